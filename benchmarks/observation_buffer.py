@@ -0,0 +1,57 @@
+import argparse
+from environment import Environment
+import numpy as np
+import time
+
+CONFIGURATIONS = {
+    "empty" : {"static_obstacles": False, "mobile_obstacles": False},
+    "static": {"static_obstacles": True, "mobile_obstacles": False},
+    "mobile": {"static_obstacles": True, "mobile_obstacles": True}
+}
+
+def legacy_observation(environment):
+    # observation construction before the preallocated buffer, kept only as the "before" reference
+    environment.relative_position = (environment.target - environment.position) / np.array(environment.grid_size)
+    local_grid = environment.get_local_grid().flatten()
+
+    return np.concatenate([environment.relative_position.astype(np.float32), local_grid.astype(np.float32)])
+
+
+def steps_per_second(environment, steps, seed):
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, 8, size=steps)
+
+    environment.reset(seed=seed)
+    start = time.perf_counter()
+
+    for action in actions:
+        _, _, terminated, truncated, _ = environment.step(action)
+
+        if terminated or truncated:
+            environment.reset()
+
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--steps', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+
+    arguments = parser.parse_args()
+
+    print(f"{'configuration':<15}{'before':>12}{'buffer':>12}{'view':>12}   (steps/s)")
+
+    for name, configuration in CONFIGURATIONS.items():
+        results = []
+
+        for mode in ("before", "buffer", "view"):
+            environment = Environment(grid_size=(15, 15), observation_view=(mode == "view"), **configuration)
+
+            if mode == "before":
+                environment.get_observation = lambda environment=environment: legacy_observation(environment)
+
+            results.append(steps_per_second(environment, arguments.steps, arguments.seed))
+
+        print(f"{name:<15}" + "".join(f"{result:>12.0f}" for result in results))
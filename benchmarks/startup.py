@@ -0,0 +1,89 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# modules that take seconds to import (torch, SB3) or are only needed to render, never imported by the cases below
+HEAVY_MODULES = ["pygame", "torch", "stable_baselines3", "cv2", "matplotlib"]
+SCRIPTS = ["evaluate.py", "regression_matrix.py", "checkpoints.py", "telemetry.py", "inference_server.py", "inference_client.py", "map_generator.py"]
+REPEATS = 5
+BUDGET = 0.5 # seconds per case, interpreter start included
+
+CASES = {
+    "import environment"  : "import environment",
+    "import evaluation"   : "import evaluation",
+    "Environment + reset" : "from environment import Environment\n"
+                            "Environment(grid_size=(15, 15), static_obstacles=True, training=False).reset(seed=0)",
+    "64 Environments"     : "from environment import Environment\n" # a batch of headless evaluation episodes
+                            "environments = [Environment(grid_size=(15, 15), static_obstacles=True, training=False) for _ in range(64)]",
+    **{f"{script} --help" : "import contextlib, io, runpy\n"
+                            f"sys.argv = [{script!r}, '--help']\n"
+                            "with contextlib.redirect_stdout(io.StringIO()):\n"
+                            f"    try: runpy.run_path({script!r}, run_name='__main__')\n"
+                            "    except SystemExit: pass" for script in SCRIPTS}
+}
+
+# run in a new interpreter, so nothing is imported yet; prints the heavy modules the case imported
+CHILD = """import sys
+{code}
+print(" ".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+def run_case(code):
+    # wall time of a whole process, as paid by a CLI call or a spawned worker
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", CHILD.format(code=code, heavy=HEAVY_MODULES)], capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+
+    return seconds, process.stdout.split()
+
+
+def run_startup(cases, repeats):
+    results = {}
+
+    for name in cases:
+        timings = [run_case(CASES[name]) for _ in range(repeats)]
+        results[name] = {"seconds": min(seconds for seconds, _ in timings), "heavy_modules": timings[0][1]}
+
+        print(f"{name:<32}{results[name]['seconds'] * 1000:>10.1f} ms   {' '.join(results[name]['heavy_modules'])}", flush=True)
+
+    return results
+
+
+def check(results, budget):
+    failures = [name for name, result in results.items() if result["seconds"] > budget or len(result["heavy_modules"]) > 0]
+
+    for name in failures:
+        print(f"| {name}: {results[name]['seconds'] * 1000:.1f} ms (budget {budget * 1000:.0f} ms), "
+              f"heavy modules imported: {', '.join(results[name]['heavy_modules']) or 'none'}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeats', type=int, default=REPEATS) # the fastest run is kept
+    parser.add_argument('--budget', type=float, default=BUDGET) # seconds, exceeded by any case: exit with status 1
+    parser.add_argument('--output', type=str, default=None) # JSON file for the results
+
+    arguments = parser.parse_args()
+
+    print(f"{'case':<32}{'time':>13}   heavy modules")
+
+    results = run_startup(arguments.cases, arguments.repeats)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump({"budget": arguments.budget, "results": results}, file, indent=2)
+
+    failures = check(results, arguments.budget)
+
+    if failures:
+        print(f"{len(failures)} cases are over the budget or import modules they do not need")
+        sys.exit(1)
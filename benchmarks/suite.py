@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # render without a window
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from benchmarks.observation_buffer import CONFIGURATIONS
+from environment import Environment
+from map_generator import make_map_source
+import numpy as np
+
+GRID_SIZES = ["15x15", "50x50", "200x200"]
+ISOLATED = ["reset", "step", "get_observation", "update_obstacles", "render"]
+END_TO_END = ["random", "PPO", "DQN"]
+REPEATS = 3
+
+def make_environment(grid_size, configuration, seed, render_mode=None):
+    # the text maps are 15x15, other sizes use generated maps
+    map_source = make_map_source("text" if grid_size == (15, 15) else "generated", grid_size, seed=seed)
+    environment = Environment(grid_size=grid_size, seed=seed, render_mode=render_mode, map_source=map_source, **CONFIGURATIONS[configuration])
+
+    if render_mode == "human":
+        environment.metadata = dict(environment.metadata, render_fps=0) # no frame rate limit
+
+    environment.reset() # the isolated benchmarks time observations, obstacles and rendering of an episode in progress
+
+    return environment
+
+
+def measure(run, duration):
+    # run(calls) returns the seconds taken; the number of calls is calibrated so each of a few rounds lasts
+    # a share of the duration (large grids can take a long time per call), and the best round is kept
+    round_duration = duration / REPEATS
+    calls = 1
+
+    while True:
+        seconds = run(calls)
+
+        if seconds >= round_duration / 10:
+            break
+
+        calls *= 10
+
+    calls = max(1, int(calls * round_duration / seconds))
+    run(calls) # warm up the map caches
+    rate = max(calls / run(calls) for _ in range(REPEATS))
+
+    return {"calls_per_second": rate, "microseconds": 1e6 / rate}
+
+
+def timed_loop(function, calls):
+    start = time.perf_counter()
+
+    for _ in range(calls):
+        function()
+
+    return time.perf_counter() - start
+
+
+def benchmark_isolated(name, environment, rng):
+    if name == "reset":
+        return lambda calls: timed_loop(environment.reset, calls)
+    if name == "get_observation":
+        return lambda calls: timed_loop(environment.get_observation, calls)
+    if name == "update_obstacles":
+        return lambda calls: timed_loop(environment.update_obstacles, calls)
+    if name == "render":
+        return lambda calls: timed_loop(environment.render, calls)
+
+    def run_steps(calls): # resets are needed between episodes, but only the steps are timed
+        seconds = 0.0
+
+        for action in rng.integers(0, 8, size=calls):
+            start = time.perf_counter()
+            _, _, terminated, truncated, _ = environment.step(action)
+            seconds += time.perf_counter() - start
+
+            if terminated or truncated:
+                environment.reset()
+
+        return seconds
+
+    return run_steps
+
+
+def benchmark_end_to_end(name, environment, rng):
+    if name == "random":
+        predict = lambda observation: rng.integers(0, 8)
+    else: # untrained models: only the cost of a forward pass matters
+        from stable_baselines3 import DQN, PPO
+
+        if name == "DQN":
+            model = DQN("MlpPolicy", environment, buffer_size=1_000, device="cpu")
+        else:
+            model = PPO("MlpPolicy", environment, device="cpu")
+
+        predict = lambda observation: model.predict(observation, deterministic=True)[0]
+
+    state = {"observation": environment.reset()[0]}
+
+    def run(calls):
+        start = time.perf_counter()
+
+        for _ in range(calls):
+            observation, _, terminated, truncated, _ = environment.step(predict(state["observation"]))
+
+            if terminated or truncated:
+                observation, _ = environment.reset()
+
+            state["observation"] = observation
+
+        return time.perf_counter() - start
+
+    return run
+
+
+def run_suite(grid_sizes, configurations, benchmarks, duration, seed):
+    results = {}
+
+    for grid_size in grid_sizes:
+        for configuration in configurations:
+            for name in benchmarks:
+                if name == "update_obstacles" and not CONFIGURATIONS[configuration]["mobile_obstacles"]:
+                    continue
+
+                environment = make_environment(grid_size, configuration, seed, render_mode="human" if name == "render" else None)
+                rng = np.random.default_rng(seed)
+
+                if name in ISOLATED:
+                    run = benchmark_isolated(name, environment, rng)
+                else:
+                    run = benchmark_end_to_end(name, environment, rng)
+
+                key = f"{name}/{configuration}/{grid_size[0]}x{grid_size[1]}"
+                results[key] = measure(run, duration)
+                environment.close()
+
+                print(f"{key:<40}{results[key]['calls_per_second']:>14.0f} calls/s{results[key]['microseconds']:>12.1f} us", flush=True)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    # a benchmark regresses when its throughput drops by more than the threshold (e.g. 0.15 for 15%)
+    regressions = []
+
+    print(f"{'benchmark':<40}{'baseline':>14}{'current':>14}{'change':>10}")
+
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        before = baseline[key]["calls_per_second"]
+        after = result["calls_per_second"]
+        change = after / before - 1
+        flag = ""
+
+        if change < -threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+
+        print(f"{key:<40}{before:>14.0f}{after:>14.0f}{change:>+10.1%}{flag}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--grid_sizes', nargs='+', default=GRID_SIZES) # e.g. 15x15 50x50
+    parser.add_argument('--configurations', nargs='+', default=list(CONFIGURATIONS), choices=list(CONFIGURATIONS))
+    parser.add_argument('--benchmarks', nargs='+', default=ISOLATED + END_TO_END, choices=ISOLATED + END_TO_END)
+    parser.add_argument('--duration', type=float, default=1.0) # seconds per benchmark
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None) # JSON file for the results
+    parser.add_argument('--baseline', type=str, default=None) # JSON file from a previous run to compare against
+    parser.add_argument('--threshold', type=float, default=0.15) # timings vary by a few percent between runs
+
+    arguments = parser.parse_args()
+
+    grid_sizes = [tuple(int(value) for value in grid_size.split("x")) for grid_size in arguments.grid_sizes]
+    results = run_suite(grid_sizes, arguments.configurations, arguments.benchmarks, arguments.duration, arguments.seed)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump({
+                "metadata": {
+                    "time"    : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python"  : platform.python_version(),
+                    "numpy"   : np.__version__,
+                    "platform": platform.platform(),
+                    "machine" : platform.machine(),
+                    "duration": arguments.duration
+                },
+                "results": results
+            }, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)["results"]
+
+        regressions = compare(results, baseline, arguments.threshold)
+
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {arguments.threshold:.0%}")
+            sys.exit(1)
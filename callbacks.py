@@ -0,0 +1,369 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from curriculum import save_curriculum
+from evaluation import run_episodes, run_snapshot_episodes, summarize
+from export_policy import policy_arrays
+import multiprocessing as mp
+import numpy as np
+import os
+from profiling import PhaseTimers, SamplingProfiler
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList
+import time
+
+class CurriculumCallback(BaseCallback):
+    # logs the curriculum statistics to TensorBoard and, with a save_freq, saves its state to JSON files (the training
+    # scripts keep it in their checkpoints instead, see AsyncCheckpointCallback)
+    def __init__(self, curriculum, save_freq=None, save_path="./models/checkpoints/", name_prefix="curriculum", verbose=0):
+        super(CurriculumCallback, self).__init__(verbose)
+
+        self.curriculum = curriculum
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+
+
+    def _init_callback(self):
+        if self.save_freq is not None:
+            os.makedirs(self.save_path, exist_ok=True)
+
+
+    def _on_step(self):
+        if self.save_freq is not None and self.n_calls % self.save_freq == 0: # same naming as the CheckpointCallback models
+            save_curriculum(self.curriculum, os.path.join(self.save_path, f"{self.name_prefix}_{self.num_timesteps}_steps.json"))
+
+        return True
+
+
+    def _on_rollout_end(self):
+        for key, value in self.curriculum.statistics().items():
+            self.logger.record(f"curriculum/{key}", value)
+
+
+class TimingCallback(CallbackList):
+    # runs the named callbacks and logs to TensorBoard the fractions of wall time spent stepping the environments,
+    # in the policy (the rest of the rollouts), in the gradient updates (between rollouts, with the log dumps) and in each callback;
+    # with profile_window=(start, steps), the stacks of that window of timesteps are sampled into log_path
+    def __init__(self, callbacks, interval=1.0, profile_window=None, log_path="./logs/"):
+        super(TimingCallback, self).__init__(list(callbacks.values()))
+
+        self.names = list(callbacks)
+        self.interval = interval # seconds, at least, between two records
+        self.profile_window = profile_window
+        self.log_path = log_path
+        self.profiler = None
+
+
+    def _init_callback(self):
+        super(TimingCallback, self)._init_callback()
+
+        self.totals = dict.fromkeys(["environment", "policy", "learner"] + self.names, 0.0)
+        self.window_start = time.perf_counter()
+        self.window_timesteps = self.model.num_timesteps
+        self.rollout_end = None
+
+        step = self.training_env.step
+        self.replaced_step = vars(self.training_env).get("step") # None when step is the method of the class
+
+        def timed_step(actions):
+            start = time.perf_counter()
+            result = step(actions)
+            self.totals["environment"] += time.perf_counter() - start
+
+            return result
+
+        self.training_env.step = timed_step # the environment the model steps, whatever its wrappers
+
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+
+        if self.rollout_end is not None:
+            self.totals["learner"] += now - self.rollout_end
+
+            if now - self.window_start >= self.interval: # DQN rollouts are only a few steps long
+                self.record(now)
+
+        self.rollout_start = now
+        self.rollout_measured = self.measured()
+
+        super(TimingCallback, self)._on_rollout_start()
+
+
+    def _on_step(self):
+        continue_training = True
+
+        for name, callback in zip(self.names, self.callbacks):
+            start = time.perf_counter()
+            continue_training = callback.on_step() and continue_training
+            self.totals[name] += time.perf_counter() - start
+
+        if self.profile_window is not None:
+            self.update_profiler()
+
+        return continue_training
+
+
+    def _on_rollout_end(self):
+        super(TimingCallback, self)._on_rollout_end()
+
+        self.rollout_end = time.perf_counter()
+        self.totals["policy"] += (self.rollout_end - self.rollout_start) - (self.measured() - self.rollout_measured)
+
+
+    def _on_training_end(self):
+        super(TimingCallback, self)._on_training_end()
+
+        # the environment steps untimed again, and a later learn call does not time it twice
+        if self.replaced_step is not None:
+            self.training_env.step = self.replaced_step
+        else:
+            del self.training_env.step
+
+        if self.profiler is not None:
+            self.stop_profiler()
+
+
+    def measured(self):
+        return self.totals["environment"] + sum(self.totals[name] for name in self.names)
+
+
+    def record(self, now):
+        elapsed = now - self.window_start
+
+        for name, total in self.totals.items():
+            self.logger.record(f"timing/{name}_fraction", total / elapsed)
+
+        self.logger.record("timing/steps_per_second", (self.num_timesteps - self.window_timesteps) / elapsed)
+
+        environment_timers = PhaseTimers() # over every environment or worker, repeated for the environments they hold
+
+        for timers in {id(timers): timers for timers in self.training_env.get_attr("timers") if timers is not None}.values():
+            environment_timers.merge(timers)
+
+        for phase, microseconds in environment_timers.mean_microseconds().items():
+            self.logger.record(f"timing/environment/{phase}_us", microseconds)
+
+        self.totals = dict.fromkeys(self.totals, 0.0)
+        self.window_start = now
+        self.window_timesteps = self.num_timesteps
+
+
+    def update_profiler(self):
+        start, steps = self.profile_window
+
+        if self.profiler is None and start <= self.num_timesteps < start + steps:
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+            self.profile_start = self.num_timesteps
+        elif self.profiler is not None and self.num_timesteps >= start + steps:
+            self.stop_profiler()
+            self.profile_window = None
+
+
+    def stop_profiler(self):
+        self.profiler.stop()
+
+        os.makedirs(self.log_path, exist_ok=True)
+        path = os.path.join(self.log_path, f"profile_{self.profile_start}_{self.num_timesteps}.collapsed")
+        self.profiler.write(path)
+        self.profiler = None
+
+        print(f"Sampled profile written to {path}")
+
+
+class AsyncEvalCallback(BaseCallback):
+    # evaluates snapshots of the policy weights in other processes (with NumPy, see numpy_policy.py) while the training
+    # goes on; results are handled in the order of the snapshots as they come back: evaluations.npz, eval/ logs and
+    # best_model, saved with the weights of the snapshot rather than the current ones
+    def __init__(self, environment_kwargs, eval_freq, n_eval_episodes=20, seed=42, best_model_save_path="./models/", log_path="./logs/",
+                 workers=1, map_count=None, batch_size=64, verbose=1):
+        super(AsyncEvalCallback, self).__init__(verbose)
+
+        self.environment_kwargs = environment_kwargs
+        self.eval_freq = eval_freq
+        self.seed = seed # the same episodes at every evaluation
+        self.best_model_save_path = best_model_save_path
+        self.log_path = log_path
+        self.workers = workers
+        self.map_count = map_count # episodes spread evenly over the testing maps
+        self.batch_size = batch_size
+
+        if map_count is not None:
+            n_eval_episodes = -(-n_eval_episodes // map_count) * map_count
+
+        self.episodes = np.array_split(np.arange(n_eval_episodes), min(workers, n_eval_episodes))
+        self.executor = None
+        self.pending = deque() # (timesteps, futures, policy weights)
+
+        self.evaluations = {"timesteps": [], "results": [], "ep_lengths": [], "successes": []}
+        self.best_mean_reward = -np.inf
+        self.last_mean_reward = None
+
+
+    def _init_callback(self):
+        for path in (self.best_model_save_path, self.log_path):
+            if path is not None:
+                os.makedirs(path, exist_ok=True)
+
+
+    def _on_step(self):
+        if self.n_calls % self.eval_freq == 0:
+            self.submit()
+
+        if len(self.pending) > 0 and all(future.done() for future in self.pending[0][1]):
+            self.collect()
+
+        return True
+
+
+    def _on_training_end(self):
+        while len(self.pending) > 0: # the last evaluations are waited for
+            self.collect()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+    def submit(self):
+        if self.executor is None: # forked at the first evaluation, the workers only run NumPy
+            context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+            self.executor = ProcessPoolExecutor(len(self.episodes), mp_context=context)
+
+        arrays = policy_arrays(self.model)
+        weights = {name: parameter.detach().clone() for name, parameter in self.model.policy.state_dict().items()}
+        futures = [self.executor.submit(run_snapshot_episodes, arrays, list(episodes), self.seed, self.environment_kwargs,
+                                        self.batch_size, self.map_count) for episodes in self.episodes]
+
+        self.pending.append((self.num_timesteps, futures, weights))
+
+
+    def collect(self):
+        timesteps, futures, weights = self.pending.popleft()
+        results = sorted([episode for future in futures for episode in future.result()], key=lambda episode: episode["episode"])
+
+        rewards = [episode["reward"] for episode in results]
+        lengths = [episode["steps"] for episode in results]
+        successes = [episode["outcome"] == "success" for episode in results]
+
+        self.evaluations["timesteps"].append(timesteps)
+        self.evaluations["results"].append(rewards)
+        self.evaluations["ep_lengths"].append(lengths)
+        self.evaluations["successes"].append(successes)
+
+        if self.log_path is not None: # same file as EvalCallback
+            np.savez(os.path.join(self.log_path, "evaluations"), **self.evaluations)
+
+        mean_reward = self.last_mean_reward = float(np.mean(rewards))
+
+        if self.verbose >= 1:
+            print(f"Eval num_timesteps={timesteps}, episode_reward={mean_reward:.2f} +/- {np.std(rewards):.2f}, success rate {np.mean(successes):.2f}")
+
+        self.logger.record("eval/mean_reward", mean_reward)
+        self.logger.record("eval/mean_ep_length", float(np.mean(lengths)))
+        self.logger.record("eval/success_rate", float(np.mean(successes)))
+
+        if self.map_count is not None:
+            for name, entry in summarize(results)["maps"].items():
+                self.logger.record(f"eval/maps/{name}", entry["successes"] / entry["episodes"])
+
+        self.logger.dump(timesteps) # at the timesteps of the snapshot
+
+        if mean_reward > self.best_mean_reward:
+            if self.verbose >= 1:
+                print("New best mean reward!")
+
+            if self.best_model_save_path is not None:
+                self.save_snapshot(weights, os.path.join(self.best_model_save_path, "best_model"))
+
+            self.best_mean_reward = mean_reward
+
+
+    def save_snapshot(self, weights, path):
+        current = {name: parameter.detach().clone() for name, parameter in self.model.policy.state_dict().items()}
+
+        self.model.policy.load_state_dict(weights)
+        self.model.save(path)
+        self.model.policy.load_state_dict(current)
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    # saves a checkpoint (model, optimizer, replay buffer, curriculum and random states, see checkpoints.py) every
+    # save_freq calls and at the end of the training; the files are written in the background while the training goes
+    # on. The score of a checkpoint, to keep the best one, is the last mean reward of the evaluation callback
+    def __init__(self, store, save_freq, curriculum=None, evaluation=None, verbose=0):
+        super(AsyncCheckpointCallback, self).__init__(verbose)
+
+        self.store = store
+        self.save_freq = save_freq
+        self.curriculum = curriculum
+        self.evaluation = evaluation
+        self.saved_timesteps = None
+
+
+    def _on_step(self):
+        if self.n_calls % self.save_freq == 0:
+            self.save()
+
+        return True
+
+
+    def _on_training_end(self):
+        if self.saved_timesteps != self.num_timesteps:
+            self.save()
+
+        self.store.wait() # the last checkpoint is complete when learn returns
+
+
+    def save(self):
+        score = self.evaluation.last_mean_reward if self.evaluation is not None else None
+        start = time.perf_counter()
+
+        self.store.save(self.model, self.curriculum, score)
+        self.saved_timesteps = self.num_timesteps
+
+        if self.verbose >= 1:
+            print(f"Checkpoint of {self.num_timesteps} timesteps taken in {time.perf_counter() - start:.3f}s, written in the background")
+
+
+class TrialEvalCallback(BaseCallback):
+    # evaluates the policy in the training process (sweep trials already run in parallel), reports the mean reward to
+    # a pruner (see sweep.py) and stops the training once the pruner finds the trial worse than the others
+    def __init__(self, environment_kwargs, eval_freq, pruner, trial, n_eval_episodes=20, seed=42, map_count=None, batch_size=64, verbose=0):
+        super(TrialEvalCallback, self).__init__(verbose)
+
+        self.environment_kwargs = environment_kwargs
+        self.eval_freq = eval_freq
+        self.pruner = pruner
+        self.trial = trial
+        self.seed = seed
+        self.map_count = map_count
+        self.batch_size = batch_size
+
+        if map_count is not None:
+            n_eval_episodes = -(-n_eval_episodes // map_count) * map_count
+
+        self.episodes = list(range(n_eval_episodes))
+        self.rewards = []
+        self.success_rates = []
+        self.pruned = False
+
+
+    def _on_step(self):
+        if self.n_calls % self.eval_freq != 0:
+            return True
+
+        results = run_episodes(self.model, self.episodes, self.seed, self.environment_kwargs, self.batch_size, self.map_count)
+        mean_reward = float(np.mean([episode["reward"] for episode in results]))
+
+        self.rewards.append(mean_reward)
+        self.success_rates.append(float(np.mean([episode["outcome"] == "success" for episode in results])))
+        self.logger.record("eval/mean_reward", mean_reward)
+        self.logger.record("eval/success_rate", self.success_rates[-1])
+
+        if self.verbose >= 1:
+            print(f"Trial {self.trial}: num_timesteps={self.num_timesteps}, episode_reward={mean_reward:.2f}")
+
+        self.pruned = self.pruner.report(self.trial, len(self.rewards) - 1, mean_reward)
+
+        return not self.pruned
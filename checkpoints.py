@@ -0,0 +1,366 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from curriculum import load_curriculum
+import json
+import numpy as np
+import os
+import pickle
+import random
+import shutil
+
+CHECKPOINTS_DIRECTORY = "models/checkpoints/"
+MANIFEST = "manifest.json"
+PRIORITIES = "priorities.npz"
+CHUNK_SLOTS = 16384 # replay buffer slots per chunk file
+TRUNCATED = ("truncated_keys", "truncated_positions", "truncated_windows") # next observations of truncated episodes in a chunk
+
+def ring_arrays(buffer):
+    # the arrays of a replay buffer indexed by slot
+    return {name: value for name, value in vars(buffer).items() if isinstance(value, np.ndarray) and value.ndim > 0 and len(value) == buffer.buffer_size}
+
+
+def priority_leaves(buffer):
+    # the priorities of the transitions in the sum tree of a PrioritizedReplayBuffer, the rest of the tree is their sums
+    tree = buffer.tree
+
+    return tree.nodes[tree.capacity:tree.capacity + buffer.buffer_size * buffer.n_envs]
+
+
+def truncated_chunks(buffer, chunks, chunk_slots):
+    # the entries of CompactReplayBuffer.truncated_observations (keyed by slot * n_envs + env) of each chunk, as arrays;
+    # they only change with the slots written, so they are saved incrementally with the chunks
+    keys = np.fromiter(buffer.truncated_observations.keys(), dtype=np.int64, count=len(buffer.truncated_observations))
+    values = list(buffer.truncated_observations.values())
+    chunk_of = keys // (buffer.n_envs * chunk_slots)
+    arrays = {}
+
+    for index in chunks:
+        selected = np.flatnonzero(chunk_of == index)
+        arrays[index] = {
+            "truncated_keys"     : keys[selected],
+            "truncated_positions": np.array([values[i][0] for i in selected], dtype=buffer.positions.dtype).reshape(-1, 2),
+            "truncated_windows"  : np.array([values[i][1] for i in selected], dtype=buffer.windows.dtype).reshape(-1, buffer.windows.shape[2])
+        }
+
+    return arrays
+
+
+def list_checkpoints(directory):
+    # (path, manifest) of the complete checkpoints (those with a manifest), oldest first
+    checkpoints = []
+
+    if not os.path.isdir(directory):
+        return checkpoints
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+
+        if name.startswith("step_") and os.path.isfile(os.path.join(path, MANIFEST)):
+            with open(os.path.join(path, MANIFEST)) as file:
+                checkpoints.append((path, json.load(file)))
+
+    return sorted(checkpoints, key=lambda checkpoint: checkpoint[1]["timesteps"])
+
+
+class CheckpointStore:
+    # a checkpoint is a directory named after its timesteps, holding the SB3 model (weights, optimizer and
+    # hyperparameters), the curriculum state, the random states and a manifest (timesteps, score, environment steps,
+    # replay buffer layout). The replay buffer is split into chunks of slots stored next to the checkpoints and shared
+    # by them: a save only writes the chunks changed since the previous one. Saves copy what they need on the training
+    # thread, then compress and write everything in a background thread; the last keep checkpoints and the best one are kept
+    def __init__(self, directory=CHECKPOINTS_DIRECTORY, keep=3, chunk_slots=CHUNK_SLOTS):
+        self.directory = directory
+        self.buffer_directory = os.path.join(directory, "replay_buffer")
+        self.keep = keep
+        self.chunk_slots = chunk_slots
+
+        self.executor = ThreadPoolExecutor(1) # one save at a time, in order
+        self.pending = None
+        self.buffer_state = None # (buffer, timesteps, position, chunk files) of the last replay buffer saved or loaded
+
+
+    def checkpoints(self):
+        return list_checkpoints(self.directory)
+
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+
+        return checkpoints[-1][0] if len(checkpoints) > 0 else None
+
+
+    def save(self, model, curriculum=None, score=None):
+        self.wait() # bounds the memory to one snapshot, and raises the errors of the previous save
+        self.pending = self.executor.submit(self.write, self.snapshot(model, curriculum, score))
+
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+    def snapshot(self, model, curriculum, score):
+        # everything the training would modify is copied here, the rest is done by write
+        from stable_baselines3.common.save_util import recursive_getattr # torch is only imported with a model, not to list checkpoints
+        import torch
+
+        environment = model.get_env()
+
+        # the same content as BaseAlgorithm.save
+        state_dicts_names, torch_variable_names = model._get_torch_save_params()
+        exclude = set(model._excluded_save_params()) | {name.split(".")[0] for name in state_dicts_names + torch_variable_names}
+        data = copy.deepcopy({name: value for name, value in model.__dict__.items() if name not in exclude})
+        pytorch_variables = {name: copy.deepcopy(recursive_getattr(model, name)) for name in torch_variable_names}
+
+        snapshot = {
+            "name"             : f"step_{model.num_timesteps}",
+            "data"             : data,
+            "params"           : copy.deepcopy(model.get_parameters()), # weights and optimizer states
+            "pytorch_variables": pytorch_variables,
+            "curriculum"       : None if curriculum is None else {"curriculum": curriculum.name, "state": copy.deepcopy(curriculum.state_dict())},
+            "manifest"         : {
+                "timesteps"    : int(model.num_timesteps),
+                "score"        : None if score is None else float(score),
+                "total_steps"  : int(environment.env_method("get_curriculum_steps")[0]), # steps seen by the curriculum
+                "replay_buffer": None
+            },
+            "state"            : {
+                "python"      : random.getstate(),
+                "numpy"       : np.random.get_state(),
+                "torch"       : torch.get_rng_state(),
+                "cuda"        : torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                "environments": [generator.bit_generator.state for generator in environment.get_attr("np_random")],
+                "buffer"      : None
+            },
+            "chunks"           : {},
+            "priorities"       : None
+        }
+
+        buffer = getattr(model, "replay_buffer", None)
+
+        if buffer is not None:
+            self.snapshot_buffer(snapshot, buffer, model.num_timesteps)
+
+        return snapshot
+
+
+    def snapshot_buffer(self, snapshot, buffer, timesteps):
+        # arrays indexed by slot are saved by chunks with the truncated observations, the priorities of a sum tree as its
+        # leaves, and the rest of the buffer (position, sampling parameters...) as a whole
+        rings = ring_arrays(buffer)
+        chunks = self.changed_chunks(buffer, timesteps)
+        files = dict(self.buffer_state[3]) if chunks is not None else {}
+
+        if chunks is None: # everything written so far
+            written = buffer.buffer_size if buffer.full else buffer.pos + 1
+            chunks = range(-(-min(written, buffer.buffer_size) // self.chunk_slots))
+
+        truncated = truncated_chunks(buffer, chunks, self.chunk_slots) if isinstance(getattr(buffer, "truncated_observations", None), dict) else {}
+
+        for index in chunks:
+            files[str(index)] = f"{snapshot['name']}_chunk_{index}.npz"
+            snapshot["chunks"][files[str(index)]] = {name: array[index * self.chunk_slots:(index + 1) * self.chunk_slots].copy() for name, array in rings.items()}
+            snapshot["chunks"][files[str(index)]].update(truncated.get(index, {}))
+
+        if hasattr(buffer, "tree"): # sampled priorities change anywhere in the buffer, so they are saved whole
+            snapshot["priorities"] = priority_leaves(buffer).copy()
+
+        snapshot["manifest"]["replay_buffer"] = {
+            "class"      : type(buffer).__name__,
+            "buffer_size": int(buffer.buffer_size),
+            "n_envs"     : int(buffer.n_envs),
+            "position"   : int(buffer.pos),
+            "chunk_slots": self.chunk_slots,
+            "arrays"     : {name: [list(array.shape), array.dtype.str] for name, array in rings.items()},
+            "chunks"     : files
+        }
+        snapshot["state"]["buffer"] = copy.deepcopy({name: value for name, value in vars(buffer).items() if name not in rings and name not in ("tree", "truncated_observations")})
+
+        self.buffer_state = (buffer, int(timesteps), int(buffer.pos), files)
+
+
+    def changed_chunks(self, buffer, timesteps):
+        # chunks holding the slots written since the last save (every step adds one slot and may overwrite the next
+        # one), or None when the whole buffer has to be saved
+        if self.buffer_state is None or self.buffer_state[0] is not buffer:
+            return None
+
+        _, saved_timesteps, position, _ = self.buffer_state
+        adds = (timesteps - saved_timesteps) // buffer.n_envs
+
+        if adds < 0 or adds + 1 >= buffer.buffer_size: # a new training, or the buffer went all the way around
+            return None
+
+        slots = (position + np.arange(adds + 1)) % buffer.buffer_size
+
+        return np.unique(slots // self.chunk_slots).tolist()
+
+
+    def write(self, snapshot):
+        from stable_baselines3.common.save_util import save_to_zip_file
+
+        path = os.path.join(self.directory, snapshot["name"])
+        temporary = path + ".tmp"
+
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        os.makedirs(self.buffer_directory, exist_ok=True)
+
+        for name, arrays in snapshot["chunks"].items():
+            np.savez_compressed(os.path.join(self.buffer_directory, name), **arrays)
+
+        if snapshot["priorities"] is not None:
+            np.savez_compressed(os.path.join(temporary, PRIORITIES), priorities=snapshot["priorities"])
+
+        save_to_zip_file(os.path.join(temporary, "model.zip"), data=snapshot["data"], params=snapshot["params"], pytorch_variables=snapshot["pytorch_variables"])
+
+        with open(os.path.join(temporary, "state.pkl"), "wb") as file:
+            pickle.dump(snapshot["state"], file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if snapshot["curriculum"] is not None: # same file as save_curriculum
+            with open(os.path.join(temporary, "curriculum.json"), "w") as file:
+                json.dump(snapshot["curriculum"], file)
+
+        with open(os.path.join(temporary, MANIFEST), "w") as file: # written last: a checkpoint without it is incomplete
+            json.dump(snapshot["manifest"], file, indent=4)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary, path)
+
+        self.prune()
+
+
+    def prune(self):
+        checkpoints = self.checkpoints()
+        kept = checkpoints[-self.keep:] if self.keep > 0 else []
+        scored = [checkpoint for checkpoint in checkpoints if checkpoint[1]["score"] is not None]
+
+        if len(scored) > 0:
+            kept.append(max(scored, key=lambda checkpoint: checkpoint[1]["score"]))
+
+        kept_paths = {path for path, _ in kept}
+
+        for path, _ in checkpoints:
+            if path not in kept_paths:
+                shutil.rmtree(path, ignore_errors=True)
+
+        referenced = {file for _, manifest in kept if manifest["replay_buffer"] is not None for file in manifest["replay_buffer"]["chunks"].values()}
+
+        for file in os.listdir(self.buffer_directory):
+            if file not in referenced:
+                os.remove(os.path.join(self.buffer_directory, file))
+
+
+    def load(self, algorithm, env, curriculum=None, path=None, custom_objects=None, **kwargs):
+        # the latest checkpoint by default; the environments restart their episodes, everything else continues as saved
+        import torch
+
+        path = path or self.latest()
+
+        with open(os.path.join(path, MANIFEST)) as file:
+            manifest = json.load(file)
+
+        with open(os.path.join(path, "state.pkl"), "rb") as file:
+            state = pickle.load(file)
+
+        model = algorithm.load(os.path.join(path, "model.zip"), env=env, custom_objects=custom_objects, **kwargs)
+        environment = model.get_env()
+
+        if manifest["replay_buffer"] is not None and getattr(model, "replay_buffer", None) is not None:
+            self.load_buffer(model.replay_buffer, manifest, state["buffer"], path)
+
+        if curriculum is not None and os.path.exists(os.path.join(path, "curriculum.json")):
+            load_curriculum(curriculum, os.path.join(path, "curriculum.json"))
+
+        environment.env_method("set_curriculum_steps", manifest["total_steps"])
+
+        if environment.env_method("get_curriculum_steps")[0] != manifest["total_steps"]: # the curriculum would start over
+            raise RuntimeError(f"the environment's step counter was not restored to {manifest['total_steps']}")
+
+        random.setstate(state["python"])
+        np.random.set_state(state["numpy"])
+        torch.set_rng_state(state["torch"])
+
+        if state["cuda"] is not None and torch.cuda.is_available() and len(state["cuda"]) == torch.cuda.device_count():
+            torch.cuda.set_rng_state_all(state["cuda"])
+
+        if len(state["environments"]) == environment.num_envs:
+            for i, generator_state in enumerate(state["environments"]):
+                generator = np.random.Generator(getattr(np.random, generator_state["bit_generator"])())
+                generator.bit_generator.state = generator_state
+                environment.set_attr("np_random", generator, indices=[i])
+
+        return model
+
+
+    def load_buffer(self, buffer, manifest, buffer_state, path):
+        from stable_baselines3.common.utils import get_device
+
+        layout = manifest["replay_buffer"]
+        rings = ring_arrays(buffer)
+        shapes = {name: [list(array.shape), array.dtype.str] for name, array in rings.items()}
+
+        if layout["class"] != type(buffer).__name__ or layout["arrays"] != shapes:
+            print(f"The replay buffer of the checkpoint ({layout['class']}, {layout['buffer_size']} slots of {layout['n_envs']} environments) "
+                  f"does not match the model's: starting with an empty one")
+            return
+
+        buffer_state = dict(buffer_state)
+        truncated = {}
+
+        for index, file in layout["chunks"].items():
+            start = int(index) * layout["chunk_slots"]
+
+            with np.load(os.path.join(self.buffer_directory, file)) as chunk:
+                for name in chunk.files:
+                    if name not in TRUNCATED:
+                        rings[name][start:start + len(chunk[name])] = chunk[name]
+
+                if "truncated_keys" in chunk.files:
+                    truncated.update(zip(chunk["truncated_keys"].tolist(), zip(chunk["truncated_positions"], chunk["truncated_windows"])))
+
+        if hasattr(buffer, "truncated_observations") and "truncated_observations" not in buffer_state: # older checkpoints pickled them
+            buffer_state["truncated_observations"] = truncated
+
+        if hasattr(buffer, "tree") and os.path.exists(os.path.join(path, PRIORITIES)):
+            with np.load(os.path.join(path, PRIORITIES)) as priorities:
+                priority_leaves(buffer)[:] = priorities["priorities"]
+
+            buffer.tree.rebuild()
+
+        buffer_state["device"] = get_device(buffer.device) # the checkpoint may come from another machine
+        vars(buffer).update(buffer_state)
+
+        # saves continue incrementally from this checkpoint, with its chunk size
+        self.chunk_slots = layout["chunk_slots"]
+        self.buffer_state = (buffer, manifest["timesteps"], layout["position"], layout["chunks"])
+
+
+def describe(store):
+    for path, manifest in store.checkpoints():
+        buffer = manifest["replay_buffer"]
+        files = [os.path.join(path, name) for name in os.listdir(path)]
+        size = sum(os.path.getsize(file) for file in files)
+
+        if buffer is not None:
+            size += sum(os.path.getsize(os.path.join(store.buffer_directory, file)) for file in buffer["chunks"].values())
+
+        print(f"{os.path.basename(path)}: {manifest['timesteps']} timesteps, score {manifest['score']}, {size / 1e6:.1f} MB"
+              + ("" if buffer is None else f" with the replay buffer chunks it uses (at slot {buffer['position']})"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--directory', type=str, default=CHECKPOINTS_DIRECTORY)
+
+    arguments = parser.parse_args()
+
+    describe(CheckpointStore(arguments.directory))
@@ -0,0 +1,189 @@
+from collections import deque
+import json
+import numpy as np
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+OUTCOMES = ["success", "collision", "truncation"]
+
+class Curriculum:
+    # picks the difficulty and the maps of training episodes from their outcomes; the decisions are kept in
+    # self.schedule, which is all the parallel workers need from the curriculum of the main process
+    name = None
+
+    def __init__(self):
+        self.schedule = {}
+
+
+    def select_difficulty(self, np_random, total_steps):
+        raise NotImplementedError
+
+
+    def map_weights(self, maps):
+        return None # every map of the difficulty is equally likely
+
+
+    def record(self, difficulty, map_name, outcome):
+        pass
+
+
+    def statistics(self):
+        return {}
+
+
+    def state_dict(self):
+        return {"schedule": self.schedule}
+
+
+    def load_state_dict(self, state):
+        self.schedule = state["schedule"]
+
+
+class StepCurriculum(Curriculum):
+    # harder maps after a fixed number of steps (the original schedule)
+    name = "steps"
+
+    def __init__(self, thresholds=(3_000_000, 5_000_000), difficulties=DIFFICULTIES):
+        super(StepCurriculum, self).__init__()
+
+        self.thresholds = thresholds
+        self.difficulties = difficulties
+
+
+    def select_difficulty(self, np_random, total_steps):
+        for threshold, difficulty in zip(self.thresholds, self.difficulties):
+            if total_steps < threshold:
+                return difficulty
+
+        return self.difficulties[-1]
+
+
+class SuccessRateCurriculum(Curriculum):
+    # moves to the next difficulty once the rolling success rate on the current one reaches promotion_rate;
+    # a review fraction of the episodes revisits earlier difficulties, and maps with lower success rates are drawn more often
+    name = "success"
+
+    def __init__(self, difficulties=DIFFICULTIES, window=200, map_window=50, promotion_rate=0.8, review=0.2, map_floor=0.1, update_interval=20):
+        super(SuccessRateCurriculum, self).__init__()
+
+        self.difficulties = difficulties
+        self.window = window
+        self.map_window = map_window
+        self.promotion_rate = promotion_rate
+        self.review = review
+        self.map_floor = map_floor
+        self.update_interval = update_interval # episodes between schedule updates, so workers are rarely sent a new one
+
+        self.results = {difficulty: deque(maxlen=window) for difficulty in difficulties} # outcome indices
+        self.map_results = {}
+        self.pending_episodes = 0
+        self.schedule = {"level": 0, "map_weights": {}}
+
+
+    def select_difficulty(self, np_random, total_steps):
+        level = self.schedule["level"]
+
+        if level > 0 and np_random.random() < self.review:
+            return self.difficulties[np_random.integers(0, level)]
+
+        return self.difficulties[level]
+
+
+    def map_weights(self, maps):
+        weights = self.schedule["map_weights"]
+
+        return np.array([weights.get(map.name, 1.0) for map in maps])
+
+
+    def record(self, difficulty, map_name, outcome):
+        if difficulty not in self.results:
+            return
+
+        self.results[difficulty].append(OUTCOMES.index(outcome))
+        self.map_results.setdefault(map_name, deque(maxlen=self.map_window)).append(outcome == "success")
+        self.pending_episodes += 1
+
+        if self.pending_episodes >= self.update_interval:
+            self.update()
+
+
+    def rate(self, results, outcome):
+        return sum(result == OUTCOMES.index(outcome) for result in results) / max(len(results), 1)
+
+
+    def update(self):
+        self.pending_episodes = 0
+        level = self.schedule["level"]
+        current = self.results[self.difficulties[level]]
+
+        if (level < len(self.difficulties) - 1 and len(current) == self.window and
+            self.rate(current, "success") >= self.promotion_rate):
+            level += 1
+
+        self.schedule = {
+            "level"      : level,
+            "map_weights": {name: round(max(1 - np.mean(results), self.map_floor), 2) for name, results in self.map_results.items()}
+        }
+
+
+    def statistics(self):
+        statistics = {"level": self.schedule["level"]}
+
+        for difficulty, results in self.results.items():
+            if len(results) > 0:
+                statistics[f"success_rate/{difficulty}"] = self.rate(results, "success")
+                statistics[f"collision_rate/{difficulty}"] = self.rate(results, "collision")
+
+        return statistics
+
+
+    def state_dict(self):
+        return {
+            "schedule"        : self.schedule,
+            "results"         : {difficulty: list(results) for difficulty, results in self.results.items()},
+            "map_results"     : {name: [bool(result) for result in results] for name, results in self.map_results.items()},
+            "pending_episodes": self.pending_episodes
+        }
+
+
+    def load_state_dict(self, state):
+        self.schedule = state["schedule"]
+        self.results = {difficulty: deque(state["results"].get(difficulty, []), maxlen=self.window) for difficulty in self.difficulties}
+        self.map_results = {name: deque(results, maxlen=self.map_window) for name, results in state["map_results"].items()}
+        self.pending_episodes = state["pending_episodes"]
+
+
+CURRICULA = {
+    "steps"  : StepCurriculum,
+    "success": SuccessRateCurriculum
+}
+
+def make_curriculum(curriculum):
+    if isinstance(curriculum, Curriculum):
+        return curriculum
+
+    return CURRICULA[curriculum or "steps"]()
+
+
+def choose_maps(curriculum, np_random, maps, size):
+    weights = curriculum.map_weights(maps)
+
+    if weights is None:
+        return np_random.integers(0, len(maps), size=size)
+
+    return np_random.choice(len(maps), size=size, p=weights / weights.sum())
+
+
+def save_curriculum(curriculum, path):
+    with open(path, "w") as file:
+        json.dump({"curriculum": curriculum.name, "state": curriculum.state_dict()}, file)
+
+
+def load_curriculum(curriculum, path):
+    with open(path) as file:
+        saved = json.load(file)
+
+    if saved["curriculum"] != curriculum.name:
+        print(f"Curriculum in {path} is \"{saved['curriculum']}\", not \"{curriculum.name}\": starting a new one")
+        return
+
+    curriculum.load_state_dict(saved["state"])
@@ -1,47 +1,83 @@
 import gymnasium as gym
 from gymnasium import spaces
+from curriculum import choose_maps, make_curriculum
 import numpy as np
-import pygame
-
-UAV_VISION = 5
-INITIAL_STEPS = 0 # based on the previous training of the current model
+from map_registry import get_registry
+from obstacle_motion import make_motion_policy, move_obstacles
+from profiling import ENVIRONMENT_PHASES, instrument
+from reachability import get_reachability
+from telemetry import make_recorder
+from vision import CoarseView, summed_area_table, vision_margin
+
+UAV_VISION = 5 # default size of the vision window
 MAX_WINDOW_SIZE = 600
 PANEL_HEIGHT = 50
 MAPS = 8
+MOVES = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
 
 class Environment(gym.Env):
     metadata = {
-        "render_modes": ["human", "ansi"],
+        "render_modes": ["human", "rgb_array", "ansi"],
         "render_fps": 10
     }
 
-    def __init__(self, grid_size=(10, 10), static_obstacles=False, mobile_obstacles=False, training=True, seed=None, render_mode=None):
+    def __init__(self, grid_size=(10, 10), static_obstacles=False, mobile_obstacles=False, training=True, seed=None, render_mode=None, observation_view=False, obstacle_motion="random", map_source=None, curriculum=None, telemetry=None, profile=False, vision=UAV_VISION, coarse_vision=0, coarse_pooling=3):
         super(Environment, self).__init__()
 
         self.grid_size = grid_size # (height, width) or (rows, columns)
 
         self.action_space = spaces.Discrete(8)
-        self.moves = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-        self.observation_space = spaces.Box(low=-1.0, high=1.0, shape=(2 + UAV_VISION * UAV_VISION,), dtype=np.float32)
+        self.moves = MOVES
+        self.move_vectors = np.array(MOVES)
+
+        # vision x vision window around the UAV, then optionally a coarse_vision x coarse_vision summary of a larger area
+        # (see vision.py); the walls around the map are as thick as the largest of the two needs
+        self.vision = vision
+        self.margin = vision_margin(vision, coarse_vision, coarse_pooling)
+        self.coarse_view = CoarseView(coarse_vision, coarse_pooling, grid_size[1] + 2 * self.margin) if coarse_vision > 0 else None
+        self.observation_space = spaces.Box(low=-1.0, high=1.0, shape=(2 + vision * vision + coarse_vision * coarse_vision,), dtype=np.float32)
 
         self.static_obstacles = static_obstacles
         self.mobile_obstacles = mobile_obstacles
         self.training = training
-
-        self.total_steps = INITIAL_STEPS
-        self.reset(seed)
+        self.text_maps = map_source is None
+        self.map_source = map_source if map_source is not None else get_registry() # text maps, or generated ones (see map_generator.py)
+        self.curriculum = make_curriculum(curriculum) # difficulty of the training maps, see curriculum.py
+        self.obstacle_motion = make_motion_policy(obstacle_motion, self.move_vectors) # random walk, patrol or waypoint loop
+
+        # observations are written into this buffer instead of allocating new arrays every step
+        self.observation_view = observation_view # return the buffer itself, for callers that copy it anyway
+        self.observation = np.zeros(self.observation_space.shape, dtype=np.float32)
+        self.observation_window = self.observation[2:2 + vision * vision].reshape(vision, vision)
+        self.coarse_observation = self.observation[2 + vision * vision:]
+        self.relative_position = np.zeros(2)
+        self.grid_dimensions = np.array(self.grid_size)
+
+        self.total_steps = 0 # set by the training scripts when a training continues, see checkpoints.py
+        self.empty_grid = None
+        self.empty_table = None
+        super().reset(seed=seed) # only seeds np_random: the first episode starts with the first call to reset
+
+        self.telemetry = make_recorder(telemetry) # None, or the path of the file recording the episodes (see telemetry.py)
+        self.telemetry_episode = None
+        self.timers = instrument(self, ENVIRONMENT_PHASES) if profile else None # per-method wall time, see profiling.py
 
         self.render_mode = render_mode
-        self.cell_size = MAX_WINDOW_SIZE / max(grid_size[0], grid_size[1])
-        window_height = self.grid_size[0] * self.cell_size + PANEL_HEIGHT
-        window_width = self.grid_size[1] * self.cell_size
+        self.renderer = None
+        self.render_static = True
+
+        if self.render_mode in ("human", "rgb_array"): # frames drawn into a NumPy buffer, see renderer.py
+            from renderer import Renderer # pygame is only imported to render
+
+            self.renderer = Renderer(self.grid_size, self.vision, MAX_WINDOW_SIZE, PANEL_HEIGHT)
 
         if self.render_mode == "human":
+            import pygame
+
             pygame.init()
-            self.screen = pygame.display.set_mode((window_width, window_height))
+            self.screen = pygame.display.set_mode(self.renderer.size)
             pygame.display.set_caption("UAV Path Finding")
             self.clock = pygame.time.Clock()
-            self.font = pygame.font.SysFont("Ubuntu", 20)
 
 
     def reset(self, seed=None, options=None):
@@ -49,94 +85,97 @@ class Environment(gym.Env):
 
         self.current_steps = 0
 
-        self.margin = UAV_VISION // 2
-        self.grid = self.reset_grid()
-
         self.grid_coordinates = {
             "first" : np.array([self.margin, self.margin]),
             "last"  : np.array([self.margin + self.grid_size[0] - 1, self.margin + self.grid_size[1] - 1])
         }
 
+        self.map = None
         self.danger_coordinates = []
+        self.free_space = self.grid_size[0] * self.grid_size[1]
+
+        options = options or {}
 
         if self.static_obstacles:
-            self.place_static_obstacles()
+            self.place_static_obstacles(options.get("map_id")) # a given map, e.g. to evaluate every testing map
+        else:
+            self.grid = self.reset_grid()
 
         if self.mobile_obstacles:
             self.place_mobile_obstacles()
 
         self.reset_position_and_target()
+        self.render_static = True
 
-        return self.get_observation(), {}
+        if self.telemetry is not None:
+            self.telemetry_episode = self.telemetry.start_episode(self, seed, options.get("episode"))
+
+        return self.get_observation(), {"optimal_path_length": self.optimal_path_length} # ignoring mobile obstacles
     
 
     def reset_grid(self):
-        grid = np.zeros((self.grid_size[0] + UAV_VISION - 1, self.grid_size[1] + UAV_VISION - 1))
-
-        for i in range(self.margin): # place walls on the borders of the map
-            grid[i, :] = 1
-            grid[grid.shape[0]-1-i, :] = 1
+        if self.empty_grid is None: # walls on the borders of the map are built only once
+            self.empty_grid = np.ones((self.grid_size[0] + 2 * self.margin, self.grid_size[1] + 2 * self.margin), dtype=np.float32)
+            self.empty_grid[self.margin:-self.margin, self.margin:-self.margin] = 0
+            self.empty_table = summed_area_table(self.empty_grid).reshape(-1)
 
-            grid[:, i] = 1
-            grid[:, grid.shape[1]-1-i] = 1
+        self.table = self.empty_table # static obstacles of the coarse view
 
-        return grid
+        return self.empty_grid.copy()
     
 
-    def place_static_obstacles(self):
-        if self.grid_size != (15, 15): # all maps are 15x15
+    def place_static_obstacles(self, map_id=None):
+        self.difficulty = self.select_difficulty()
+        map = self.sample_map(self.difficulty, map_id) # maps are parsed once, not on every reset
+
+        if map.shape != tuple(self.grid_size):
             print("NO STATIC OBSTACLES: grid and obstacles map have different sizes")
+            self.grid = self.reset_grid()
             return
 
-        difficulty = self.select_difficulty()
-        map_id = self.np_random.integers(1, MAPS + 1)
+        self.map = map
+        self.grid = map.get_grid(self.margin).copy()
+        self.table = map.get_summed_area_table(self.margin) if self.coarse_view is not None else None
+        self.danger_coordinates = map.get_danger_coordinates(self.margin)
+        self.free_space = map.free_space
 
-        if self.training:
-            path = f"maps/training/{difficulty}/map_"
-        else:
-            path = f"maps/testing/map_"
 
-        with open(f"{path}{map_id}.txt") as map: # load obstacles based on the map file
-            self.free_space = 0
+    def select_difficulty(self):
+        return self.curriculum.select_difficulty(self.np_random, self.total_steps)
 
-            for i, line in enumerate(map):
-                line = "".join([char for char in line if char != "\n" and char != " "])
 
-                for j, char in enumerate(line):
-                    grid_coodinates = (i + self.grid_coordinates["first"][0], j + self.grid_coordinates["first"][1])
+    def get_curriculum_steps(self):
+        # total_steps, through env_method: get_attr and set_attr would reach the step counter of the Monitor wrapper SB3
+        # adds around a single environment (which starts from 0 in every process, and has a get_total_steps method)
+        return self.total_steps
 
-                    if char == '2': # danger coordinates
-                        self.danger_coordinates.append((grid_coodinates[0], grid_coodinates[1]))
 
-                    char = 1 if char == '1' else 0 # other numbers in the map are converted to zero
-                    self.grid[grid_coodinates[0]][grid_coodinates[1]] = char
-                    
-                    if char != 1:
-                        self.free_space += 1
+    def set_curriculum_steps(self, total_steps):
+        self.total_steps = total_steps
 
 
-    def select_difficulty(self):
-        if self.total_steps < 3_000_000:
-            return "easy"
-        if self.total_steps < 5_000_000:
-            return "medium"
-        
-        return "hard"
+    def sample_map(self, difficulty, map_id=None):
+        if map_id is not None:
+            return self.map_source.select(self.training, difficulty, map_id)
+
+        if not self.training or not self.text_maps:
+            return self.map_source.sample(self.np_random, difficulty, self.training)
+
+        maps = self.map_source.group(self.training, difficulty)
+
+        return maps[choose_maps(self.curriculum, self.np_random, maps, 1)[0]]
 
 
     def place_mobile_obstacles(self):
         self.mobile_obstacles_number = self.free_space // 50 # good fraction of mobile obstacles
-        self.mobile_obstacles_positions = []
 
-        for _ in range(self.mobile_obstacles_number):
-            while True:
-                position = self.get_random_coordinates()
+        # distinct free cells drawn at once, as large maps have hundreds of obstacles
+        cells = self.np_random.choice(np.flatnonzero(self.grid == 0), self.mobile_obstacles_number, replace=False)
+        self.mobile_obstacles_positions = np.stack(np.divmod(cells, self.grid.shape[1]), axis=1)
+        self.grid[self.mobile_obstacles_positions[:, 0], self.mobile_obstacles_positions[:, 1]] = 1
 
-                if not self.detect_obstacle(position):
-                    break
-
-            self.mobile_obstacles_positions.append(position)
-            self.grid[position[0]][position[1]] = 1
+        self.mobile_obstacles_active = np.ones((1, self.mobile_obstacles_number), dtype=bool)
+        self.obstacle_motion.reset(self.grid[np.newaxis], self.mobile_obstacles_positions[np.newaxis], self.mobile_obstacles_active, self.np_random, [0])
 
 
     def get_random_coordinates(self):
@@ -160,6 +199,12 @@ class Environment(gym.Env):
 
     
     def reset_position_and_target(self):
+        if self.map is not None: # only start and target pairs connected on the static map are drawn
+            reachability = get_reachability(self.map, self.margin)
+            self.position, self.target = reachability.sample_pair(self.np_random, self.grid)
+            self.optimal_path_length = reachability.distance(self.position, self.target)
+            return
+
         while True:
             self.position = self.get_random_coordinates()
 
@@ -171,17 +216,32 @@ class Environment(gym.Env):
             if not np.array_equal(self.position, self.target) and not self.detect_obstacle(self.position) and not self.detect_obstacle(self.target):
                 break
 
+        self.optimal_path_length = int(np.abs(self.target - self.position).max()) # diagonal moves cost one step
+
     
     def get_observation(self):
-        self.relative_position = (self.target - self.position) / np.array(self.grid_size)
-        local_grid = self.get_local_grid().flatten()
+        np.subtract(self.target, self.position, out=self.relative_position)
+        np.divide(self.relative_position, self.grid_dimensions, out=self.relative_position)
+
+        self.observation[:2] = self.relative_position
+        self.observation_window[:] = self.get_local_grid()
+
+        if self.coarse_view is not None:
+            obstacles = self.mobile_obstacles_positions if self.mobile_obstacles else None
+            active = self.mobile_obstacles_active[0] if self.mobile_obstacles else None
+            self.coarse_observation[:] = self.coarse_view.encode(self.table, self.position[np.newaxis], obstacles, active)[0]
+
+        if self.observation_view:
+            return self.observation
 
-        return np.concatenate([self.relative_position.astype(np.float32), local_grid.astype(np.float32)])
+        return self.observation.copy()
     
 
     def get_local_grid(self):
-        return self.grid[self.position[0]-self.margin : self.position[0]+self.margin + 1,
-                         self.position[1]-self.margin : self.position[1]+self.margin + 1]
+        radius = self.vision // 2
+
+        return self.grid[self.position[0]-radius : self.position[0]+radius + 1,
+                         self.position[1]-radius : self.position[1]+radius + 1]
     
 
     def step(self, action):
@@ -195,8 +255,7 @@ class Environment(gym.Env):
         else:
             truncated = False
 
-        move = np.array(self.moves[action])
-        next_position = self.position + move
+        next_position = self.position + self.move_vectors[action]
 
         self.update_obstacles()
 
@@ -213,8 +272,14 @@ class Environment(gym.Env):
                 terminated = False
                 self.position = next_position
 
+        if (terminated or truncated) and self.training and self.map is not None:
+            self.curriculum.record(self.difficulty, self.map.name, "success" if reward > 0 else "collision" if terminated else "truncation")
+
         reward = np.clip(reward / 100, -1.0, 1.0)
 
+        if self.telemetry is not None:
+            self.telemetry.record_step(self, action, reward, terminated, truncated)
+
         return self.get_observation(), reward, terminated, truncated, {}
     
 
@@ -222,101 +287,35 @@ class Environment(gym.Env):
         if not self.mobile_obstacles:
             return
 
-        for i, obstacle_position in enumerate(self.mobile_obstacles_positions):
-            directions = list(range(8))
-            self.np_random.shuffle(directions)
+        # all obstacles move at once (a batch of one environment), see obstacle_motion.py
+        grids = self.grid[np.newaxis]
+        positions = self.mobile_obstacles_positions[np.newaxis]
 
-            for action in directions:
-                move = np.array(self.moves[action])
-
-                if not self.detect_obstacle(obstacle_position + move):
-                    self.grid[self.mobile_obstacles_positions[i][0]][self.mobile_obstacles_positions[i][1]] = 0
-                    self.mobile_obstacles_positions[i] += move
-                    self.grid[self.mobile_obstacles_positions[i][0]][self.mobile_obstacles_positions[i][1]] = 1
-                    break
+        preferences = self.obstacle_motion.propose(grids, positions, self.mobile_obstacles_active, self.np_random)
+        directions, moved = move_obstacles(grids, positions, self.mobile_obstacles_active, preferences, self.move_vectors)
+        self.obstacle_motion.update(positions, self.mobile_obstacles_active, directions, moved)
     
 
     def render(self):
-        if self.render_mode != 'human':
-            return
-        
-        self.screen.fill((200, 200, 200))
-
-        # draw uav vision
-        for i in range(UAV_VISION):
-            for j in range(UAV_VISION):
-                coordinates = (self.position[0] - self.margin + i, self.position[1] - self.margin + j)
-
-                if not self.out_of_bounds(coordinates):
-                    view_rect = pygame.Rect(
-                        (coordinates[1] - self.margin) * self.cell_size,
-                        (coordinates[0] - self.margin) * self.cell_size,
-                        self.cell_size,
-                        self.cell_size
-                    )
-
-                    pygame.draw.rect(self.screen, (255, 255, 255), view_rect)
-
-        # draw grid
-        for i in range(self.grid_size[0]):
-            for j in range(self.grid_size[1]):
-                grid_rect = pygame.Rect(
-                    j * self.cell_size,
-                    i * self.cell_size,
-                    self.cell_size,
-                    self.cell_size
-                )
-                
-                pygame.draw.rect(self.screen, (150, 150, 150), grid_rect, 1)
-
-        # draw target
-        target_rect = pygame.Rect(
-            (self.target[1] - self.margin) * self.cell_size,
-            (self.target[0] - self.margin) * self.cell_size,
-            self.cell_size,
-            self.cell_size
-        )
-
-        pygame.draw.rect(self.screen, (255, 0, 0), target_rect)
-
-        # draw obstacles
-        for i in range(self.grid_size[0]):
-            for j in range(self.grid_size[1]):
-                if self.detect_obstacle((i + self.grid_coordinates["first"][0], j + self.grid_coordinates["first"][1])):
-                    obstacle_rect = pygame.Rect(
-                        j * self.cell_size,
-                        i * self.cell_size,
-                        self.cell_size,
-                        self.cell_size
-                    )
-
-                    pygame.draw.rect(self.screen, (0, 0, 0), obstacle_rect)
-
-        # draw uav
-        UAV_rect = pygame.Rect(
-            (self.position[1] - self.margin) * self.cell_size,
-            (self.position[0] - self.margin) * self.cell_size,
-            self.cell_size,
-            self.cell_size
-        )
-
-        pygame.draw.rect(self.screen, (0, 255, 0), UAV_rect)
-
-        # draw text background
-        text_background_rect = pygame.Rect(
-            0,
-            self.grid_size[0] * self.cell_size,
-            self.grid_size[1] * self.cell_size,
-            PANEL_HEIGHT
-        )
-
-        pygame.draw.rect(self.screen, (20, 20, 20), text_background_rect)
-
-        # draw text
-        text = self.font.render(f"Relative position: {np.round(self.relative_position, 2)}", True, (255, 255, 255))
-        self.screen.blit(text, (15, self.grid_size[0] * self.cell_size + 15))
-
-        pygame.display.flip()
+        if self.renderer is None:
+            return None
+
+        if self.render_static: # the static map is only drawn once per episode
+            self.renderer.reset(self.map.codes == 1 if self.map is not None else None)
+            self.render_static = False
+
+        obstacles = None
+
+        if self.mobile_obstacles:
+            obstacles = self.mobile_obstacles_positions[self.mobile_obstacles_active[0]] - self.margin
+
+        self.renderer.update(self.position - self.margin, self.target - self.margin, obstacles,
+                             f"Relative position: {np.round(self.relative_position, 2)}")
+
+        if self.render_mode == "rgb_array":
+            return self.renderer.frame # reused by the next call, copy it to keep it
+
+        self.renderer.show(self.screen)
         self.clock.tick(self.metadata["render_fps"])
 
 
@@ -331,5 +330,10 @@ class Environment(gym.Env):
         
 
     def close(self):
+        if self.telemetry is not None:
+            self.telemetry.flush()
+
         if hasattr(self, "screen"):
+            import pygame
+
             pygame.quit()
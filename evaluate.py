@@ -1,6 +1,9 @@
 import argparse
-from environment import Environment
-from stable_baselines3 import DQN, PPO
+from environment import MAPS, UAV_VISION, Environment
+from evaluation import evaluate, load_model, print_summary, summarize
+from map_generator import make_map_source
+from planners import PLANNERS, PlannerPolicy
+from results_cache import RESULTS_PATH, ResultsCache
 import time
 
 INTERVAL = 0.5
@@ -12,76 +15,113 @@ parser.add_argument('--grid_size', nargs='+', default=[15, 15])
 parser.add_argument('--static_obstacles', action='store_true', default=False)
 parser.add_argument('--mobile_obstacles', action='store_true', default=False)
 parser.add_argument('--model', type=str, default="models/last_model")
-parser.add_argument('--algorithm', type=str, default="PPO")
+parser.add_argument('--algorithm', type=str, default="PPO") # "PPO", "DQN", or a planner: "ASTAR", "JPS", "DSTAR"
+parser.add_argument('--map_source', type=str, default="text") # "text", "generated" or a map file from map_generator.py
+parser.add_argument('--vision', type=int, default=UAV_VISION) # the observation layout must match the one the model was trained with
+parser.add_argument('--coarse_vision', type=int, default=0)
+parser.add_argument('--coarse_pooling', type=int, default=3)
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--batch_size', type=int, default=64) # episodes run in lockstep per process
+parser.add_argument('--workers', type=int, default=1)
+parser.add_argument('--all_maps', action='store_true', default=False) # episode i runs on testing map i % 8 + 1
+parser.add_argument('--telemetry', type=str, default=None) # file recording every episode and step, replayed with telemetry.py
+parser.add_argument('--video', type=str, default=None) # directory of one video per episode, rendered headless
+parser.add_argument('--fleet', type=int, default=None) # number of UAVs flying at once in one airspace, headless
+parser.add_argument('--cache', type=str, default=RESULTS_PATH) # results of the episodes already evaluated with the same model, maps, seed and settings
+parser.add_argument('--no_cache', action='store_true', default=False)
 
 arguments = parser.parse_args()
 
 episodes = arguments.episodes
-
-if episodes > 10:
-    step_time = 0
-    render_mode = None
-    render = False
-else:
-    step_time = INTERVAL
-    render_mode = "human"
-    render = True
+render = episodes <= 10 and arguments.video is None and arguments.fleet is None
 
 grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
 static_obstacles = arguments.static_obstacles
 mobile_obstacles = arguments.mobile_obstacles
 model_name = arguments.model
 algorithm = arguments.algorithm
+seed = arguments.seed
+map_count = MAPS if arguments.all_maps else None
+
+environment_kwargs = {
+    "grid_size"       : grid_size,
+    "static_obstacles": static_obstacles,
+    "mobile_obstacles": mobile_obstacles,
+    "training"        : False,
+    "map_source"      : make_map_source(arguments.map_source, grid_size),
+    "telemetry"       : arguments.telemetry,
+    "vision"          : arguments.vision,
+    "coarse_vision"   : arguments.coarse_vision,
+    "coarse_pooling"  : arguments.coarse_pooling
+}
+
+print(f"Evaluating {algorithm if algorithm in PLANNERS else model_name}")
+
+if arguments.fleet is not None:
+    del environment_kwargs["telemetry"] # only recorded for single UAV environments
+
+if not render: # headless: batched episodes, optionally spread across processes
+    results, elapsed = evaluate(algorithm, model_name, episodes, seed, environment_kwargs,
+                                batch_size=arguments.batch_size,
+                                workers=arguments.workers,
+                                map_count=map_count,
+                                video_directory=arguments.video,
+                                fleet=arguments.fleet,
+                                cache=None if arguments.no_cache else ResultsCache(arguments.cache))
+
+    print_summary(summarize(results), elapsed)
+else:
+    environment = Environment(**environment_kwargs, seed=seed, render_mode="human")
+    model = load_model(algorithm, model_name)
 
-environment = Environment(grid_size=grid_size,
-                          static_obstacles=static_obstacles,
-                          mobile_obstacles=mobile_obstacles,
-                          training=False,
-                          seed=42,
-                          render_mode=render_mode)
+    total_reward = 0
+    successes = 0
+    collisions = 0
+    truncations = 0
 
-if algorithm == "DQN":
-    model = DQN.load(model_name, env=environment)
-elif algorithm == "PPO":
-    model = PPO.load(model_name, env=environment)
+    for episode in range(episodes):
+        options = {"episode": episode}
 
-total_reward = 0
-successes = 0
-collisions = 0
-truncations = 0
+        if map_count is not None:
+            options["map_id"] = episode % map_count + 1
 
-print(f"Evaluating {model_name}")
+        observation, _ = environment.reset(options=options)
+        terminated = truncated = False
+        episode_reward = 0
 
-for episode in range(episodes):
-    observation, _ = environment.reset()
-    terminated = truncated = False
-    episode_reward = 0
+        if isinstance(model, PlannerPolicy):
+            model.reset(0, environment)
 
-    while not (terminated or truncated):
-        if render:
+        while not (terminated or truncated):
             environment.render()
-        
-        action, _ = model.predict(observation)
-        observation, reward, terminated, truncated, _ = environment.step(action)
-        episode_reward += reward
 
-        if terminated and reward > 0:
-            successes += 1
-        elif terminated and reward < 0:
-            collisions += 1
-        elif truncated:
-            truncations += 1
+            if isinstance(model, PlannerPolicy):
+                action = model.act(0, environment)
+            else:
+                action, _ = model.predict(observation)
 
-        time.sleep(step_time)
+            observation, reward, terminated, truncated, _ = environment.step(action)
+            episode_reward += reward
+
+            if terminated and reward > 0:
+                successes += 1
+            elif terminated and reward < 0:
+                collisions += 1
+            elif truncated:
+                truncations += 1
+
+            time.sleep(INTERVAL)
 
-    if render:
         print(f"Episode {episode} reward: {episode_reward}")
 
-    total_reward += episode_reward
+        total_reward += episode_reward
+
+    environment.close()
 
-print("|====================")
-print(f"| Successes: {successes}")
-print(f"| Collisions: {collisions}")
-print(f"| Truncations: {truncations}")
-print(f"| Mean reward: {(total_reward / episodes):.3f}")
-print("|====================")
+    print_summary({
+        "successes"  : successes,
+        "collisions" : collisions,
+        "truncations": truncations,
+        "mean_reward": total_reward / episodes,
+        "maps"       : {}
+    })
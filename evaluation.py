@@ -0,0 +1,305 @@
+from concurrent.futures import ProcessPoolExecutor
+from environment import Environment
+import multiprocessing as mp
+import numpy as np
+from numpy_policy import load_policy, policy_from_arrays
+import os
+from planners import PLANNERS, PlannerPolicy
+import time
+
+MAX_LISTED_MAPS = 32
+OUTCOMES = {"success": "successes", "collision": "collisions", "truncation": "truncations"}
+PERCENTILES = [50, 90, 99]
+
+worker_model = None
+
+def load_model(algorithm, model_name):
+    if algorithm in PLANNERS: # classical planners need no trained model
+        return PlannerPolicy(algorithm)
+    if model_name.endswith(".npz"): # exported with export_policy.py, no torch needed
+        return load_policy(model_name)
+
+    from stable_baselines3 import DQN, PPO # torch is only imported when it is needed
+
+    return {"DQN": DQN, "PPO": PPO}[algorithm].load(model_name, device="cpu")
+
+
+def episode_seed(seed, episode):
+    # every episode owns its seed, so results do not depend on which worker or slot runs it
+    return int(np.random.SeedSequence([seed, episode]).generate_state(1)[0])
+
+
+def run_episodes(model, episodes, seed, environment_kwargs, batch_size=64, map_count=None, video_directory=None):
+    # with map_count, episode i runs on map i % map_count + 1, so every (testing) map gets its share of the episodes;
+    # with video_directory, every episode is rendered headless into video_directory/episode_{i}.mp4
+    pending = list(reversed(episodes))
+    results = []
+
+    if len(pending) == 0:
+        return results
+
+    render_mode = "rgb_array" if video_directory is not None else None
+    environments = [Environment(**environment_kwargs, observation_view=True, render_mode=render_mode) for _ in range(min(batch_size, len(pending)))] # observations are copied into the batch
+    observations = np.zeros((len(environments),) + environments[0].observation_space.shape, dtype=np.float32)
+    live = [None] * len(environments)
+    writers = [None] * len(environments)
+    planning = isinstance(model, PlannerPolicy)
+
+    if video_directory is not None:
+        from renderer import VideoWriter # OpenCV is only needed to export videos
+
+        os.makedirs(video_directory, exist_ok=True)
+
+    def start(slot):
+        if len(pending) == 0:
+            live[slot] = None
+            return
+
+        episode = pending.pop()
+        options = {"episode": episode} # telemetry id
+
+        if map_count is not None:
+            options["map_id"] = episode % map_count + 1
+
+        observations[slot], info = environments[slot].reset(seed=episode_seed(seed, episode), options=options)
+        map = environments[slot].map
+
+        live[slot] = {
+            "episode"            : episode,
+            "map"                : map.name if map is not None else "empty",
+            "optimal_path_length": info["optimal_path_length"],
+            "reward"             : 0.0,
+            "steps"              : 0
+        }
+
+        if planning:
+            model.reset(slot, environments[slot])
+            live[slot]["planning_times"] = []
+
+        if video_directory is not None:
+            writers[slot] = VideoWriter(os.path.join(video_directory, f"episode_{episode}.mp4"), environments[slot].renderer.size,
+                                        fps=environments[slot].metadata["render_fps"])
+            writers[slot].write(environments[slot].render())
+
+    for slot in range(len(environments)):
+        start(slot)
+
+    while True:
+        active = [slot for slot in range(len(environments)) if live[slot] is not None]
+
+        if len(active) == 0:
+            break
+
+        if planning: # planners read the grid of every environment, timing each decision
+            actions = []
+
+            for slot in active:
+                start_time = time.perf_counter()
+                actions.append(model.act(slot, environments[slot]))
+                live[slot]["planning_times"].append(time.perf_counter() - start_time)
+        else:
+            actions, _ = model.predict(observations[active], deterministic=True) # one forward pass for every live episode
+
+        for slot, action in zip(active, actions):
+            observation, reward, terminated, truncated, _ = environments[slot].step(action)
+            episode = live[slot]
+            episode["reward"] += float(reward)
+            episode["steps"] += 1
+
+            if writers[slot] is not None:
+                writers[slot].write(environments[slot].render())
+
+            if terminated or truncated:
+                if writers[slot] is not None:
+                    writers[slot].close()
+                    writers[slot] = None
+
+                if terminated and reward > 0:
+                    episode["outcome"] = "success"
+                elif terminated:
+                    episode["outcome"] = "collision"
+                else:
+                    episode["outcome"] = "truncation"
+
+                results.append(episode)
+                start(slot)
+            else:
+                observations[slot] = observation
+
+    for environment in environments:
+        environment.close() # writes the recorded telemetry
+
+    return results
+
+
+def run_fleet_episodes(model, episodes, seed, environment_kwargs, n_agents):
+    # agents of one airspace (see fleet_environment.py) driven by one forward pass per tick, until enough episodes finished
+    if isinstance(model, PlannerPolicy):
+        raise ValueError("planners drive a single UAV, fleets need a policy")
+
+    from fleet_environment import FleetEnvironment
+
+    environment = FleetEnvironment(n_agents, **environment_kwargs, seed=seed)
+    observations = environment.reset()
+    rewards = np.zeros(n_agents)
+    steps = np.zeros(n_agents, dtype=np.int64)
+    results = []
+
+    while len(results) < episodes:
+        actions, _ = model.predict(observations, deterministic=True)
+        observations, step_rewards, dones, infos = environment.step(actions)
+        rewards += step_rewards
+        steps += 1
+
+        for agent in np.flatnonzero(dones):
+            info = infos[agent]
+
+            if step_rewards[agent] > 0:
+                outcome = "success"
+            elif info["TimeLimit.truncated"]: # also when the airspace is drawn again
+                outcome = "truncation"
+            else:
+                outcome = "collision"
+
+            results.append({
+                "episode"            : len(results),
+                "map"                : info["map"],
+                "optimal_path_length": info["optimal_path_length"],
+                "reward"             : float(rewards[agent]),
+                "steps"              : int(steps[agent]),
+                "outcome"            : outcome
+            })
+
+        rewards[dones] = 0
+        steps[dones] = 0
+
+    environment.close()
+
+    return results[:episodes]
+
+
+def initialize_worker(algorithm, model_name, model=None):
+    global worker_model
+
+    worker_model = model if model is not None else load_model(algorithm, model_name)
+
+
+def run_worker_episodes(episodes, seed, environment_kwargs, batch_size, map_count, video_directory):
+    return run_episodes(worker_model, episodes, seed, environment_kwargs, batch_size, map_count, video_directory)
+
+
+def run_snapshot_episodes(arrays, episodes, seed, environment_kwargs, batch_size=64, map_count=None):
+    # policy weights sent by a training process (see AsyncEvalCallback), evaluated without torch
+    return run_episodes(policy_from_arrays(arrays), episodes, seed, environment_kwargs, batch_size, map_count)
+
+
+def run_model_episodes(algorithm, model_name, episodes, seed, environment_kwargs, batch_size=64, workers=1, map_count=None, video_directory=None):
+    if len(episodes) == 0:
+        return []
+
+    if workers > 1:
+        chunks = [list(chunk) for chunk in np.array_split(episodes, workers) if len(chunk) > 0]
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        # forked workers inherit the model loaded here, with torch and SB3 already imported, instead of each loading it
+        model = load_model(algorithm, model_name) if context.get_start_method() == "fork" else None
+
+        with ProcessPoolExecutor(len(chunks), mp_context=context,
+                                 initializer=initialize_worker, initargs=(algorithm, model_name, model)) as executor:
+            futures = [executor.submit(run_worker_episodes, chunk, seed, environment_kwargs, batch_size, map_count, video_directory) for chunk in chunks]
+
+            return [episode for future in futures for episode in future.result()]
+
+    return run_episodes(load_model(algorithm, model_name), episodes, seed, environment_kwargs, batch_size, map_count, video_directory)
+
+
+def evaluate(algorithm, model_name, episodes, seed, environment_kwargs, batch_size=64, workers=1, map_count=None, video_directory=None, fleet=None, cache=None):
+    # with a ResultsCache (see results_cache.py), only the episodes it does not hold yet are run; planners (timed), fleets
+    # (whose episodes depend on each other) and runs writing videos or telemetry are always run
+    start_time = time.perf_counter()
+
+    if fleet is not None: # one airspace shared by fleet agents
+        results = run_fleet_episodes(load_model(algorithm, model_name), episodes, seed, environment_kwargs, fleet)
+    else:
+        pending = list(range(episodes))
+        cached = {}
+
+        if cache is not None and algorithm not in PLANNERS and video_directory is None and environment_kwargs.get("telemetry") is None:
+            key = (cache.model_hash(model_name), cache.configuration(algorithm, environment_kwargs, map_count), seed)
+            cached = cache.lookup(*key, pending)
+            pending = [episode for episode in pending if episode not in cached]
+
+            if len(cached) > 0:
+                print(f"{len(cached)} of the {episodes} episodes read from the cache")
+        else:
+            cache = None
+
+        results = run_model_episodes(algorithm, model_name, pending, seed, environment_kwargs, batch_size, workers, map_count, video_directory)
+
+        if cache is not None and len(results) > 0:
+            cache.store(*key, results)
+
+        results += list(cached.values())
+
+    elapsed = time.perf_counter() - start_time
+    results.sort(key=lambda episode: episode["episode"])
+
+    return results, elapsed
+
+
+def new_summary_entry():
+    return {"episodes": 0, "successes": 0, "collisions": 0, "truncations": 0, "reward": 0.0, "efficiency": 0.0}
+
+
+def summarize(results):
+    summary = new_summary_entry()
+    maps = {}
+
+    for episode in results:
+        for entry in (summary, maps.setdefault(episode["map"], new_summary_entry())):
+            entry["episodes"] += 1
+            entry[OUTCOMES[episode["outcome"]]] += 1
+            entry["reward"] += episode["reward"]
+
+            if episode["outcome"] == "success": # shortest path length over the steps taken
+                entry["efficiency"] += episode["optimal_path_length"] / episode["steps"]
+
+    for entry in [summary] + list(maps.values()):
+        entry["mean_reward"] = entry.pop("reward") / max(entry["episodes"], 1)
+        entry["path_efficiency"] = entry.pop("efficiency") / max(entry["successes"], 1)
+
+    summary["maps"] = dict(sorted(maps.items()))
+
+    planning_times = [planning_time for episode in results for planning_time in episode.get("planning_times", [])]
+
+    if len(planning_times) > 0: # in milliseconds
+        latencies = np.percentile(planning_times, PERCENTILES + [100]) * 1000
+        summary["planning_latency"] = dict(zip([f"p{percentile}" for percentile in PERCENTILES] + ["max"], latencies))
+
+    return summary
+
+
+def print_summary(summary, elapsed=None):
+    print("|====================")
+    print(f"| Successes: {summary['successes']}")
+    print(f"| Collisions: {summary['collisions']}")
+    print(f"| Truncations: {summary['truncations']}")
+    print(f"| Mean reward: {summary['mean_reward']:.3f}")
+
+    if "path_efficiency" in summary:
+        print(f"| Path efficiency: {summary['path_efficiency']:.3f}")
+
+    if "planning_latency" in summary:
+        print("| Planning latency: " + ", ".join(f"{name} {value:.3f} ms" for name, value in summary["planning_latency"].items()))
+
+    if elapsed is not None:
+        print(f"| Throughput: {summary['episodes'] / elapsed:.1f} episodes/s")
+
+    print("|====================")
+
+    if 1 < len(summary["maps"]) <= MAX_LISTED_MAPS: # generated maps are rarely repeated, so they are not listed
+        for name, entry in summary["maps"].items():
+            print(f"| {name}: {entry['successes']}/{entry['episodes']} successes, "
+                  f"{entry['collisions']} collisions, {entry['truncations']} truncations, "
+                  f"mean reward {entry['mean_reward']:.3f}, path efficiency {entry['path_efficiency']:.3f}")
+
+        print("|====================")
@@ -0,0 +1,147 @@
+import argparse
+from environment import Environment, UAV_VISION
+from evaluation import episode_seed
+from map_generator import make_map_source
+import numpy as np
+from numpy_policy import load_policy
+import os
+from stable_baselines3 import DQN, PPO
+import time
+import torch.nn as nn
+
+ALGORITHMS = {"DQN": DQN, "PPO": PPO}
+ACTIVATIONS = {nn.Tanh: "tanh", nn.ReLU: "relu"}
+
+def policy_layers(model):
+    # layers that map an observation to the action logits (PPO) or Q-values (DQN)
+    if isinstance(model, PPO):
+        return list(model.policy.mlp_extractor.policy_net) + [model.policy.action_net]
+    if isinstance(model, DQN):
+        return list(model.policy.q_net.q_net)
+
+    raise ValueError(f"only PPO and DQN models can be exported, not {type(model).__name__}")
+
+
+def policy_arrays(model):
+    # the weights and settings of a NumpyPolicy, as saved in the .npz files
+    layers = policy_layers(model)
+    linear = [layer for layer in layers if isinstance(layer, nn.Linear)]
+    activations = {type(layer) for layer in layers if not isinstance(layer, nn.Linear)}
+
+    if len(activations) != 1 or next(iter(activations)) not in ACTIVATIONS:
+        raise ValueError(f"unsupported activations: {[activation.__name__ for activation in activations]}")
+
+    arrays = {
+        "layers"          : np.array(len(linear)),
+        "activation"      : np.array(ACTIVATIONS[activations.pop()]),
+        "algorithm"       : np.array(type(model).__name__),
+        "exploration_rate": np.array(getattr(model, "exploration_rate", 0.0))
+    }
+
+    for i, layer in enumerate(linear):
+        arrays[f"weights_{i}"] = layer.weight.detach().cpu().numpy().T.astype(np.float32)
+        arrays[f"biases_{i}"] = layer.bias.detach().cpu().numpy().astype(np.float32)
+
+    return arrays
+
+
+def export_policy(model, path):
+    np.savez(path, **policy_arrays(model))
+
+
+def record_observations(model, environment_kwargs, count, seed):
+    # observations visited by the SB3 model itself, so the check covers the states that matter
+    environment = Environment(**environment_kwargs)
+    observations = np.zeros((count,) + environment.observation_space.shape, dtype=np.float32)
+    episode = 0
+    observation, _ = environment.reset(seed=episode_seed(seed, episode))
+
+    for i in range(count):
+        observations[i] = observation
+        action, _ = model.predict(observation, deterministic=True)
+        observation, _, terminated, truncated, _ = environment.step(action)
+
+        if terminated or truncated:
+            episode += 1
+            observation, _ = environment.reset(seed=episode_seed(seed, episode))
+
+    return observations
+
+
+def verify(model, policy, observations):
+    expected, _ = model.predict(observations, deterministic=True)
+    actions, _ = policy.predict(observations, deterministic=True)
+    mismatches = np.flatnonzero(expected != actions)
+
+    print(f"Verified {len(observations)} observations: {len(mismatches)} different actions")
+
+    for i in mismatches[:10]:
+        outputs = policy.forward(observations[i:i + 1])[0]
+        print(f"| observation {i}: SB3 {expected[i]}, exported {actions[i]}, outputs {np.round(outputs, 4)}")
+
+    return len(mismatches) == 0
+
+
+def latency(predict, observations, calls=1000):
+    start = time.perf_counter()
+
+    for i in range(calls):
+        predict(observations[i % len(observations)])
+
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model', type=str, default="models/last_model")
+    parser.add_argument('--algorithm', type=str, default="PPO")
+    parser.add_argument('--output', type=str, default=None) # defaults to the model name with .npz
+    parser.add_argument('--verify', action='store_true', default=False)
+    parser.add_argument('--observations', type=str, default=None) # recorded observation set (.npy), created if missing
+    parser.add_argument('--count', type=int, default=10_000)
+    parser.add_argument('--grid_size', nargs='+', default=[15, 15])
+    parser.add_argument('--static_obstacles', action='store_true', default=False)
+    parser.add_argument('--mobile_obstacles', action='store_true', default=False)
+    parser.add_argument('--map_source', type=str, default="text")
+    parser.add_argument('--vision', type=int, default=UAV_VISION) # the observation layout the model was trained with
+    parser.add_argument('--coarse_vision', type=int, default=0)
+    parser.add_argument('--coarse_pooling', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+
+    arguments = parser.parse_args()
+
+    output = arguments.output or arguments.model.removesuffix(".zip") + ".npz"
+    model = ALGORITHMS[arguments.algorithm].load(arguments.model, device="cpu")
+
+    export_policy(model, output)
+    print(f"Exported {arguments.model} to {output} ({os.path.getsize(output) / 1024:.1f} KiB)")
+
+    if arguments.verify:
+        start = time.perf_counter()
+        policy = load_policy(output)
+        print(f"Loaded in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        if arguments.observations and os.path.exists(arguments.observations):
+            observations = np.load(arguments.observations)
+        else:
+            grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
+            observations = record_observations(model, {
+                "grid_size"       : grid_size,
+                "static_obstacles": arguments.static_obstacles,
+                "mobile_obstacles": arguments.mobile_obstacles,
+                "training"        : False,
+                "map_source"      : make_map_source(arguments.map_source, grid_size),
+                "vision"          : arguments.vision,
+                "coarse_vision"   : arguments.coarse_vision,
+                "coarse_pooling"  : arguments.coarse_pooling
+            }, arguments.count, arguments.seed)
+
+            if arguments.observations:
+                np.save(arguments.observations, observations)
+
+        print(f"Latency per observation: SB3 {latency(lambda observation: model.predict(observation, deterministic=True), observations):.1f} us, "
+              f"exported {latency(lambda observation: policy.predict(observation, deterministic=True), observations):.1f} us")
+
+        if not verify(model, policy, observations):
+            raise SystemExit(1)
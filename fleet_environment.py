@@ -0,0 +1,317 @@
+from curriculum import choose_maps, make_curriculum
+from environment import MOVES, UAV_VISION
+from gymnasium import spaces
+from map_registry import get_registry
+from obstacle_motion import make_motion_policy, move_obstacles
+from profiling import FLEET_ENVIRONMENT_PHASES, instrument
+from reachability import get_reachability
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from vision import CoarseView, summed_area_table, vision_margin
+
+class FleetEnvironment(VecEnv):
+    # n_agents UAVs flying in one airspace (one grid, one set of mobile obstacles) at once. Every agent is one environment
+    # of the VecEnv with the observations of Environment, so a single policy learns from and drives all of them with one
+    # batched forward pass. Agents are indexed by cell in an occupancy grid, which finds agent-agent collisions without
+    # comparing pairs; an agent whose episode ends is respawned on its own, and the whole airspace (map, obstacles and
+    # agents) is drawn again every airspace_steps ticks, truncating the episodes still running
+    def __init__(self, n_agents, grid_size=(10, 10), static_obstacles=False, mobile_obstacles=False, training=True, seed=None, obstacle_motion="random", map_source=None, curriculum=None, airspace_steps=None, profile=False, vision=UAV_VISION, coarse_vision=0, coarse_pooling=3):
+        self.grid_size = grid_size # (height, width) or (rows, columns)
+
+        action_space = spaces.Discrete(8)
+        observation_space = spaces.Box(low=-1.0, high=1.0, shape=(2 + vision * vision + coarse_vision * coarse_vision,), dtype=np.float32)
+
+        self.render_mode = None
+        super(FleetEnvironment, self).__init__(n_agents, observation_space, action_space)
+
+        self.moves = np.array(MOVES)
+        self.static_obstacles = static_obstacles
+        self.mobile_obstacles = mobile_obstacles
+        self.training = training
+        self.text_maps = map_source is None
+        self.map_source = map_source if map_source is not None else get_registry()
+        self.obstacle_motion = make_motion_policy(obstacle_motion, self.moves)
+        self.curriculum = make_curriculum(curriculum)
+        self.airspace_steps = airspace_steps or grid_size[0] * grid_size[1] # as the truncation of a single UAV
+
+        self.np_random = np.random.default_rng(seed)
+        self.total_steps = 0 # aggregated over all agents
+
+        self.vision = vision
+        self.margin = vision_margin(vision, coarse_vision, coarse_pooling) # see Environment
+        self.grid = np.ones((grid_size[0] + 2 * self.margin, grid_size[1] + 2 * self.margin), dtype=np.float32)
+        self.grid[self.margin:-self.margin, self.margin:-self.margin] = 0
+        self.empty_grid = self.grid.copy()
+        self.width = self.grid.shape[1]
+        self.cells = self.grid.reshape(-1) # flat views, so every lookup is a single index
+        self.occupancy = np.zeros(self.grid.shape, dtype=np.int32) # agent index + 1 on the cell of every agent, 0 elsewhere
+        self.occupants = self.occupancy.reshape(-1)
+
+        window = np.arange(-(vision // 2), vision // 2 + 1)
+        self.window = (np.repeat(window, vision) * self.width + np.tile(window, vision)) # flat offsets of the vision window
+        self.center = vision * vision // 2
+
+        self.coarse_view = None
+
+        if coarse_vision > 0: # one summed-area table of the static obstacles, shared by all agents
+            self.coarse_view = CoarseView(coarse_vision, coarse_pooling, self.width)
+            self.empty_table = summed_area_table(self.empty_grid).reshape(-1)
+            self.table = self.empty_table
+
+        self.agents = np.arange(n_agents)
+        self.positions = np.zeros((n_agents, 2), dtype=np.int64)
+        self.targets = np.zeros((n_agents, 2), dtype=np.int64)
+        self.current_steps = np.zeros(n_agents, dtype=np.int64)
+        self.optimal_path_lengths = np.zeros(n_agents, dtype=np.int64) # ignoring mobile obstacles and the other agents
+        self.ticks = 0
+        self.map = None
+        self.difficulty = None
+        self.episodes = [] # (difficulty, map name, outcome) of the episodes finished in the last step
+
+        self.actions = np.zeros(n_agents, dtype=np.int64)
+        self.timers = instrument(self, FLEET_ENVIRONMENT_PHASES) if profile else None # per-method wall time, see profiling.py
+
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.np_random = np.random.default_rng(self._seeds[0])
+
+        self.reset_airspace()
+        self._reset_seeds()
+        self._reset_options()
+
+        return self.get_observations()
+
+
+    def reset_airspace(self):
+        self.ticks = 0
+        self.map = None
+        self.free_space = self.grid_size[0] * self.grid_size[1]
+
+        if self.static_obstacles:
+            self.place_static_obstacles()
+        else:
+            self.grid[:] = self.empty_grid
+
+        if self.coarse_view is not None:
+            self.table = self.map.get_summed_area_table(self.margin) if self.map is not None else self.empty_table
+
+        if self.mobile_obstacles:
+            self.place_mobile_obstacles()
+
+        if 2 * self.num_envs > self.free_space - (self.mobile_obstacles_number if self.mobile_obstacles else 0):
+            raise ValueError(f"{self.num_envs} agents do not fit in {self.free_space} free cells")
+
+        self.occupancy[:] = 0
+        self.spawn(self.agents)
+
+
+    def place_static_obstacles(self):
+        self.difficulty = self.curriculum.select_difficulty(self.np_random, self.total_steps) if self.training else "testing"
+
+        if not self.training or not self.text_maps:
+            map = self.map_source.sample(self.np_random, self.difficulty, self.training)
+        else:
+            maps = self.map_source.group(self.training, self.difficulty)
+            map = maps[choose_maps(self.curriculum, self.np_random, maps, 1)[0]]
+
+        if map.shape != tuple(self.grid_size):
+            print("NO STATIC OBSTACLES: grid and obstacles map have different sizes")
+            self.static_obstacles = False
+            self.grid[:] = self.empty_grid
+            return
+
+        self.map = map
+        self.grid[:] = map.get_grid(self.margin)
+        self.free_space = map.free_space
+
+
+    def place_mobile_obstacles(self):
+        self.mobile_obstacles_number = self.free_space // 50 # as in Environment
+
+        cells = self.np_random.choice(np.flatnonzero(self.cells == 0), self.mobile_obstacles_number, replace=False)
+        self.mobile_obstacles_positions = np.stack(np.divmod(cells, self.width), axis=1)
+        self.cells[cells] = 1
+
+        self.mobile_obstacles_active = np.ones((1, self.mobile_obstacles_number), dtype=bool)
+        self.obstacle_motion.reset(self.grid[np.newaxis], self.mobile_obstacles_positions[np.newaxis], self.mobile_obstacles_active, self.np_random, [0])
+
+
+    def spawn(self, agents):
+        # start cells are free of obstacles and of the other agents, targets of obstacles
+        blocked = self.grid.copy()
+        blocked[self.occupancy > 0] = 1
+        blocked_cells = blocked.reshape(-1)
+        reachability = get_reachability(self.map, self.margin) if self.map is not None else None
+
+        for agent in agents:
+            if reachability is not None: # only pairs connected on the static map
+                position, target = reachability.sample_pair(self.np_random, blocked)
+                optimal_path_length = reachability.distance(position, target)
+            else:
+                while True:
+                    position = self.np_random.integers(self.margin, self.margin + np.array(self.grid_size))
+                    target = self.np_random.integers(self.margin, self.margin + np.array(self.grid_size))
+
+                    if not np.array_equal(position, target) and blocked[position[0], position[1]] != 1 and self.grid[target[0], target[1]] != 1:
+                        break
+
+                optimal_path_length = int(np.abs(target - position).max()) # diagonal moves cost one step
+
+            cell = position[0] * self.width + position[1]
+            blocked_cells[cell] = 1
+            self.occupants[cell] = agent + 1
+
+            self.positions[agent] = position
+            self.targets[agent] = target
+            self.optimal_path_lengths[agent] = optimal_path_length
+
+        self.current_steps[agents] = 0
+
+
+    def get_observations(self):
+        # same layout as Environment.get_observation, with the other agents seen as obstacles
+        relative_positions = (self.targets - self.positions) / np.array(self.grid_size)
+        windows = (self.positions[:, 0] * self.width + self.positions[:, 1])[:, np.newaxis] + self.window
+
+        others = self.occupants[windows] > 0
+        others[:, self.center] = False
+        local_grids = np.maximum(self.cells[windows], others)
+        observations = [relative_positions.astype(np.float32), local_grids]
+
+        if self.coarse_view is not None: # the other agents are not in the coarse view, only obstacles
+            obstacles = self.mobile_obstacles_positions if self.mobile_obstacles else None
+            observations.append(self.coarse_view.encode(self.table, self.positions, obstacles))
+
+        return np.concatenate(observations, axis=1)
+
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions).reshape(self.num_envs)
+
+
+    def step_wait(self):
+        self.total_steps += self.num_envs
+        self.current_steps += 1
+        self.ticks += 1
+
+        truncated = self.current_steps > self.grid_size[0] * self.grid_size[1] # UAV took many steps (more steps than coordinates in the grid)
+
+        current_cells = self.positions[:, 0] * self.width + self.positions[:, 1]
+        next_positions = self.positions + self.moves[self.actions]
+        next_cells = next_positions[:, 0] * self.width + next_positions[:, 1]
+
+        self.update_obstacles()
+
+        collided = ~truncated & (self.cells[next_cells] == 1)
+        staying = truncated | collided
+        final_cells = np.where(staying, current_cells, next_cells)
+
+        while True:
+            # two agents ending on one cell (including the cell of an agent that stays) or swapping their cells both crash;
+            # crashed agents stay where they were, which can cause new conflicts
+            _, inverse, counts = np.unique(final_cells, return_inverse=True, return_counts=True)
+            occupants = self.occupants[final_cells] - 1
+            occupants = np.where(occupants >= 0, occupants, self.agents)
+            swapped = (occupants != self.agents) & (final_cells[occupants] == current_cells)
+
+            crashed = (counts[inverse] > 1) | swapped
+            crashed &= ~staying
+
+            if not crashed.any():
+                break
+
+            staying |= crashed
+            collided |= crashed
+            final_cells[crashed] = current_cells[crashed]
+
+        moved = ~staying
+        self.occupants[current_cells[moved]] = 0
+        self.occupants[final_cells[moved]] = self.agents[moved] + 1
+        self.positions[moved] = next_positions[moved]
+
+        reached = moved & np.all(self.positions == self.targets, axis=1)
+
+        rewards = np.full(self.num_envs, -0.1, dtype=np.float32)
+        rewards[truncated | collided] = -100
+        rewards[reached] = 100
+        rewards = np.clip(rewards / 100, -1.0, 1.0)
+
+        terminated = collided | reached
+        dones = terminated | truncated
+        airspace_ended = self.ticks >= self.airspace_steps
+
+        if airspace_ended: # episodes still running are cut short, without the truncation penalty
+            truncated |= ~dones
+            dones[:] = True
+
+        observations = self.get_observations()
+        infos = [{} for _ in range(self.num_envs)]
+        finished = np.flatnonzero(dones)
+        map_name = self.map.name if self.map is not None else "empty"
+
+        for i in finished:
+            infos[i]["terminal_observation"] = observations[i].copy()
+            infos[i]["TimeLimit.truncated"] = bool(truncated[i] and not terminated[i])
+            infos[i]["map"] = map_name
+            infos[i]["optimal_path_length"] = int(self.optimal_path_lengths[i])
+
+        self.episodes = []
+
+        if self.static_obstacles and self.training and len(finished) > 0:
+            self.episodes = [(self.difficulty, map_name, "success" if reached[i] else "collision" if collided[i] else "truncation") for i in finished]
+
+            for episode in self.episodes:
+                self.curriculum.record(*episode)
+
+        if airspace_ended:
+            self.reset_airspace()
+            observations = self.get_observations()
+        elif len(finished) > 0:
+            self.occupants[self.positions[finished, 0] * self.width + self.positions[finished, 1]] = 0
+            self.spawn(finished)
+            observations[finished] = self.get_observations()[finished]
+
+        return observations, rewards, dones, infos
+
+
+    def update_obstacles(self):
+        if not self.mobile_obstacles:
+            return
+
+        # obstacles move on the grid only, as in Environment they do not avoid the UAVs
+        grids = self.grid[np.newaxis]
+        positions = self.mobile_obstacles_positions[np.newaxis]
+
+        preferences = self.obstacle_motion.propose(grids, positions, self.mobile_obstacles_active, self.np_random)
+        directions, moved = move_obstacles(grids, positions, self.mobile_obstacles_active, preferences, self.moves)
+        self.obstacle_motion.update(positions, self.mobile_obstacles_active, directions, moved)
+
+
+    def close(self):
+        pass
+
+
+    def get_curriculum_steps(self):
+        # the same methods as Environment's, so the step counter of any environment is read and set with env_method
+        return self.total_steps
+
+
+    def set_curriculum_steps(self, total_steps):
+        self.total_steps = total_steps
+
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from environment import Environment, UAV_VISION
+from evaluation import PERCENTILES, episode_seed
+from inference_server import HEADER
+import json
+from map_generator import make_map_source
+import multiprocessing as mp
+import numpy as np
+import time
+
+class InferenceClient:
+    def __init__(self, observation_size):
+        self.observation_size = observation_size
+        self.lock = asyncio.Lock() # one request at a time per connection, answers come back in order
+
+
+    async def connect(self, socket_path=None, host="127.0.0.1", port=8765):
+        if socket_path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+
+
+    async def predict(self, observations):
+        observations = np.asarray(observations, dtype=np.float32).reshape(-1, self.observation_size)
+
+        async with self.lock:
+            self.writer.write(HEADER.pack(len(observations)) + observations.tobytes())
+            await self.writer.drain()
+            data = await self.reader.readexactly(len(observations) * 4)
+
+        return np.frombuffer(data, dtype=np.int32)
+
+
+    async def counters(self):
+        async with self.lock:
+            self.writer.write(HEADER.pack(0))
+            await self.writer.drain()
+            (length,) = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+
+            return json.loads(await self.reader.readexactly(length))
+
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def fly(uav, environment_kwargs, steps, seed, address, latencies, outcomes):
+    # one UAV with its own connection, as a drone of the fleet would have
+    environment = Environment(**environment_kwargs, observation_view=True) # the observation is serialized right away
+    client = InferenceClient(environment.observation_space.shape[0])
+    await client.connect(*address)
+
+    episode = 0
+    observation, _ = environment.reset(seed=episode_seed(seed, uav * (steps + 1)))
+
+    for _ in range(steps):
+        start = time.perf_counter()
+        action = (await client.predict(observation))[0]
+        latencies.append(time.perf_counter() - start)
+
+        observation, reward, terminated, truncated, _ = environment.step(action)
+
+        if terminated or truncated:
+            outcomes["successes" if terminated and reward > 0 else "collisions" if terminated else "truncations"] += 1
+            episode += 1
+            observation, _ = environment.reset(seed=episode_seed(seed, uav * (steps + 1) + episode))
+
+    await client.close()
+
+
+async def fly_fleet(uavs, environment_kwargs, steps, seed, address):
+    latencies = []
+    outcomes = {"successes": 0, "collisions": 0, "truncations": 0}
+
+    await asyncio.gather(*[fly(uav, environment_kwargs, steps, seed, address, latencies, outcomes) for uav in uavs])
+
+    return latencies, outcomes
+
+
+def run_fleet(uavs, environment_kwargs, steps, seed, address):
+    return asyncio.run(fly_fleet(uavs, environment_kwargs, steps, seed, address))
+
+
+async def read_counters(address):
+    client = InferenceClient(0)
+    await client.connect(*address)
+    counters = await client.counters()
+    await client.close()
+
+    return counters
+
+
+def generate_load(uavs, steps, environment_kwargs, seed, address, processes=1):
+    # the environments are simulated here too, so several processes may be needed to saturate the server
+    fleets = [list(fleet) for fleet in np.array_split(np.arange(uavs), processes) if len(fleet) > 0]
+    start = time.perf_counter()
+
+    if len(fleets) > 1:
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+
+        with ProcessPoolExecutor(len(fleets), mp_context=context) as executor:
+            results = list(executor.map(run_fleet, fleets, *zip(*[(environment_kwargs, steps, seed, address)] * len(fleets))))
+    else:
+        results = [run_fleet(fleets[0], environment_kwargs, steps, seed, address)]
+
+    elapsed = time.perf_counter() - start
+    latencies = [latency for fleet_latencies, _ in results for latency in fleet_latencies]
+    outcomes = {outcome: sum(fleet_outcomes[outcome] for _, fleet_outcomes in results) for outcome in results[0][1]}
+    counters = asyncio.run(read_counters(address))
+
+    print("|====================")
+    print(f"| UAVs: {uavs}, steps: {uavs * steps} in {elapsed:.2f} s ({uavs * steps / elapsed:.0f} steps/s)")
+    print("| Round trip: " + ", ".join(f"p{percentile} {value:.2f} ms" for percentile, value in
+                                       zip(PERCENTILES, np.percentile(latencies, PERCENTILES) * 1000)))
+    print(f"| Episodes: {outcomes['successes']} successes, {outcomes['collisions']} collisions, {outcomes['truncations']} truncations")
+    print(f"| Server: mean batch {counters['mean_batch_size']:.1f}, {counters['observations_per_second']:.0f} observations/s, latency " +
+          ", ".join(f"{name} {value:.2f} ms" for name, value in counters["latency_ms"].items()))
+    print("|====================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--uavs', type=int, default=64) # concurrent environments, one connection each
+    parser.add_argument('--steps', type=int, default=1000) # per UAV
+    parser.add_argument('--processes', type=int, default=1) # processes simulating the UAVs
+    parser.add_argument('--grid_size', nargs='+', default=[15, 15])
+    parser.add_argument('--static_obstacles', action='store_true', default=False)
+    parser.add_argument('--mobile_obstacles', action='store_true', default=False)
+    parser.add_argument('--map_source', type=str, default="text")
+    parser.add_argument('--vision', type=int, default=UAV_VISION) # the observation layout of the served model
+    parser.add_argument('--coarse_vision', type=int, default=0)
+    parser.add_argument('--coarse_pooling', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--socket', type=str, default=None)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+
+    arguments = parser.parse_args()
+
+    grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
+
+    environment_kwargs = {
+        "grid_size"       : grid_size,
+        "static_obstacles": arguments.static_obstacles,
+        "mobile_obstacles": arguments.mobile_obstacles,
+        "training"        : False,
+        "map_source"      : make_map_source(arguments.map_source, grid_size),
+        "vision"          : arguments.vision,
+        "coarse_vision"   : arguments.coarse_vision,
+        "coarse_pooling"  : arguments.coarse_pooling
+    }
+
+    generate_load(arguments.uavs, arguments.steps, environment_kwargs, arguments.seed,
+                  (arguments.socket, arguments.host, arguments.port), arguments.processes)
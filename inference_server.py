@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from evaluation import load_model
+import json
+import numpy as np
+import os
+import struct
+import time
+
+# every message starts with the number of observations that follow (float32, as Environment.get_observation);
+# the answer is one int32 action per observation. A count of 0 asks for the counters, answered as length-prefixed JSON
+HEADER = struct.Struct("<I")
+PERCENTILES = [50, 90, 99]
+LATENCY_WINDOW = 10_000
+
+class InferenceServer:
+    # requests from every connection are queued and run as one forward pass, once the batch is full or
+    # the oldest request has waited max_wait seconds
+    def __init__(self, model, max_batch_size=256, max_wait=0.002):
+        self.model = model
+        self.observation_size = model.observation_size if hasattr(model, "observation_size") else model.observation_space.shape[0]
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = deque() # (observations, future, arrival time)
+        self.queued_observations = 0
+        self.arrived = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1) # forward passes run outside the event loop, one at a time
+
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.observations = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW) # seconds from arrival to answer, latest requests only
+
+
+    async def submit(self, observations):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((observations, future, time.perf_counter()))
+        self.queued_observations += len(observations)
+        self.arrived.set()
+
+        return await future
+
+
+    def predict(self, observations):
+        actions, _ = self.model.predict(observations, deterministic=True)
+
+        return np.asarray(actions, dtype=np.int32).reshape(-1)
+
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self.queue:
+                self.arrived.clear()
+                await self.arrived.wait()
+
+            deadline = self.queue[0][2] + self.max_wait
+
+            while self.queued_observations < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+
+                if remaining <= 0:
+                    break
+
+                self.arrived.clear()
+
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = []
+            size = 0
+
+            while self.queue and (size == 0 or size + len(self.queue[0][0]) <= self.max_batch_size): # oversized requests run alone
+                batch.append(self.queue.popleft())
+                size += len(batch[-1][0])
+
+            self.queued_observations -= size
+
+            try:
+                actions = await loop.run_in_executor(self.executor, self.predict, np.concatenate([request[0] for request in batch]))
+            except Exception as error: # the requests of this batch fail, the loop keeps serving the next ones
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(error)
+
+                continue
+
+            now = time.perf_counter()
+            start = 0
+
+            for observations, future, arrival in batch:
+                if not future.cancelled():
+                    future.set_result(actions[start:start + len(observations)])
+
+                start += len(observations)
+                self.latencies.append(now - arrival)
+
+            self.requests += len(batch)
+            self.observations += size
+            self.batches += 1
+
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                (count,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+
+                if count == 0:
+                    payload = json.dumps(self.counters()).encode()
+                    writer.write(HEADER.pack(len(payload)) + payload)
+                else:
+                    data = await reader.readexactly(count * self.observation_size * 4)
+                    observations = np.frombuffer(data, dtype=np.float32).reshape(count, self.observation_size)
+                    writer.write((await self.submit(observations)).tobytes())
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError): # client disconnected
+            pass
+        except Exception as error: # the forward pass of its request failed, the client sees the connection closed
+            print(f"Closing a connection: {type(error).__name__}: {error}", flush=True)
+        finally:
+            writer.close()
+
+
+    def counters(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = np.percentile(self.latencies, PERCENTILES) * 1000 if self.latencies else [0.0] * len(PERCENTILES)
+
+        return {
+            "requests"               : self.requests,
+            "observations"           : self.observations,
+            "batches"                : self.batches,
+            "mean_batch_size"        : self.observations / max(self.batches, 1),
+            "requests_per_second"    : self.requests / elapsed,
+            "observations_per_second": self.observations / elapsed,
+            "latency_ms"             : dict(zip([f"p{percentile}" for percentile in PERCENTILES], latencies))
+        }
+
+
+    async def log_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            counters = self.counters()
+            print(f"{counters['requests_per_second']:.0f} requests/s, {counters['observations_per_second']:.0f} observations/s, "
+                  f"mean batch {counters['mean_batch_size']:.1f}, latency " +
+                  ", ".join(f"{name} {value:.2f} ms" for name, value in counters["latency_ms"].items()), flush=True)
+
+
+async def serve(server, socket_path=None, host="127.0.0.1", port=8765, log_interval=10.0):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        listener = await asyncio.start_unix_server(server.handle, path=socket_path)
+        print(f"Serving on {socket_path}", flush=True)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        print(f"Serving on {host}:{port}", flush=True)
+
+    tasks = [asyncio.create_task(server.batch_loop())]
+
+    if log_interval > 0:
+        tasks.append(asyncio.create_task(server.log_loop(log_interval)))
+
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model', type=str, default="models/last_model") # SB3 .zip or exported .npz
+    parser.add_argument('--algorithm', type=str, default="PPO")
+    parser.add_argument('--socket', type=str, default=None) # Unix socket path; localhost TCP otherwise
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max_batch_size', type=int, default=256)
+    parser.add_argument('--max_wait_ms', type=float, default=2.0)
+    parser.add_argument('--log_interval', type=float, default=10.0) # seconds between counter logs, 0 disables them
+
+    arguments = parser.parse_args()
+
+    model = load_model(arguments.algorithm, arguments.model)
+    server = InferenceServer(model, max_batch_size=arguments.max_batch_size, max_wait=arguments.max_wait_ms / 1000)
+
+    try:
+        asyncio.run(serve(server, arguments.socket, arguments.host, arguments.port, arguments.log_interval))
+    except KeyboardInterrupt:
+        pass
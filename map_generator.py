@@ -0,0 +1,235 @@
+import argparse
+from collections import OrderedDict
+from map_registry import Map
+import numpy as np
+import os
+
+DIFFICULTY_SCALE = {"easy": 0.5, "medium": 1.0, "hard": 1.5, "testing": 1.0} # generated maps get denser with difficulty
+CACHED_MAPS = 256 # a pool of maps for each difficulty
+MAP_POOL = 64 # generated maps per difficulty by default, so the maps and their distance fields are reused
+MAX_ROOM = 10
+MAX_WALL = 8
+CHUNK = 256
+
+def label_components(free):
+    # 8-connected components of the free cells (the UAV can move diagonally between any two free cells), numbered in
+    # the order of their first cell; union-find over all the pairs of free neighbours at once: every root is hooked to
+    # the smallest root it touches, then every cell points to its root again, until no pair joins two components
+    height, width = free.shape
+    indices = np.arange(free.size).reshape(free.shape)
+    first, second = [], []
+
+    for di, dj in ((0, 1), (1, -1), (1, 0), (1, 1)): # every pair of neighbours once
+        rows, neighbour_rows = slice(0, height - di), slice(di, height)
+        columns, neighbour_columns = slice(max(-dj, 0), width - max(dj, 0)), slice(max(dj, 0), width - max(-dj, 0))
+        both = free[rows, columns] & free[neighbour_rows, neighbour_columns]
+        first.append(indices[rows, columns][both])
+        second.append(indices[neighbour_rows, neighbour_columns][both])
+
+    first, second = np.concatenate(first), np.concatenate(second)
+    parents = np.arange(free.size)
+
+    while True:
+        roots, neighbour_roots = parents[first], parents[second]
+        joined = roots != neighbour_roots
+
+        if not joined.any():
+            break
+
+        np.minimum.at(parents, np.maximum(roots[joined], neighbour_roots[joined]), np.minimum(roots[joined], neighbour_roots[joined]))
+
+        while True: # pointer jumping
+            grandparents = parents[parents]
+
+            if np.array_equal(grandparents, parents):
+                break
+
+            parents = grandparents
+
+    labels = np.full(free.size, -1, dtype=np.int64)
+    cells = np.flatnonzero(free)
+    roots, labels[cells] = np.unique(parents[cells], return_inverse=True) # roots are the first cell of their component
+
+    return labels.reshape(free.shape), len(roots)
+
+
+def mark_danger(codes):
+    # free cells next to an obstacle, like the "2" cells of the text maps
+    obstacles = np.pad(codes == 1, 1)
+    near = np.zeros(codes.shape, dtype=bool)
+
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            near |= obstacles[1 + di:1 + di + codes.shape[0], 1 + dj:1 + dj + codes.shape[1]]
+
+    codes[(codes != 1) & near] = 2
+
+    return codes
+
+
+def generate_map(shape, seed=None, density=0.05, corridors=4, rooms=2):
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    scale = height * width / (15 * 15) # counts are given for a 15x15 map and grow with the area, sizes stay the same
+    codes = np.zeros(shape, dtype=np.uint8)
+
+    # walls leaving gaps between them that form corridors
+    for _ in range(int(round(corridors * scale))):
+        if rng.random() < 0.5:
+            row = rng.integers(0, height)
+            start, length = rng.integers(0, width), rng.integers(min(width, 4), min(width, MAX_WALL) + 1)
+            codes[row, start:start + length] = 1
+        else:
+            column = rng.integers(0, width)
+            start, length = rng.integers(0, height), rng.integers(min(height, 4), min(height, MAX_WALL) + 1)
+            codes[start:start + length, column] = 1
+
+    # hollow rooms with one door on each side
+    for _ in range(int(round(rooms * scale))):
+        room_height = rng.integers(4, max(5, min(height, MAX_ROOM)))
+        room_width = rng.integers(4, max(5, min(width, MAX_ROOM)))
+        top, left = rng.integers(0, max(1, height - room_height)), rng.integers(0, max(1, width - room_width))
+        bottom, right = min(top + room_height, height) - 1, min(left + room_width, width) - 1
+
+        if bottom - top < 2 or right - left < 2: # no room fits in this map
+            continue
+
+        codes[top, left:right + 1] = codes[bottom, left:right + 1] = 1
+        codes[top:bottom + 1, left] = codes[top:bottom + 1, right] = 1
+
+        codes[top, rng.integers(left + 1, right)] = codes[bottom, rng.integers(left + 1, right)] = 0
+        codes[rng.integers(top + 1, bottom), left] = codes[rng.integers(top + 1, bottom), right] = 0
+
+    # scattered blocks
+    codes[rng.random(shape) < density] = 1
+
+    # only the largest free region is kept, so every start and target pair is connected
+    labels, components = label_components(codes == 0)
+
+    if components > 1:
+        largest = np.argmax(np.bincount(labels[labels >= 0]))
+        codes[(labels >= 0) & (labels != largest)] = 1
+
+    return mark_danger(codes)
+
+
+class GeneratedMaps:
+    # maps generated on the fly from seeds; with a pool, only that many distinct maps exist per difficulty
+    def __init__(self, shape, seed=0, pool=None, density=0.05, corridors=4, rooms=2):
+        self.shape = tuple(shape)
+        self.seed = seed
+        self.pool = pool
+        self.parameters = {"density": density, "corridors": corridors, "rooms": rooms}
+        self.maps = OrderedDict() # least recently used maps are dropped first
+
+
+    def sample(self, np_random, difficulty, training):
+        difficulty = difficulty if training else "testing"
+        index = int(np_random.integers(0, self.pool if self.pool else 2**31))
+
+        return self.get(difficulty, index)
+
+
+    def select(self, training, difficulty, map_id):
+        return self.get(difficulty if training else "testing", map_id)
+
+
+    def get(self, difficulty, index):
+        name = f"generated/{difficulty}/{self.shape[0]}x{self.shape[1]}/map_{index}"
+
+        if name in self.maps:
+            self.maps.move_to_end(name)
+            return self.maps[name]
+
+        scale = DIFFICULTY_SCALE[difficulty]
+        seed = np.random.SeedSequence([self.seed, list(DIFFICULTY_SCALE).index(difficulty), index])
+        codes = generate_map(self.shape, seed,
+                             density=self.parameters["density"] * scale,
+                             corridors=self.parameters["corridors"] * scale,
+                             rooms=self.parameters["rooms"] * scale)
+
+        # generate_map only keeps the largest free region, so the free cells are a single component
+        self.maps[name] = Map(name, codes, labels=np.where(codes != 1, 0, -1).astype(np.int8))
+
+        if len(self.maps) > CACHED_MAPS:
+            self.maps.popitem(last=False)
+
+        return self.maps[name]
+
+
+class ChunkedMaps:
+    # maps stored as one memory-mapped (count, height, width) array: workers only page in the maps (and rows) they touch
+    def __init__(self, path):
+        self.path = path
+        self.codes = np.load(path, mmap_mode="r")
+        self.shape = self.codes.shape[1:]
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.maps = OrderedDict()
+
+
+    def sample(self, np_random, difficulty, training):
+        return self.get(int(np_random.integers(0, len(self.codes))))
+
+
+    def select(self, training, difficulty, map_id):
+        return self.get((map_id - 1) % len(self.codes)) # map ids start at 1, as the text maps
+
+
+    def get(self, index):
+        if index in self.maps:
+            self.maps.move_to_end(index)
+            return self.maps[index]
+
+        self.maps[index] = Map(f"{self.name}/map_{index}", self.codes[index])
+
+        if len(self.maps) > CACHED_MAPS:
+            self.maps.popitem(last=False)
+
+        return self.maps[index]
+
+
+def save_generated_maps(path, count, shape, seed=0, density=0.05, corridors=4, rooms=2):
+    # maps are written straight into the memory-mapped file, a chunk at a time, so they never all live in memory
+    codes = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(count,) + tuple(shape))
+
+    for index in range(count):
+        seed_sequence = np.random.SeedSequence([seed, index])
+        codes[index] = generate_map(shape, seed_sequence, density=density, corridors=corridors, rooms=rooms)
+
+        if (index + 1) % CHUNK == 0:
+            codes.flush()
+
+    codes.flush()
+
+
+def make_map_source(source, grid_size, seed=0, pool=MAP_POOL):
+    if source is None or source == "text":
+        return None
+    if source == "generated": # a pool of 0 generates a new map for almost every episode
+        return GeneratedMaps(grid_size, seed=seed, pool=pool or None)
+
+    return ChunkedMaps(source)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--grid_size', nargs='+', required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--density', type=float, default=0.05)
+    parser.add_argument('--corridors', type=float, default=4)
+    parser.add_argument('--rooms', type=float, default=2)
+
+    arguments = parser.parse_args()
+
+    grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
+
+    save_generated_maps(arguments.output, arguments.count, grid_size,
+                        seed=arguments.seed,
+                        density=arguments.density,
+                        corridors=arguments.corridors,
+                        rooms=arguments.rooms)
+
+    print(f"Generated {arguments.count} maps of {grid_size[0]}x{grid_size[1]} into {arguments.output}")
@@ -0,0 +1,169 @@
+import argparse
+import numpy as np
+import os
+from vision import summed_area_table
+
+MAPS_DIRECTORY = "maps"
+PACK_PATH = "maps/maps.npy"
+
+class Map:
+    def __init__(self, name, codes, labels=None):
+        self.name = name # relative path without extension, e.g. "training/easy/map_1"
+        self.codes = codes # 0: free, 1: obstacle, 2: danger (free cell close to an obstacle)
+        self.shape = codes.shape
+        self.free_space = int(np.count_nonzero(codes != 1))
+        self.labels = labels # connected components of the free cells when already known, see Reachability
+
+        self.grids = {}
+        self.danger_coordinates = {}
+        self.summed_area_tables = {}
+
+
+    def get_grid(self, margin):
+        if margin not in self.grids: # padded grids are built once per margin and then only copied
+            grid = np.ones((self.shape[0] + 2 * margin, self.shape[1] + 2 * margin), dtype=np.float32)
+            grid[margin:margin + self.shape[0], margin:margin + self.shape[1]] = self.codes == 1
+            grid.flags.writeable = False
+
+            self.grids[margin] = grid
+
+        return self.grids[margin]
+
+
+    def get_danger_coordinates(self, margin):
+        if margin not in self.danger_coordinates:
+            coordinates = np.argwhere(self.codes == 2) + margin
+            coordinates.flags.writeable = False
+
+            self.danger_coordinates[margin] = coordinates
+
+        return self.danger_coordinates[margin]
+
+
+    def get_summed_area_table(self, margin):
+        if margin not in self.summed_area_tables: # flattened, for the coarse views of vision.py
+            table = summed_area_table(self.get_grid(margin)).reshape(-1)
+            table.flags.writeable = False
+
+            self.summed_area_tables[margin] = table
+
+        return self.summed_area_tables[margin]
+
+
+class MapRegistry:
+    def __init__(self, directory=MAPS_DIRECTORY, pack_path=PACK_PATH):
+        self.directory = directory
+        self.pack_path = pack_path
+        self.maps = {}
+
+        paths = self.find_map_files()
+
+        if self.pack_is_current(paths):
+            self.load_pack()
+        else:
+            for name, path in paths.items():
+                self.maps[name] = Map(name, self.parse_map_file(path))
+
+        self.counts = {} # number of maps in each folder, e.g. "training/easy"
+
+        for name in self.maps:
+            group = name.rsplit("/", 1)[0]
+            self.counts[group] = self.counts.get(group, 0) + 1
+
+
+    def find_map_files(self):
+        paths = {}
+
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".txt"):
+                    path = os.path.join(root, file)
+                    name = os.path.relpath(path, self.directory)[:-len(".txt")].replace(os.sep, "/")
+                    paths[name] = path
+
+        return dict(sorted(paths.items()))
+
+
+    def parse_map_file(self, path):
+        with open(path) as map:
+            return np.array([line.split() for line in map if line.strip()], dtype=np.uint8)
+
+
+    def pack_is_current(self, paths):
+        if self.pack_path is None or not os.path.exists(self.pack_path):
+            return False
+
+        pack_time = os.path.getmtime(self.pack_path)
+
+        return all(os.path.getmtime(path) <= pack_time for path in paths.values())
+
+
+    def load_pack(self):
+        pack = np.load(self.pack_path, mmap_mode="r") # shared zero-copy between processes reading the same file
+
+        for entry in pack:
+            name = str(entry["name"])
+            self.maps[name] = Map(name, entry["codes"])
+
+
+    def save_pack(self, path=None):
+        path = path or self.pack_path
+        shapes = {map.shape for map in self.maps.values()}
+
+        if len(shapes) != 1:
+            raise ValueError(f"maps with different shapes cannot be packed together: {sorted(shapes)}")
+
+        dtype = np.dtype([("name", "U64"), ("codes", np.uint8, shapes.pop())])
+        pack = np.empty(len(self.maps), dtype=dtype)
+
+        for i, map in enumerate(self.maps.values()):
+            pack[i] = (map.name, map.codes)
+
+        np.save(path, pack)
+
+
+    def get(self, name):
+        return self.maps[name]
+
+
+    def sample(self, np_random, difficulty, training):
+        count = self.counts[f"training/{difficulty}" if training else "testing"]
+
+        return self.select(training, difficulty, np_random.integers(1, count + 1))
+
+
+    def group(self, training, difficulty):
+        count = self.counts[f"training/{difficulty}" if training else "testing"]
+
+        return [self.select(training, difficulty, map_id) for map_id in range(1, count + 1)]
+
+
+    def select(self, training, difficulty, map_id):
+        if training:
+            return self.maps[f"training/{difficulty}/map_{map_id}"]
+
+        return self.maps[f"testing/map_{map_id}"]
+
+
+registry = None
+
+def get_registry():
+    global registry
+
+    if registry is None: # every map is parsed once per process (or shared from the pack)
+        registry = MapRegistry()
+
+    return registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--pack', type=str, default=PACK_PATH)
+
+    arguments = parser.parse_args()
+
+    map_registry = MapRegistry(pack_path=None)
+    map_registry.save_pack(arguments.pack)
+
+    print(f"Packed {len(map_registry.maps)} maps into {arguments.pack}")
@@ -0,0 +1,62 @@
+import numpy as np
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda values: np.maximum(values, 0)
+}
+
+class NumpyPolicy:
+    # MlpPolicy exported by export_policy.py: the same layers as the SB3 model, evaluated with NumPy only
+    def __init__(self, weights, biases, activation, algorithm, exploration_rate=0.0, seed=None):
+        self.weights = weights # (inputs, outputs) matrices, so a batch goes through as observations @ weights
+        self.biases = biases
+        self.activation = ACTIVATIONS[activation]
+        self.algorithm = algorithm
+        self.exploration_rate = exploration_rate
+        self.observation_size = weights[0].shape[0]
+        self.rng = np.random.default_rng(seed)
+
+
+    def forward(self, observations):
+        values = observations
+
+        for weights, biases in zip(self.weights[:-1], self.biases[:-1]):
+            values = self.activation(values @ weights + biases)
+
+        return values @ self.weights[-1] + self.biases[-1] # action logits (PPO) or Q-values (DQN)
+
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        # same signature and return value as the SB3 models, so it can replace them in evaluation.py
+        observations = np.asarray(observation, dtype=np.float32).reshape(-1, self.observation_size)
+        outputs = self.forward(observations)
+
+        if deterministic:
+            actions = np.argmax(outputs, axis=1)
+        elif self.algorithm == "PPO": # sample from the softmax of the logits (Gumbel-max trick)
+            actions = np.argmax(outputs - np.log(-np.log(self.rng.random(outputs.shape))), axis=1)
+        else: # epsilon-greedy, as DQN.predict
+            actions = np.argmax(outputs, axis=1)
+            explore = self.rng.random(len(actions)) < self.exploration_rate
+            actions[explore] = self.rng.integers(0, outputs.shape[1], size=np.count_nonzero(explore))
+
+        if np.ndim(observation) == 1:
+            return actions[0], state
+
+        return actions, state
+
+
+def policy_from_arrays(arrays, seed=None):
+    layers = int(arrays["layers"])
+
+    return NumpyPolicy([arrays[f"weights_{i}"] for i in range(layers)],
+                       [arrays[f"biases_{i}"] for i in range(layers)],
+                       str(arrays["activation"]),
+                       str(arrays["algorithm"]),
+                       float(arrays["exploration_rate"]),
+                       seed=seed)
+
+
+def load_policy(path, seed=None):
+    with np.load(path) as data:
+        return policy_from_arrays(data, seed)
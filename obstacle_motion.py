@@ -0,0 +1,210 @@
+import numpy as np
+
+WAYPOINTS = 4
+FEW_OBSTACLES = 32 # below this many active obstacles, a plain loop is cheaper than the NumPy calls of the batch
+
+class MotionPolicy:
+    # positions have shape (environments, obstacles, 2) and active marks which obstacles exist in each environment
+    def __init__(self, moves):
+        self.moves = np.asarray(moves)
+
+
+    def reset(self, grids, positions, active, rng, indices):
+        pass
+
+
+    def propose(self, grids, positions, active, rng):
+        raise NotImplementedError
+
+
+    def update(self, positions, active, directions, moved):
+        pass
+
+
+    def random_order(self, shape, rng):
+        return np.argsort(rng.random(shape + (len(self.moves),)), axis=-1)
+
+
+class RandomWalk(MotionPolicy):
+    def propose(self, grids, positions, active, rng):
+        return self.random_order(positions.shape[:2], rng) # every direction is equally preferred
+
+
+class Patrol(MotionPolicy):
+    # obstacles fly in a straight line and turn back when they are blocked
+    def __init__(self, moves):
+        super(Patrol, self).__init__(moves)
+
+        self.opposites = np.array([np.flatnonzero(np.all(self.moves == -move, axis=1))[0] for move in self.moves])
+        self.headings = np.zeros((0, 0), dtype=np.int64)
+
+
+    def reset(self, grids, positions, active, rng, indices):
+        if self.headings.shape != positions.shape[:2]:
+            self.headings = np.zeros(positions.shape[:2], dtype=np.int64)
+
+        self.headings[indices] = rng.integers(0, len(self.moves), size=(len(indices), positions.shape[1]))
+
+
+    def propose(self, grids, positions, active, rng):
+        order = self.random_order(positions.shape[:2], rng) # random directions when both ways are blocked
+
+        return np.concatenate([self.headings[..., np.newaxis], self.opposites[self.headings][..., np.newaxis], order], axis=-1)
+
+
+    def update(self, positions, active, directions, moved):
+        self.headings[moved] = directions[moved]
+
+
+class WaypointLoop(MotionPolicy):
+    # obstacles visit a loop of random waypoints, always taking the move that gets closest to the next one
+    def __init__(self, moves, waypoints=WAYPOINTS):
+        super(WaypointLoop, self).__init__(moves)
+
+        self.waypoints_number = waypoints
+        self.waypoints = np.zeros((0, 0, waypoints, 2), dtype=np.int64)
+        self.current = np.zeros((0, 0), dtype=np.int64)
+
+
+    def reset(self, grids, positions, active, rng, indices):
+        if self.current.shape != positions.shape[:2]:
+            self.waypoints = np.zeros(positions.shape[:2] + (self.waypoints_number, 2), dtype=np.int64)
+            self.current = np.zeros(positions.shape[:2], dtype=np.int64)
+
+        for i in indices:
+            free = np.argwhere(grids[i] == 0)
+
+            if len(free) == 0:
+                continue
+
+            choices = rng.integers(0, len(free), size=(positions.shape[1], self.waypoints_number))
+            self.waypoints[i] = free[choices]
+
+        self.current[indices] = 0
+
+
+    def propose(self, grids, positions, active, rng):
+        targets = np.take_along_axis(self.waypoints, self.current[..., np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        candidates = positions[:, :, np.newaxis] + self.moves
+        distances = np.abs(candidates - targets[:, :, np.newaxis]).max(axis=-1) # chebyshev distance, as diagonal moves cost one step
+        noise = rng.random(distances.shape) # breaks ties randomly
+
+        return np.argsort(distances + noise * 0.5, axis=-1)
+
+
+    def update(self, positions, active, directions, moved):
+        targets = np.take_along_axis(self.waypoints, self.current[..., np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        reached = active & np.all(positions == targets, axis=-1)
+        self.current[reached] = (self.current[reached] + 1) % self.waypoints_number
+
+
+MOTION_POLICIES = {
+    "random"   : RandomWalk,
+    "patrol"   : Patrol,
+    "waypoints": WaypointLoop
+}
+
+def make_motion_policy(motion, moves):
+    if isinstance(motion, MotionPolicy):
+        return motion
+
+    return MOTION_POLICIES[motion](moves)
+
+
+def move_few_obstacles(cells, shape, positions, pending, preferences, offsets, directions, moved):
+    # the rounds of move_obstacles one obstacle at a time, with the same results: every choice of a round is made on
+    # the grid of the start of the round, and a cell claimed twice in a round goes to the lower index
+    _, height, width = shape
+    offsets = offsets.tolist()
+
+    while len(pending) > 0:
+        claimed = set()
+        winners = []
+        losers = []
+
+        for environment, obstacle, current in pending:
+            for direction in preferences[environment, obstacle].tolist():
+                candidate = current + offsets[direction]
+
+                if cells[candidate] == 0:
+                    break
+            else: # surrounded by occupied cells, it stays where it is
+                continue
+
+            if candidate in claimed:
+                losers.append((environment, obstacle, current))
+            else:
+                claimed.add(candidate)
+                winners.append((environment, obstacle, current, candidate, direction))
+
+        for environment, obstacle, current, candidate, direction in winners:
+            cells[current] = 0
+            cells[candidate] = 1
+            positions[environment, obstacle] = divmod(candidate - environment * height * width, width)
+            directions[environment, obstacle] = direction
+            moved[environment, obstacle] = True
+
+        pending = losers
+
+    return directions, moved
+
+
+def move_obstacles(grids, positions, active, preferences, moves):
+    # every pending obstacle takes its first preferred direction leading to a free cell, all at once;
+    # if several obstacles pick the same cell the lowest index wins and the others try again on the updated grid
+    if not grids.flags.c_contiguous:
+        raise ValueError("obstacles can only be moved on contiguous grids")
+
+    environments, height, width = grids.shape
+    cells = grids.reshape(-1) # flat view, so every lookup is a single index
+    offsets = moves[:, 0] * width + moves[:, 1]
+
+    directions = np.zeros(active.shape, dtype=np.int64)
+    moved = np.zeros(active.shape, dtype=bool)
+
+    pending_environments, pending_obstacles = np.nonzero(active)
+    current = (pending_environments * height + positions[pending_environments, pending_obstacles, 0]) * width + positions[pending_environments, pending_obstacles, 1]
+
+    if len(current) < FEW_OBSTACLES:
+        pending = list(zip(pending_environments.tolist(), pending_obstacles.tolist(), current.tolist()))
+        return move_few_obstacles(cells, grids.shape, positions, pending, preferences, offsets, directions, moved)
+
+    while len(current) > 0:
+        options = preferences[pending_environments, pending_obstacles]
+        free = cells[current[:, np.newaxis] + offsets[options]] == 0
+
+        movable = free.any(axis=1)
+
+        if not movable.all(): # obstacles surrounded by occupied cells stay where they are
+            pending_environments = pending_environments[movable]
+            pending_obstacles = pending_obstacles[movable]
+            current = current[movable]
+            options = options[movable]
+            free = free[movable]
+
+        direction = options[np.arange(len(current)), np.argmax(free, axis=1)]
+        candidates = current + offsets[direction]
+
+        order = np.argsort(candidates, kind="stable") # equal candidates stay sorted by obstacle index
+        winners = np.empty(len(candidates), dtype=bool)
+        winners[order[:1]] = True
+        winners[order[1:]] = candidates[order[1:]] != candidates[order[:-1]]
+
+        cells[current[winners]] = 0
+        cells[candidates[winners]] = 1
+
+        winner_environments = pending_environments[winners]
+        winner_obstacles = pending_obstacles[winners]
+        rows, columns = np.divmod(candidates[winners] - winner_environments * height * width, width)
+
+        positions[winner_environments, winner_obstacles, 0] = rows
+        positions[winner_environments, winner_obstacles, 1] = columns
+        directions[winner_environments, winner_obstacles] = direction[winners]
+        moved[winner_environments, winner_obstacles] = True
+
+        losers = ~winners
+        pending_environments = pending_environments[losers]
+        pending_obstacles = pending_obstacles[losers]
+        current = current[losers]
+
+    return directions, moved
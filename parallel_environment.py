@@ -0,0 +1,272 @@
+from curriculum import make_curriculum
+from environment import UAV_VISION
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import os
+from stable_baselines3.common.vec_env import VecEnv
+from vec_environment import VecEnvironment
+
+def create_buffers(buffer, n_envs, observation_size):
+    layout = [
+        ("total_steps", (1,), np.int64),
+        ("actions", (n_envs,), np.int64),
+        ("observations", (n_envs, observation_size), np.float32),
+        ("terminal_observations", (n_envs, observation_size), np.float32),
+        ("rewards", (n_envs,), np.float32),
+        ("dones", (n_envs,), np.bool_),
+        ("truncations", (n_envs,), np.bool_),
+        ("optimal_path_lengths", (n_envs,), np.int64) # of the episodes finished in the last step
+    ]
+
+    buffers = {}
+    offset = 0
+
+    for name, shape, dtype in layout:
+        if buffer is not None:
+            buffers[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -offset % 8 # keep every array aligned
+
+    return buffers, offset
+
+
+def worker(pipe, memory_name, n_envs, observation_size, first, last, environment_kwargs):
+    memory = SharedMemory(name=memory_name) # the main process owns (and unlinks) the block
+
+    buffers, _ = create_buffers(memory.buf, n_envs, observation_size)
+    environments = VecEnvironment(last - first, **environment_kwargs)
+    environments.record_episodes = False # the curriculum of the main process records every episode and sends its schedule
+
+    observations = buffers["observations"][first:last] # every worker only touches its own slice
+    terminal_observations = buffers["terminal_observations"][first:last]
+
+    try:
+        while True:
+            command, data = pipe.recv()
+
+            if command == "step":
+                if data is not None:
+                    environments.curriculum.schedule = data
+
+                # the main process already counted this step for all workers, so the local counter starts one step behind
+                environments.total_steps = int(buffers["total_steps"][0]) - environments.num_envs
+                environments.step_async(buffers["actions"][first:last])
+                step_observations, rewards, dones, infos = environments.step_wait()
+
+                for i in np.flatnonzero(dones):
+                    terminal_observations[i] = infos[i]["terminal_observation"]
+                    buffers["truncations"][first + i] = infos[i]["TimeLimit.truncated"]
+                    buffers["optimal_path_lengths"][first + i] = infos[i]["optimal_path_length"]
+
+                observations[:] = step_observations
+                buffers["rewards"][first:last] = rewards
+                buffers["dones"][first:last] = dones
+                pipe.send(environments.episodes)
+            elif command == "reset":
+                seed, schedule = data
+                environments.total_steps = int(buffers["total_steps"][0])
+                environments.curriculum.schedule = schedule
+
+                if seed is not None:
+                    environments.seed(seed)
+
+                observations[:] = environments.reset()
+                pipe.send(None)
+            elif command == "get_attr":
+                pipe.send(environments.get_attr(*data))
+            elif command == "set_attr":
+                pipe.send(environments.set_attr(*data))
+            elif command == "env_method":
+                name, args, kwargs, indices = data
+                pipe.send(environments.env_method(name, *args, indices=indices, **kwargs))
+            elif command == "close":
+                break
+    finally:
+        del observations, terminal_observations, buffers
+        memory.close()
+        pipe.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    local_attributes = ("render_mode", "total_steps", "curriculum") # answered by the main process, not by the workers
+    local_methods = ("get_curriculum_steps", "set_curriculum_steps")
+
+    def __init__(self, n_envs, workers=None, grid_size=(10, 10), static_obstacles=False, mobile_obstacles=False, training=True, seed=None, obstacle_motion="random", map_source=None, curriculum=None, profile=False, vision=UAV_VISION, coarse_vision=0, coarse_pooling=3):
+        workers = workers or os.cpu_count() # one worker per core by default
+        workers = min(workers, n_envs)
+
+        environment_kwargs = {
+            "grid_size"       : grid_size,
+            "static_obstacles": static_obstacles,
+            "mobile_obstacles": mobile_obstacles,
+            "training"        : training,
+            "obstacle_motion" : obstacle_motion,
+            "map_source"      : map_source,
+            "curriculum"      : make_curriculum(curriculum), # owned by the main process, the workers follow its schedule
+            "profile"         : profile, # the timers stay in the workers, read with get_attr("timers")
+            "vision"          : vision,
+            "coarse_vision"   : coarse_vision,
+            "coarse_pooling"  : coarse_pooling
+        }
+
+        self.curriculum = environment_kwargs["curriculum"]
+        self.sent_schedule = self.curriculum.schedule
+
+        probe = VecEnvironment(1, **environment_kwargs)
+        observation_size = probe.observation_space.shape[0]
+
+        self.render_mode = None
+        super(SharedMemoryVecEnv, self).__init__(n_envs, probe.observation_space, probe.action_space)
+
+        _, size = create_buffers(None, n_envs, observation_size)
+        self.memory = SharedMemory(create=True, size=size)
+        self.buffers, _ = create_buffers(self.memory.buf, n_envs, observation_size)
+        self.buffers["total_steps"][0] = 0 # aggregated over all workers
+
+        # fork shares the already loaded maps and modules with the workers
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+
+        self.slices = [(int(chunk[0]), int(chunk[-1]) + 1) for chunk in np.array_split(np.arange(n_envs), workers)]
+        self.pipes = []
+        self.processes = []
+
+        for i, (first, last) in enumerate(self.slices):
+            kwargs = dict(environment_kwargs, seed=None if seed is None else seed + i)
+            pipe, worker_pipe = context.Pipe()
+            process = context.Process(target=worker,
+                                      args=(worker_pipe, self.memory.name, n_envs, observation_size, first, last, kwargs),
+                                      daemon=True)
+            process.start()
+            worker_pipe.close()
+
+            self.pipes.append(pipe)
+            self.processes.append(process)
+
+        self.closed = False
+
+
+    @property
+    def total_steps(self):
+        return int(self.buffers["total_steps"][0])
+
+
+    @total_steps.setter
+    def total_steps(self, value):
+        self.buffers["total_steps"][0] = value
+
+
+    def get_curriculum_steps(self):
+        return self.total_steps
+
+
+    def set_curriculum_steps(self, total_steps):
+        self.total_steps = total_steps # read by the workers from the shared buffer
+
+
+    def reset(self):
+        for pipe, (first, _) in zip(self.pipes, self.slices):
+            pipe.send(("reset", (self._seeds[first], self.curriculum.schedule)))
+
+        for pipe in self.pipes:
+            pipe.recv()
+
+        self.sent_schedule = self.curriculum.schedule
+        self._reset_seeds()
+        self._reset_options()
+
+        return self.buffers["observations"].copy()
+
+
+    def step_async(self, actions):
+        self.buffers["actions"][:] = np.asarray(actions).reshape(self.num_envs)
+        self.buffers["total_steps"][0] += self.num_envs
+
+        schedule = None
+
+        if self.curriculum.schedule is not self.sent_schedule: # only sent when the curriculum changed its decisions
+            schedule = self.sent_schedule = self.curriculum.schedule
+
+        for pipe in self.pipes:
+            pipe.send(("step", schedule))
+
+
+    def step_wait(self):
+        for pipe in self.pipes:
+            for episode in pipe.recv():
+                self.curriculum.record(*episode)
+
+        dones = self.buffers["dones"].copy()
+        infos = [{} for _ in range(self.num_envs)]
+
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self.buffers["terminal_observations"][i].copy()
+            infos[i]["TimeLimit.truncated"] = bool(self.buffers["truncations"][i])
+            infos[i]["optimal_path_length"] = int(self.buffers["optimal_path_lengths"][i])
+
+        return self.buffers["observations"].copy(), self.buffers["rewards"].copy(), dones, infos
+
+
+    def close(self):
+        if self.closed:
+            return
+
+        for pipe in self.pipes:
+            pipe.send(("close", None))
+
+        for process in self.processes:
+            process.join()
+
+        self.buffers = None
+        self.memory.close()
+        self.memory.unlink()
+        self.closed = True
+
+
+    def get_attr(self, attr_name, indices=None):
+        if attr_name in self.local_attributes:
+            return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+        return self.call_workers("get_attr", indices, lambda local: (attr_name, local))
+
+
+    def set_attr(self, attr_name, value, indices=None):
+        if attr_name == "total_steps":
+            self.total_steps = value
+            return
+
+        self.call_workers("set_attr", indices, lambda local: (attr_name, value, local))
+
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name in self.local_methods:
+            return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+        return self.call_workers("env_method", indices, lambda local: (method_name, method_args, method_kwargs, local))
+
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+    def call_workers(self, command, indices, arguments):
+        indices = list(self._get_indices(indices))
+        calls = []
+
+        for pipe, (first, last) in zip(self.pipes, self.slices):
+            local = [i - first for i in indices if first <= i < last]
+
+            if len(local) > 0:
+                pipe.send((command, arguments(local)))
+                calls.append(pipe)
+
+        results = []
+
+        for pipe in calls:
+            result = pipe.recv()
+
+            if result is not None:
+                results.extend(result)
+
+        return results
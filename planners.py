@@ -0,0 +1,398 @@
+import heapq
+import math
+import numpy as np
+
+INF = float("inf")
+SQRT2 = math.sqrt(2)
+
+# planners work on the padded grid of Environment (1: obstacle), with cells as flat indices;
+# the walls around the map keep every neighbour of a free cell inside the grid, so there are no bound checks
+
+class Planner:
+    def __init__(self, moves):
+        self.moves = [tuple(int(value) for value in move) for move in moves]
+        self.width = None
+
+
+    def prepare(self, grid):
+        if grid.shape[1] != self.width:
+            self.width = grid.shape[1]
+            self.offsets = [row * self.width + column for row, column in self.moves]
+            self.actions = {offset: action for action, offset in enumerate(self.offsets)}
+
+        return (grid != 0).tobytes() # one byte per cell, much faster to index than the array
+
+
+    def cell(self, coordinates):
+        return int(coordinates[0]) * self.width + int(coordinates[1])
+
+
+    def heuristic(self, cell, goal):
+        row, column = divmod(cell, self.width)
+        goal_row, goal_column = divmod(goal, self.width)
+
+        return max(abs(row - goal_row), abs(column - goal_column)) # diagonal moves cost one step
+
+
+    def act(self, grid, position, target):
+        # returns the next move, or None when the target cannot be reached
+        raise NotImplementedError
+
+
+class PathPlanner(Planner):
+    # keeps the last path and only searches again when an obstacle moves onto it
+    def __init__(self, moves):
+        super(PathPlanner, self).__init__(moves)
+
+        self.path = []
+
+
+    def act(self, grid, position, target):
+        blocked = self.prepare(grid)
+        start, goal = self.cell(position), self.cell(target)
+
+        valid = (len(self.path) > 1 and self.path[0] == start and self.path[-1] == goal and
+                 not any(blocked[cell] for cell in self.path[1:]))
+
+        if not valid:
+            self.path = self.search(blocked, start, goal) or []
+
+        if len(self.path) < 2:
+            return None
+
+        self.path.pop(0)
+
+        return self.actions[self.path[0] - start]
+
+
+    def search(self, blocked, start, goal):
+        raise NotImplementedError
+
+
+    def reconstruct(self, parents, goal):
+        path = [goal]
+
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+
+        return path[::-1]
+
+
+class AStar(PathPlanner):
+    def search(self, blocked, start, goal):
+        distances = {start: 0}
+        parents = {start: None}
+        heap = [(self.heuristic(start, goal), 0, start)]
+
+        while heap:
+            _, distance, cell = heapq.heappop(heap)
+            distance = -distance # ties are broken towards the deepest cell
+
+            if cell == goal:
+                return self.reconstruct(parents, goal)
+            if distance > distances[cell]:
+                continue
+
+            for offset in self.offsets:
+                neighbour = cell + offset
+
+                if blocked[neighbour] or distances.get(neighbour, INF) <= distance + 1:
+                    continue
+
+                distances[neighbour] = distance + 1
+                parents[neighbour] = cell
+                heapq.heappush(heap, (distance + 1 + self.heuristic(neighbour, goal), -(distance + 1), neighbour))
+
+        return None
+
+
+class JumpPointSearch(PathPlanner):
+    # A* over jump points only (diagonal moves between two obstacles are allowed, as in the environment);
+    # the pruning rules assume octile costs, so paths can take a few more steps than A* with the environment's unit costs
+    def octile(self, cell, goal):
+        row, column = divmod(cell, self.width)
+        goal_row, goal_column = divmod(goal, self.width)
+        rows, columns = abs(row - goal_row), abs(column - goal_column)
+
+        return max(rows, columns) + (SQRT2 - 1) * min(rows, columns)
+
+
+    def search(self, blocked, start, goal):
+        distances = {start: 0.0}
+        parents = {start: None}
+        heap = [(self.octile(start, goal), 0.0, start, None)]
+
+        while heap:
+            _, distance, cell, direction = heapq.heappop(heap)
+            distance = -distance
+
+            if cell == goal:
+                return self.expand(self.reconstruct(parents, goal))
+            if distance > distances[cell]:
+                continue
+
+            for row_step, column_step in self.directions(blocked, cell, direction):
+                jump_point = self.jump(blocked, cell, row_step, column_step, goal)
+
+                if jump_point is None:
+                    continue
+
+                new_distance = distance + self.octile(cell, jump_point)
+
+                if distances.get(jump_point, INF) <= new_distance:
+                    continue
+
+                distances[jump_point] = new_distance
+                parents[jump_point] = cell
+                heapq.heappush(heap, (new_distance + self.octile(jump_point, goal), -new_distance, jump_point, (row_step, column_step)))
+
+        return None
+
+
+    def directions(self, blocked, cell, direction):
+        if direction is None:
+            return self.moves
+
+        row_step, column_step = direction
+        width = self.width
+
+        if row_step and column_step: # natural neighbours, plus the forced ones around obstacles behind the move
+            directions = [(row_step, 0), (0, column_step), (row_step, column_step)]
+
+            if blocked[cell - row_step * width]:
+                directions.append((-row_step, column_step))
+            if blocked[cell - column_step]:
+                directions.append((row_step, -column_step))
+        elif row_step:
+            directions = [(row_step, 0)]
+
+            if blocked[cell + 1]:
+                directions.append((row_step, 1))
+            if blocked[cell - 1]:
+                directions.append((row_step, -1))
+        else:
+            directions = [(0, column_step)]
+
+            if blocked[cell + width]:
+                directions.append((1, column_step))
+            if blocked[cell - width]:
+                directions.append((-1, column_step))
+
+        return directions
+
+
+    def jump(self, blocked, cell, row_step, column_step, goal):
+        width = self.width
+        step = row_step * width + column_step
+
+        while True:
+            cell += step
+
+            if blocked[cell]:
+                return None
+            if cell == goal:
+                return cell
+
+            if row_step and column_step:
+                if ((blocked[cell - row_step * width] and not blocked[cell - row_step * width + column_step]) or
+                    (blocked[cell - column_step] and not blocked[cell - column_step + row_step * width])):
+                    return cell
+                if (self.jump(blocked, cell, row_step, 0, goal) is not None or
+                    self.jump(blocked, cell, 0, column_step, goal) is not None):
+                    return cell
+            elif row_step:
+                if ((blocked[cell + 1] and not blocked[cell + 1 + row_step * width]) or
+                    (blocked[cell - 1] and not blocked[cell - 1 + row_step * width])):
+                    return cell
+            else:
+                if ((blocked[cell + width] and not blocked[cell + width + column_step]) or
+                    (blocked[cell - width] and not blocked[cell - width + column_step])):
+                    return cell
+
+
+    def expand(self, jump_points):
+        # consecutive jump points are on one straight or diagonal line
+        path = jump_points[:1]
+
+        for cell in jump_points[1:]:
+            row, column = divmod(path[-1], self.width)
+            next_row, next_column = divmod(cell, self.width)
+            step = int(np.sign(next_row - row)) * self.width + int(np.sign(next_column - column))
+
+            while path[-1] != cell:
+                path.append(path[-1] + step)
+
+        return path
+
+
+class DStarLite(Planner):
+    # incremental search from the target back to the UAV (Koenig and Likhachev, 2002): when obstacles move,
+    # only the distances around the changed cells are repaired instead of searching again from scratch
+    def __init__(self, moves):
+        super(DStarLite, self).__init__(moves)
+
+        self.goal = None
+
+
+    def initialize(self, blocked_cells, start, goal):
+        self.goal = goal
+        self.last_start = start
+        self.key_modifier = 0
+        self.blocked_cells = blocked_cells
+        self.blocked = blocked_cells.tobytes()
+
+        self.distances = {} # g values
+        self.lookahead = {goal: 0} # rhs values
+        self.queue = []
+        self.queued = {}
+
+        self.push(goal, (self.heuristic(start, goal), 0))
+
+
+    def key(self, cell, start):
+        value = min(self.distances.get(cell, INF), self.lookahead.get(cell, INF))
+
+        return (value + self.heuristic(start, cell) + self.key_modifier, value)
+
+
+    def push(self, cell, key):
+        self.queued[cell] = key
+        heapq.heappush(self.queue, (key, cell))
+
+
+    def top(self):
+        while self.queue: # entries are removed lazily
+            key, cell = self.queue[0]
+
+            if self.queued.get(cell) == key:
+                return key, cell
+
+            heapq.heappop(self.queue)
+
+        return None, None
+
+
+    def update_lookahead(self, cell):
+        if cell != self.goal:
+            self.lookahead[cell] = min((1 + self.distances.get(cell + offset, INF)
+                                        for offset in self.offsets if not self.blocked[cell + offset]), default=INF)
+
+
+    def update_cell(self, cell, start):
+        if self.distances.get(cell, INF) != self.lookahead.get(cell, INF):
+            self.push(cell, self.key(cell, start))
+        else:
+            self.queued.pop(cell, None)
+
+
+    def repair(self, cell, start):
+        # blocked cells cannot be entered, so their values are only repaired once they are free again
+        if cell == start or not self.blocked[cell]:
+            self.update_lookahead(cell)
+            self.update_cell(cell, start)
+
+
+    def compute_shortest_path(self, start):
+        while True:
+            key, cell = self.top()
+
+            if cell is None or (key >= self.key(start, start) and self.lookahead.get(start, INF) <= self.distances.get(start, INF)):
+                return
+
+            new_key = self.key(cell, start)
+
+            if key < new_key:
+                self.push(cell, new_key)
+                continue
+
+            del self.queued[cell]
+            distance = self.distances.get(cell, INF)
+            lookahead = self.lookahead.get(cell, INF)
+
+            if distance > lookahead: # cell becomes consistent, its neighbours may get shorter
+                self.distances[cell] = lookahead
+
+                if not self.blocked[cell]:
+                    for offset in self.offsets:
+                        neighbour = cell + offset
+
+                        if neighbour != self.goal and lookahead + 1 < self.lookahead.get(neighbour, INF):
+                            self.lookahead[neighbour] = lookahead + 1
+                            self.update_cell(neighbour, start)
+            else: # cell got longer, every neighbour that went through it is repaired
+                self.distances[cell] = INF
+                self.repair(cell, start)
+
+                for offset in self.offsets:
+                    self.repair(cell + offset, start)
+
+
+    def act(self, grid, position, target):
+        blocked = self.prepare(grid)
+        blocked_cells = np.frombuffer(blocked, dtype=bool)
+        start, goal = self.cell(position), self.cell(target)
+
+        if goal != self.goal or len(blocked_cells) != len(self.blocked_cells):
+            self.initialize(blocked_cells, start, goal)
+        else:
+            self.key_modifier += self.heuristic(self.last_start, start)
+            self.last_start = start
+
+            changed = np.flatnonzero(blocked_cells != self.blocked_cells)
+            self.blocked_cells = blocked_cells
+            self.blocked = blocked
+
+            # moving into a cell costs 1 if it is free, so a changed cell only affects the cells around it
+            # when a path can go through it
+            for cell in changed.tolist():
+                self.repair(cell, start)
+
+                if self.distances.get(cell, INF) < INF:
+                    for offset in self.offsets:
+                        self.repair(cell + offset, start)
+
+        self.compute_shortest_path(start)
+
+        costs = [INF if blocked[start + offset] else self.distances.get(start + offset, INF) for offset in self.offsets]
+        action = min(range(len(costs)), key=lambda action: (costs[action], self.heuristic(start + self.offsets[action], goal)))
+
+        return action if costs[action] < INF else None
+
+
+PLANNERS = {
+    "ASTAR": AStar,
+    "JPS"  : JumpPointSearch,
+    "DSTAR": DStarLite
+}
+
+class PlannerPolicy:
+    # stands in for a trained model in evaluation.py, with one planner per environment slot
+    def __init__(self, algorithm):
+        self.planner_class = PLANNERS[algorithm]
+        self.planners = {}
+
+
+    def reset(self, slot, environment):
+        self.planners[slot] = self.planner_class(environment.moves)
+
+
+    def act(self, slot, environment):
+        grid = environment.grid
+
+        if environment.mobile_obstacles and len(environment.mobile_obstacles_positions) > 0:
+            # mobile obstacles move after the UAV picks its move, so the cells they can reach are avoided too
+            grid = grid.copy()
+            positions = environment.mobile_obstacles_positions
+            rows = (positions[:, 0, np.newaxis] + environment.move_vectors[:, 0]).reshape(-1)
+            columns = (positions[:, 1, np.newaxis] + environment.move_vectors[:, 1]).reshape(-1)
+            grid[rows, columns] = 1
+            grid[environment.target[0], environment.target[1]] = environment.grid[environment.target[0], environment.target[1]]
+
+        action = self.planners[slot].act(grid, environment.position, environment.target)
+
+        if action is None: # no path: greedy move towards the target, preferring free and then safe cells
+            cells = environment.position + environment.move_vectors
+            distances = np.abs(cells - environment.target).max(axis=1)
+            action = np.lexsort((distances, grid[cells[:, 0], cells[:, 1]], environment.grid[cells[:, 0], cells[:, 1]]))[0]
+
+        return action
@@ -0,0 +1,99 @@
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+ENVIRONMENT_PHASES = ["reset", "step", "get_observation", "update_obstacles"]
+VEC_ENVIRONMENT_PHASES = ["reset", "step_wait", "reset_environments", "get_observations", "update_obstacles"]
+FLEET_ENVIRONMENT_PHASES = ["reset", "step_wait", "spawn", "get_observations", "update_obstacles"]
+
+class PhaseTimers:
+    # inclusive wall time and number of calls of the timed methods (step includes get_observation, for example)
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+
+    def add(self, phase, elapsed):
+        self.totals[phase] = self.totals.get(phase, 0.0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+
+    def merge(self, other):
+        for phase, total in other.totals.items():
+            self.totals[phase] = self.totals.get(phase, 0.0) + total
+            self.calls[phase] = self.calls.get(phase, 0) + other.calls[phase]
+
+
+    def mean_microseconds(self):
+        return {phase: total / self.calls[phase] * 1e6 for phase, total in self.totals.items()}
+
+
+def instrument(instance, phases):
+    # wraps the methods of this instance only, so environments without timers keep the plain methods
+    timers = PhaseTimers()
+
+    for phase in phases:
+        method = getattr(instance, phase)
+
+        def timed(*args, method=method, phase=phase, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            timers.add(phase, time.perf_counter() - start)
+
+            return result
+
+        setattr(instance, phase, timed)
+
+    return timers
+
+
+class SamplingProfiler:
+    # samples the Python stack of one thread from a background thread and writes it in the collapsed format
+    # ("outer;inner count" per line) read by flamegraph.pl, speedscope or inferno
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.labels = {} # code object -> frame label
+        self.running = False
+
+
+    def label(self, code):
+        if code not in self.labels:
+            self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+        return self.labels[code]
+
+
+    def sample(self, thread_id):
+        while self.running:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+
+            if len(stack) > 0:
+                self.samples[";".join(reversed(stack))] += 1
+
+            time.sleep(self.interval)
+
+
+    def start(self, thread=None):
+        self.running = True
+        thread_id = (thread or threading.current_thread()).ident
+        self.sampler = threading.Thread(target=self.sample, args=(thread_id,), daemon=True)
+        self.sampler.start()
+
+
+    def stop(self):
+        self.running = False
+        self.sampler.join()
+
+
+    def write(self, path):
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from map_generator import label_components
+import numpy as np
+
+CACHED_MAP_CELLS = 2**22 # padded cells of the maps kept, about 100 MB with their components
+CACHED_DISTANCE_CELLS = 2**25 # cells of the distance fields kept over all maps, 128 MB as int32
+
+class CellBoundedCache:
+    # least recently used entries are dropped first, once the entries hold more than max_cells cells in total
+    def __init__(self, max_cells):
+        self.max_cells = max_cells
+        self.cells = 0
+        self.entries = OrderedDict() # key -> (value, cells)
+
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+
+        return self.entries[key][0]
+
+
+    def add(self, key, value, cells):
+        self.entries[key] = (value, cells)
+        self.cells += cells
+
+        while self.cells > self.max_cells and len(self.entries) > 1: # the newest entry stays, whatever its size
+            _, (_, dropped) = self.entries.popitem(last=False)
+            self.cells -= dropped
+
+        return value
+
+
+distance_fields = CellBoundedCache(CACHED_DISTANCE_CELLS) # shared by the maps, so a large grid cannot hold thousands of fields
+
+class Reachability:
+    # connected components and distance fields of one map, in padded grid coordinates (flat indices)
+    def __init__(self, map, margin):
+        self.key = (map.name, margin)
+        self.width = map.shape[1] + 2 * margin
+        self.free = np.pad(map.codes != 1, margin) # padding walls are obstacles
+
+        labels = map.labels if map.labels is not None else label_components(map.codes != 1)[0] # the padding walls connect nothing
+        self.labels = np.pad(labels, margin, constant_values=-1).reshape(-1)
+
+        # the free cells with one more wall around them, so the neighbours of a cell are fixed offsets of its flat index
+        self.walled_width = self.width + 2
+        self.walled = np.pad(self.free, 1).reshape(-1)
+        self.offsets = np.array([di * self.walled_width + dj for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)])
+
+        free_cells = np.flatnonzero(self.labels >= 0)
+        self.cells = free_cells[np.argsort(self.labels[free_cells], kind="stable")] # free cells grouped by component
+        self.sizes = np.bincount(self.labels[free_cells])
+        self.starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+
+        self.ranks = np.zeros(len(self.labels), dtype=np.int64) # position of every free cell inside its component
+        self.ranks[self.cells] = np.arange(len(self.cells)) - self.starts[self.labels[self.cells]]
+
+        self.danger_cells = np.flatnonzero(np.pad(map.codes == 2, margin))
+
+
+    def sample_pair(self, np_random, grid):
+        # the target is drawn first (75% of the episodes close to a wall) and the start from the rest of its component
+        cells = grid.reshape(-1)
+
+        while True:
+            if np_random.random() < 0.75 and len(self.danger_cells) > 0:
+                target = self.danger_cells[np_random.integers(0, len(self.danger_cells))]
+            else:
+                target = self.cells[np_random.integers(0, len(self.cells))]
+
+            label = self.labels[target]
+            size = self.sizes[label]
+
+            if size < 2:
+                continue
+
+            index = np_random.integers(0, size - 1) # every cell of the component except the target
+            index += index >= self.ranks[target]
+            position = self.cells[self.starts[label] + index]
+
+            if cells[position] != 1 and cells[target] != 1: # mobile obstacles
+                return self.coordinates(position), self.coordinates(target)
+
+
+    def coordinates(self, cell):
+        return np.array(divmod(int(cell), self.width))
+
+
+    def distance_field(self, target):
+        key = self.key + (int(target[0]) * self.width + int(target[1]),)
+        distances = distance_fields.get(key)
+
+        if distances is not None:
+            return distances
+
+        # breadth-first search from the target, the frontier kept as flat indices: the work follows the cells reached,
+        # not the size of the grid times the distance
+        distances = np.full(len(self.walled), -1, dtype=np.int64)
+        frontier = np.array([(int(target[0]) + 1) * self.walled_width + int(target[1]) + 1])
+        distances[frontier] = 0
+        distance = 0
+
+        while len(frontier) > 0:
+            distance += 1
+            neighbours = (frontier[:, np.newaxis] + self.offsets).reshape(-1)
+            frontier = np.unique(neighbours[self.walled[neighbours] & (distances[neighbours] < 0)])
+            distances[frontier] = distance
+
+        distances = distances.reshape(-1, self.walled_width)[1:-1, 1:-1].astype(np.int32) # a compact copy, not a view of the walled grid
+
+        return distance_fields.add(key, distances, distances.size)
+
+
+    def distance(self, position, target):
+        return int(self.distance_field(target)[position[0], position[1]])
+
+
+cache = CellBoundedCache(CACHED_MAP_CELLS)
+
+def get_reachability(map, margin):
+    # maps are evicted least recently used first, which only happens with generated maps (there are only 32 text maps)
+    key = (map.name, margin)
+    reachability = cache.get(key)
+
+    if reachability is None:
+        reachability = Reachability(map, margin)
+        cache.add(key, reachability, len(reachability.labels))
+
+    return reachability
@@ -0,0 +1,170 @@
+import argparse
+from checkpoints import CHECKPOINTS_DIRECTORY, list_checkpoints
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+from environment import MAPS, UAV_VISION
+from evaluation import load_model, run_episodes
+from map_generator import make_map_source
+import multiprocessing as mp
+import numpy as np
+import os
+from results_cache import RESULTS_PATH, ResultsCache
+import time
+
+MODEL_EXTENSIONS = (".zip", ".npz")
+
+models = {} # loaded once per worker process and model, see run_chunk
+
+def find_models(paths):
+    # (label, model name) of the models to compare: the checkpoints of CheckpointStore directories (oldest first) and
+    # the models saved in other directories, or model files
+    found = []
+
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append((os.path.splitext(os.path.basename(path))[0], path))
+            continue
+
+        for checkpoint, manifest in list_checkpoints(path):
+            found.append((os.path.basename(checkpoint), os.path.join(checkpoint, "model.zip")))
+
+        for name in sorted(os.listdir(path)):
+            if name.endswith(MODEL_EXTENSIONS):
+                found.append((os.path.splitext(name)[0], os.path.join(path, name)))
+
+    return found
+
+
+def run_chunk(algorithm, model_name, episodes, seed, environment_kwargs, batch_size):
+    if model_name not in models:
+        models[model_name] = load_model(algorithm, model_name)
+
+        if not model_name.endswith(".npz"): # SB3 models run on torch, which is only imported for them
+            import torch
+
+            torch.set_num_threads(1) # the tasks are the parallelism
+
+    return run_episodes(models[model_name], episodes, seed, environment_kwargs, batch_size, MAPS)
+
+
+def map_success_rates(results, episodes):
+    # success rate on each testing map, episode i running on map i % MAPS + 1
+    successes = np.zeros(MAPS)
+
+    for episode in results.values():
+        successes[episode["episode"] % MAPS] += episode["outcome"] == "success"
+
+    return successes / episodes
+
+
+def write_matrix(path, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_matrix(rows):
+    print("| " + " | ".join(rows[0]) + " |")
+
+    for row in rows:
+        print("| " + " | ".join(f"{value:.3f}" if isinstance(value, float) else str(value) for value in row.values()) + " |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('paths', nargs='*', default=[CHECKPOINTS_DIRECTORY]) # checkpoint directories, directories of models or model files
+    parser.add_argument('--algorithm', type=str, default="PPO") # "PPO" or "DQN", ignored by the models exported to .npz
+    parser.add_argument('--episodes', type=int, default=20) # per testing map
+    parser.add_argument('--grid_size', nargs='+', default=[15, 15])
+    parser.add_argument('--mobile_obstacles', action='store_true', default=False)
+    parser.add_argument('--map_source', type=str, default="text") # "text", "generated" or a map file from map_generator.py
+    parser.add_argument('--vision', type=int, default=UAV_VISION) # the observation layout the models were trained with
+    parser.add_argument('--coarse_vision', type=int, default=0)
+    parser.add_argument('--coarse_pooling', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch_size', type=int, default=64) # episodes per task, run in lockstep
+    parser.add_argument('--workers', type=int, default=0) # processes running the tasks, 0 means one per core
+    parser.add_argument('--cache', type=str, default=RESULTS_PATH)
+    parser.add_argument('--output', type=str, default="regression_matrix.csv")
+
+    arguments = parser.parse_args()
+
+    grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
+
+    # the same episodes as evaluate.py --static_obstacles --all_maps --episodes (MAPS * episodes), so each run fills the other's cache
+    environment_kwargs = {
+        "grid_size"       : grid_size,
+        "static_obstacles": True,
+        "mobile_obstacles": arguments.mobile_obstacles,
+        "training"        : False,
+        "map_source"      : make_map_source(arguments.map_source, grid_size),
+        "telemetry"       : None,
+        "vision"          : arguments.vision,
+        "coarse_vision"   : arguments.coarse_vision,
+        "coarse_pooling"  : arguments.coarse_pooling
+    }
+
+    cache = ResultsCache(arguments.cache)
+    episodes = list(range(MAPS * arguments.episodes))
+    cells = [] # (label, model name, cache key, cached results) of every checkpoint
+    tasks = []
+
+    for label, model_name in find_models(arguments.paths):
+        key = (cache.model_hash(model_name), cache.configuration(arguments.algorithm, environment_kwargs, MAPS), arguments.seed)
+        results = cache.lookup(*key, episodes)
+        missing = [episode for episode in episodes if episode not in results]
+
+        cells.append((label, model_name, key, results))
+        tasks += [(len(cells) - 1, missing[i:i + arguments.batch_size]) for i in range(0, len(missing), arguments.batch_size)]
+
+    if len(cells) == 0:
+        raise SystemExit(f"No models found in {', '.join(arguments.paths)}")
+
+    missing_episodes = sum(len(chunk) for _, chunk in tasks)
+    workers = max(min(arguments.workers or os.cpu_count(), len(tasks)), 1)
+    start_time = time.perf_counter()
+
+    print(f"{len(cells)} models, {len(cells) * len(episodes) - missing_episodes} cached episodes, "
+          f"running {missing_episodes} in {len(tasks)} tasks over {workers} workers")
+
+    if len(tasks) > 0:
+        # with fork, the workers share the parsed maps and imported modules of this process; the tasks of a model are
+        # queued together, so a worker mostly reuses the model it loaded last
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+
+        if workers > 1 and any(not cells[cell][1].endswith(".npz") for cell, _ in tasks):
+            import stable_baselines3 # imported once here rather than by every worker
+
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            futures = {executor.submit(run_chunk, arguments.algorithm, cells[cell][1], chunk, arguments.seed, environment_kwargs, arguments.batch_size): cell
+                       for cell, chunk in tasks}
+
+            for future in as_completed(futures): # stored as they finish, an interrupted run keeps its progress
+                label, _, key, results = cells[futures[future]]
+                chunk_results = future.result()
+
+                cache.store(*key, chunk_results)
+                results.update((episode["episode"], episode) for episode in chunk_results)
+
+        print(f"Ran {missing_episodes} episodes in {time.perf_counter() - start_time:.1f} s")
+
+    cache.close()
+
+    rows = []
+
+    for label, model_name, _, results in cells:
+        rates = map_success_rates(results, arguments.episodes)
+        row = {"model": label}
+        row.update((f"map_{i + 1}", float(rate)) for i, rate in enumerate(rates))
+        row["success_rate"] = float(rates.mean())
+        row["mean_reward"] = float(np.mean([episode["reward"] for episode in results.values()]))
+        rows.append(row)
+
+    write_matrix(arguments.output, rows)
+    print_matrix(rows)
+
+    for i in range(MAPS): # a map getting worse in later checkpoints shows up here
+        best = max(rows, key=lambda row: row[f"map_{i + 1}"])
+        print(f"| map_{i + 1}: best {best['model']} ({best[f'map_{i + 1}']:.3f}), last {rows[-1]['model']} ({rows[-1][f'map_{i + 1}']:.3f})")
@@ -0,0 +1,201 @@
+import numpy as np
+import pygame
+
+BACKGROUND, VISION, TARGET, OBSTACLE, UAV = range(5) # what a cell shows, the highest code is drawn on top
+COLORS = np.array([
+    (200, 200, 200),
+    (255, 255, 255),
+    (255, 0, 0),
+    (0, 0, 0),
+    (0, 255, 0)
+], dtype=np.uint8)
+LINE_COLOR = (150, 150, 150) # grid lines, only visible on background and vision cells
+PANEL_COLOR = (20, 20, 20)
+PALETTE = np.repeat(COLORS, 2, axis=0) # color of code * 2 + (pixel on a grid line)
+PALETTE[2 * np.arange(TARGET) + 1] = LINE_COLOR
+MAX_DIRTY_RECTS = 64 # beyond that, the bounding box of the changed cells is updated at once
+TILE_PIXELS = 64 # cells at least that large are copied from a prepared tile, smaller ones are painted per pixel
+
+class Renderer:
+    # frames are drawn into one reusable (height, width, 3) NumPy buffer: the static map is rendered once per episode,
+    # then only the cells whose content changed (UAV, vision window, mobile obstacles, target) are repainted
+    def __init__(self, grid_size, vision, max_window_size=600, panel_height=50):
+        self.grid_size = tuple(grid_size)
+        self.margin = vision // 2
+
+        cell_size = max_window_size / max(self.grid_size)
+        self.row_edges = (np.arange(self.grid_size[0] + 1) * cell_size).astype(np.int64) # pixels of cell i: [edges[i], edges[i + 1])
+        self.column_edges = (np.arange(self.grid_size[1] + 1) * cell_size).astype(np.int64)
+        self.map_height = int(self.row_edges[-1])
+        self.size = (int(self.column_edges[-1]), self.map_height + panel_height) # (width, height), as pygame
+
+        self.frame = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self.map_frame = self.frame[:self.map_height]
+        self.panel = self.frame[self.map_height:]
+
+        # pixels on the border of their cell, where the grid lines are drawn
+        self.heights = np.diff(self.row_edges)
+        self.widths = np.diff(self.column_edges)
+        row_borders = np.zeros(self.map_height, dtype=bool)
+        row_borders[self.row_edges[:-1]] = True
+        row_borders[self.row_edges[1:] - 1] = True
+        column_borders = np.zeros(self.size[0], dtype=bool)
+        column_borders[self.column_edges[:-1]] = True
+        column_borders[self.column_edges[1:] - 1] = True
+        self.lines = (row_borders[:, np.newaxis] | column_borders[np.newaxis, :]).astype(np.uint8)
+
+        self.tiles = {} # (code, height, width) -> cell image with its grid lines
+
+        cells = self.grid_size[0] * self.grid_size[1]
+        self.static_codes = np.zeros(cells, dtype=np.uint8)
+        self.codes = np.zeros(cells, dtype=np.uint8) # content of the cells in the next frame
+        self.drawn = np.zeros(cells, dtype=np.uint8) # content painted in the buffer
+        self.dynamic_cells = np.zeros(0, dtype=np.int64)
+
+        window = np.arange(-self.margin, self.margin + 1)
+        self.window_rows = np.repeat(window, vision)
+        self.window_columns = np.tile(window, vision)
+
+        self.dirty = [] # pixel rectangles changed since the last show
+        self.text = None
+        self.surface = None
+
+        pygame.font.init() # the panel text is the only part drawn by pygame
+        self.font = pygame.font.SysFont("Ubuntu", 20)
+
+
+    def reset(self, static_grid=None):
+        # (rows, columns) array, nonzero on the static obstacles
+        if static_grid is None:
+            self.static_codes[:] = BACKGROUND
+        else:
+            self.static_codes[:] = np.where(np.asarray(static_grid).ravel() != 0, OBSTACLE, BACKGROUND)
+
+        codes = np.repeat(np.repeat(self.static_codes.reshape(self.grid_size), self.heights, axis=0), self.widths, axis=1)
+        np.take(PALETTE, 2 * codes + self.lines, axis=0, out=self.map_frame)
+
+        self.codes[:] = self.static_codes
+        self.drawn[:] = self.static_codes
+        self.dynamic_cells = np.zeros(0, dtype=np.int64)
+        self.dirty = [(0, 0, self.size[0], self.map_height)]
+
+
+    def update(self, position, target, obstacles=None, text=None):
+        # position, target and obstacles in map coordinates (without the margin of the padded grids)
+        rows = position[0] + self.window_rows
+        columns = position[1] + self.window_columns
+        inside = (rows >= 0) & (rows < self.grid_size[0]) & (columns >= 0) & (columns < self.grid_size[1])
+
+        cells = [rows[inside] * self.grid_size[1] + columns[inside], [target[0] * self.grid_size[1] + target[1]]]
+        layers = [np.full(np.count_nonzero(inside), VISION), [TARGET]]
+
+        if obstacles is not None and len(obstacles) > 0:
+            obstacles = np.asarray(obstacles)
+            cells.append(obstacles[:, 0] * self.grid_size[1] + obstacles[:, 1])
+            layers.append(np.full(len(obstacles), OBSTACLE))
+
+        cells.append([position[0] * self.grid_size[1] + position[1]])
+        layers.append([UAV])
+
+        cells = np.concatenate(cells).astype(np.int64)
+        previous = self.dynamic_cells
+
+        self.codes[previous] = self.static_codes[previous]
+        np.maximum.at(self.codes, cells, np.concatenate(layers).astype(np.uint8))
+        self.dynamic_cells = cells
+
+        dirty = np.unique(np.concatenate([previous, cells]))
+
+        self.paint(dirty[self.codes[dirty] != self.drawn[dirty]])
+
+        if text is not None and text != self.text:
+            self.draw_panel(text)
+
+
+    def paint(self, cells):
+        if len(cells) == 0:
+            return
+
+        rows, columns = np.divmod(cells, self.grid_size[1])
+        heights = self.heights[rows]
+        widths = self.widths[columns]
+        tops = self.row_edges[rows]
+        lefts = self.column_edges[columns]
+        codes = self.codes[cells]
+        self.drawn[cells] = codes
+
+        if self.heights[0] * self.widths[0] >= TILE_PIXELS:
+            for code, top, left, height, width in zip(codes.tolist(), tops.tolist(), lefts.tolist(), heights.tolist(), widths.tolist()):
+                self.map_frame[top:top + height, left:left + width] = self.tile(code, height, width)
+        else: # every pixel of the cells at once, so thousands of moving obstacles cost a few array operations
+            counts = heights * widths # 0 for cells thinner than a pixel on large grids
+            cell = np.repeat(np.arange(len(cells)), counts)
+            offsets = np.arange(len(cell)) - np.repeat(np.cumsum(counts) - counts, counts)
+            y = tops[cell] + offsets // widths[cell]
+            x = lefts[cell] + offsets % widths[cell]
+            self.map_frame[y, x] = PALETTE[2 * codes[cell] + self.lines[y, x]]
+
+        if len(cells) <= MAX_DIRTY_RECTS:
+            self.dirty.extend(zip(lefts.tolist(), tops.tolist(), widths.tolist(), heights.tolist()))
+        else:
+            self.dirty.append((int(lefts.min()), int(tops.min()), int((lefts + widths).max() - lefts.min()), int((tops + heights).max() - tops.min())))
+
+
+    def tile(self, code, height, width):
+        key = (code, height, width)
+
+        if key not in self.tiles:
+            lines = np.zeros((height, width), dtype=np.uint8)
+            lines[[0, -1], :] = 1
+            lines[:, [0, -1]] = 1
+            self.tiles[key] = PALETTE[2 * code + lines]
+
+        return self.tiles[key]
+
+
+    def draw_panel(self, text):
+        self.text = text
+        self.panel[:] = PANEL_COLOR
+
+        surface = self.font.render(text, True, (255, 255, 255), PANEL_COLOR)
+        rendered = np.frombuffer(pygame.image.tobytes(surface, "RGB"), dtype=np.uint8).reshape(surface.get_height(), surface.get_width(), 3)
+        height = min(rendered.shape[0], self.panel.shape[0] - 15)
+        width = min(rendered.shape[1], self.panel.shape[1] - 15)
+        self.panel[15:15 + height, 15:15 + width] = rendered[:height, :width]
+
+        self.dirty.append((0, self.map_height, self.size[0], self.panel.shape[0]))
+
+
+    def show(self, screen):
+        # copies the changed rectangles to the window
+        if self.surface is None:
+            self.surface = pygame.image.frombuffer(self.frame, self.size, "RGB") # shares the memory of the buffer
+
+        if len(self.dirty) > MAX_DIRTY_RECTS + 1:
+            self.dirty = [(0, 0, self.size[0], self.size[1])]
+
+        for rect in self.dirty:
+            screen.blit(self.surface, rect, rect)
+
+        pygame.display.update(self.dirty)
+        self.dirty = []
+
+
+class VideoWriter:
+    # frames of the renderer (RGB) written to a video file with OpenCV
+    def __init__(self, path, size, fps=10):
+        import cv2 # only needed to export videos
+
+        self.cv2 = cv2
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+        if not self.writer.isOpened():
+            raise IOError(f"Cannot write the video {path}")
+
+
+    def write(self, frame):
+        self.writer.write(self.cv2.cvtColor(frame, self.cv2.COLOR_RGB2BGR))
+
+
+    def close(self):
+        self.writer.release()
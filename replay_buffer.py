@@ -0,0 +1,262 @@
+import numpy as np
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import BaseBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+import torch as th
+import torch.nn.functional as F
+from typing import NamedTuple
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor # importance sampling weights
+    leaves: np.ndarray # where to update the priorities
+    discounts: th.Tensor = None # per transition, only in recent SB3 versions (n-step returns); gamma otherwise
+
+
+class CompactReplayBuffer(BaseBuffer):
+    # observations are stored losslessly as the relative position in cells (int16) and the 0/1 vision window as bits,
+    # and the next observation of a transition is the observation of the following slot (as optimize_memory_usage in SB3);
+    # only the next observations of truncated episodes are kept aside, the others are multiplied by done = 1 anyway
+    def __init__(self, buffer_size, observation_space, action_space, device="auto", n_envs=1, optimize_memory_usage=False, handle_timeout_termination=True, grid_size=(10, 10)):
+        super(CompactReplayBuffer, self).__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
+
+        buffer_size = self.buffer_size = max(buffer_size // n_envs, 1) # transitions over all environments, as in SB3
+        self.grid_dimensions = np.array(grid_size)
+        self.window_size = self.obs_shape[0] - 2
+        self.handle_timeout_termination = handle_timeout_termination
+
+        self.positions = np.zeros((buffer_size, n_envs, 2), dtype=np.int16)
+        self.windows = np.zeros((buffer_size, n_envs, (self.window_size + 7) // 8), dtype=np.uint8)
+        self.actions = np.zeros((buffer_size, n_envs), dtype=np.min_scalar_type(action_space.n - 1))
+        self.rewards = np.zeros((buffer_size, n_envs), dtype=np.float32)
+        self.dones = np.zeros((buffer_size, n_envs), dtype=bool)
+        self.truncations = np.zeros((buffer_size, n_envs), dtype=bool)
+        self.truncated_observations = {} # slot * n_envs + env -> encoded next observation
+
+
+    @property
+    def nbytes(self):
+        arrays = [self.positions, self.windows, self.actions, self.rewards, self.dones, self.truncations]
+
+        return sum(array.nbytes for array in arrays) + len(self.truncated_observations) * (self.positions.itemsize * 2 + self.windows.shape[2])
+
+
+    def encode(self, observations):
+        observations = np.asarray(observations).reshape(-1, self.obs_shape[0])
+        positions = np.rint(observations[:, :2] * self.grid_dimensions).astype(np.int16)
+
+        return positions, np.packbits(observations[:, 2:] > 0.5, axis=1)
+
+
+    def decode(self, positions, windows):
+        observations = np.empty((len(positions), self.obs_shape[0]), dtype=np.float32)
+        observations[:, :2] = positions / self.grid_dimensions # same operations as the environments, so the values are identical
+        observations[:, 2:] = np.unpackbits(windows, axis=1, count=self.window_size)
+
+        return observations
+
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        next_slot = (self.pos + 1) % self.buffer_size
+        truncated = np.array([info.get("TimeLimit.truncated", False) for info in infos])
+
+        for env in np.flatnonzero(self.truncations[self.pos]): # the overwritten transitions
+            del self.truncated_observations[self.pos * self.n_envs + env]
+
+        self.positions[self.pos], self.windows[self.pos] = self.encode(obs)
+        next_positions, next_windows = self.encode(next_obs)
+        self.positions[next_slot], self.windows[next_slot] = next_positions, next_windows # replaced by the reset observation after a done
+
+        for env in np.flatnonzero(truncated):
+            self.truncated_observations[self.pos * self.n_envs + env] = (next_positions[env], next_windows[env])
+
+        self.actions[self.pos] = np.asarray(action).reshape(self.n_envs)
+        self.rewards[self.pos] = np.asarray(reward).reshape(self.n_envs)
+        self.dones[self.pos] = np.asarray(done).reshape(self.n_envs)
+        self.truncations[self.pos] = truncated
+
+        self.pos += 1
+
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+
+    def sample(self, batch_size, env=None):
+        if self.full: # the observation of the current slot was overwritten by the last next observation
+            batch = (np.random.randint(1, self.buffer_size, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch = np.random.randint(0, self.pos, size=batch_size)
+
+        return self._get_samples(batch, np.random.randint(0, self.n_envs, size=batch_size), env)
+
+
+    def _get_samples(self, batch, envs, env=None):
+        next_batch = (batch + 1) % self.buffer_size
+
+        observations = self.decode(self.positions[batch, envs], self.windows[batch, envs])
+        next_observations = self.decode(self.positions[next_batch, envs], self.windows[next_batch, envs])
+        truncated = self.truncations[batch, envs]
+
+        for i in np.flatnonzero(truncated):
+            positions, windows = self.truncated_observations[batch[i] * self.n_envs + envs[i]]
+            next_observations[i] = self.decode(positions[np.newaxis], windows[np.newaxis])[0]
+
+        dones = self.dones[batch, envs]
+
+        if self.handle_timeout_termination: # only dones that are not due to timeouts
+            dones = dones & ~truncated
+
+        data = (
+            observations,
+            self.actions[batch, envs].astype(np.int64).reshape(-1, 1),
+            next_observations,
+            dones.astype(np.float32).reshape(-1, 1),
+            self.rewards[batch, envs].reshape(-1, 1)
+        )
+
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+
+class SumTree:
+    # binary tree of priority sums over a power of two of leaves, updated and searched for whole batches at once
+    def __init__(self, size):
+        self.depth = max(int(size - 1).bit_length(), 0)
+        self.capacity = 1 << self.depth
+        self.nodes = np.zeros(2 * self.capacity)
+
+
+    def total(self):
+        return self.nodes[1]
+
+
+    def get(self, leaves):
+        return self.nodes[leaves + self.capacity]
+
+
+    def update(self, leaves, priorities):
+        indices = np.asarray(leaves) + self.capacity
+        self.nodes[indices] = priorities
+
+        for _ in range(self.depth):
+            indices = np.unique(indices // 2)
+            self.nodes[indices] = self.nodes[2 * indices] + self.nodes[2 * indices + 1]
+
+
+    def rebuild(self):
+        # the sums of every level from the leaves, e.g. after loading them
+        for level in reversed(range(self.depth)):
+            first = 1 << level
+            self.nodes[first:2 * first] = self.nodes[2 * first:4 * first:2] + self.nodes[2 * first + 1:4 * first:2]
+
+
+    def find(self, values):
+        indices = np.ones(len(values), dtype=np.int64)
+
+        for _ in range(self.depth):
+            left = self.nodes[2 * indices]
+            right = values >= left
+            values = np.where(right, values - left, values)
+            indices = 2 * indices + right
+
+        return indices - self.capacity
+
+
+class PrioritizedReplayBuffer(CompactReplayBuffer):
+    # samples transitions in proportion to their last TD error (to the power of alpha), so the rare collisions and
+    # successes are replayed more often; the bias is corrected by importance sampling weights, beta being annealed to 1
+    def __init__(self, buffer_size, observation_space, action_space, device="auto", n_envs=1, optimize_memory_usage=False, handle_timeout_termination=True, grid_size=(10, 10), alpha=0.6, beta=0.4, epsilon=1e-6):
+        super(PrioritizedReplayBuffer, self).__init__(buffer_size, observation_space, action_space, device, n_envs, optimize_memory_usage, handle_timeout_termination, grid_size)
+
+        self.alpha = alpha
+        self.initial_beta = beta
+        self.beta = beta
+        self.epsilon = epsilon
+
+        self.tree = SumTree(self.buffer_size * n_envs) # leaf of a transition: slot * n_envs + env
+        self.max_priority = 1.0
+        self.envs = np.arange(n_envs)
+
+
+    @property
+    def nbytes(self):
+        return super(PrioritizedReplayBuffer, self).nbytes + self.tree.nodes.nbytes
+
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        slot = self.pos
+
+        super(PrioritizedReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+
+        # new transitions are replayed at least once, the oldest ones lost their observation to the last next observation
+        self.tree.update(slot * self.n_envs + self.envs, self.max_priority ** self.alpha)
+        self.tree.update(self.pos * self.n_envs + self.envs, 0.0)
+
+
+    def sample(self, batch_size, env=None):
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size) # one value per segment
+        leaves = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        batch, envs = np.divmod(leaves, self.n_envs)
+
+        probabilities = self.tree.get(leaves) / total
+        weights = (self.size() * self.n_envs * probabilities) ** -self.beta
+        weights /= weights.max() # normalized over the batch
+
+        samples = self._get_samples(batch, envs, env)
+
+        return PrioritizedReplayBufferSamples(samples.observations, samples.actions, samples.next_observations, samples.dones, samples.rewards,
+                                              weights=self.to_torch(weights.astype(np.float32).reshape(-1, 1)), leaves=leaves,
+                                              discounts=getattr(samples, "discounts", None))
+
+
+    def update_priorities(self, leaves, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(leaves, priorities ** self.alpha)
+
+
+class PrioritizedDQN(DQN):
+    # DQN weighting its loss by the importance sampling weights and feeding the TD errors back to the buffer
+    def __init__(self, *args, replay_buffer_class=PrioritizedReplayBuffer, **kwargs):
+        super(PrioritizedDQN, self).__init__(*args, replay_buffer_class=replay_buffer_class, **kwargs)
+
+
+    def train(self, gradient_steps, batch_size=100):
+        self.policy.set_training_mode(True)
+        self._update_learning_rate(self.policy.optimizer)
+
+        buffer = self.replay_buffer
+        buffer.beta = min(buffer.initial_beta + (1.0 - buffer.initial_beta) * (1.0 - self._current_progress_remaining), 1.0)
+
+        losses = []
+
+        for _ in range(gradient_steps):
+            replay_data = buffer.sample(batch_size, env=self._vec_normalize_env)
+            discounts = replay_data.discounts if replay_data.discounts is not None else self.gamma
+
+            with th.no_grad():
+                next_q_values, _ = self.q_net_target(replay_data.next_observations).max(dim=1)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * discounts * next_q_values.reshape(-1, 1)
+
+            current_q_values = th.gather(self.q_net(replay_data.observations), dim=1, index=replay_data.actions.long())
+
+            loss = (replay_data.weights * F.smooth_l1_loss(current_q_values, target_q_values, reduction="none")).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            buffer.update_priorities(replay_data.leaves, (target_q_values - current_q_values).detach().cpu().numpy().ravel())
+
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
+        self.logger.record("train/beta", buffer.beta)
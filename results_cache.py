@@ -0,0 +1,132 @@
+import hashlib
+import json
+from map_generator import ChunkedMaps, GeneratedMaps
+from map_registry import get_registry
+import os
+import sqlite3
+
+RESULTS_PATH = "models/results.sqlite"
+VERSION = 1 # increase when the meaning of the stored results changes
+# code the outcome of an episode depends on: results computed before any of these files changed are not reused
+SOURCES = ["environment.py", "evaluation.py", "map_generator.py", "map_registry.py", "numpy_policy.py", "obstacle_motion.py", "reachability.py", "vision.py"]
+COLUMNS = ["episode", "map", "outcome", "reward", "steps", "optimal_path_length"]
+
+source_digest = None
+
+def file_hash(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_source_digest():
+    global source_digest
+
+    if source_digest is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        source_digest = hashlib.sha256("".join(file_hash(os.path.join(directory, source)) for source in SOURCES).encode()).hexdigest()
+
+    return source_digest
+
+
+def describe_maps(map_source):
+    # what identifies the testing maps of a map source
+    if map_source is None: # text maps, by content
+        digest = hashlib.sha256()
+
+        for map in get_registry().group(False, "testing"):
+            digest.update(map.name.encode())
+            digest.update(map.codes.tobytes())
+
+        return {"text": digest.hexdigest()}
+    if isinstance(map_source, GeneratedMaps): # generated from their seed, by map_generator.py
+        return {"generated": list(map_source.shape), "seed": map_source.seed, "pool": map_source.pool, **map_source.parameters}
+    if isinstance(map_source, ChunkedMaps):
+        status = os.stat(map_source.path)
+        return {"file": os.path.abspath(map_source.path), "size": status.st_size, "modified": status.st_mtime_ns}
+
+    raise ValueError(f"unknown map source {map_source!r}")
+
+
+def resolve_model_path(model_name):
+    # SB3 adds .zip to the names it loads
+    return model_name if os.path.isfile(model_name) else model_name + ".zip"
+
+
+class ResultsCache:
+    # evaluation results of every episode, keyed by (model file hash, configuration hash, seed, episode). Episodes are
+    # deterministic (see episode_seed in evaluation.py) and episode i of an evaluation over every map always runs on map
+    # i % map_count + 1, so the results of any evaluation, or any map of it, can be read back instead of recomputed
+    def __init__(self, path=RESULTS_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL") # readers are not blocked by a writing process
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, size INTEGER, modified INTEGER, hash TEXT);
+            CREATE TABLE IF NOT EXISTS configurations (hash TEXT PRIMARY KEY, description TEXT);
+            CREATE TABLE IF NOT EXISTS episodes (
+                model TEXT, configuration TEXT, seed INTEGER, episode INTEGER,
+                map TEXT, outcome TEXT, reward REAL, steps INTEGER, optimal_path_length INTEGER,
+                PRIMARY KEY (model, configuration, seed, episode)
+            ) WITHOUT ROWID;
+        """)
+
+
+    def model_hash(self, model_name):
+        # files are hashed again only when their size or modification time changed
+        path = os.path.abspath(resolve_model_path(model_name))
+        status = os.stat(path)
+        row = self.connection.execute("SELECT size, modified, hash FROM models WHERE path = ?", (path,)).fetchone()
+
+        if row is not None and row[:2] == (status.st_size, status.st_mtime_ns):
+            return row[2]
+
+        digest = file_hash(path)
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)", (path, status.st_size, status.st_mtime_ns, digest))
+
+        return digest
+
+
+    def configuration(self, algorithm, environment_kwargs, map_count=None):
+        description = {
+            "version"    : VERSION,
+            "algorithm"  : algorithm,
+            "environment": {name: value for name, value in environment_kwargs.items() if name not in ("map_source", "telemetry")},
+            "maps"       : describe_maps(environment_kwargs.get("map_source")),
+            "map_count"  : map_count,
+            "code"       : get_source_digest()
+        }
+        text = json.dumps(description, sort_keys=True)
+        digest = hashlib.sha256(text.encode()).hexdigest()
+
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO configurations VALUES (?, ?)", (digest, text))
+
+        return digest
+
+
+    def lookup(self, model, configuration, seed, episodes):
+        episodes = set(episodes)
+        rows = self.connection.execute(f"SELECT {', '.join(COLUMNS)} FROM episodes WHERE model = ? AND configuration = ? AND seed = ?",
+                                       (model, configuration, seed))
+
+        return {row[0]: dict(zip(COLUMNS, row)) for row in rows if row[0] in episodes}
+
+
+    def store(self, model, configuration, seed, results):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [(model, configuration, seed, int(episode["episode"]), episode["map"], episode["outcome"], float(episode["reward"]),
+                                          int(episode["steps"]), int(episode["optimal_path_length"])) for episode in results])
+
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,289 @@
+import argparse
+from callbacks import TrialEvalCallback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+from curriculum import make_curriculum
+from environment import MAPS, UAV_VISION, Environment
+import json
+from map_generator import make_map_source
+from map_registry import get_registry
+import multiprocessing as mp
+import numpy as np
+import os
+from reachability import get_reachability
+from replay_buffer import CompactReplayBuffer
+from stable_baselines3 import DQN, PPO
+from stable_baselines3.common.vec_env import VecMonitor
+import time
+import torch
+from vec_environment import VecEnvironment
+from vision import vision_margin
+
+ALGORITHMS = {"DQN": DQN, "PPO": PPO}
+
+# the hyperparameters of train_DQN.py and train_PPO.py, overridden by the sampled ones
+DEFAULT_HYPERPARAMETERS = {
+    "DQN": {
+        "learning_rate"         : 3e-5,
+        "buffer_size"           : 200000,
+        "learning_starts"       : 5000,
+        "batch_size"            : 128,
+        "gamma"                 : 0.99,
+        "exploration_fraction"  : 0.2,
+        "exploration_final_eps" : 0.01,
+        "train_freq"            : 16,
+        "target_update_interval": 5000,
+        "gradient_steps"        : 1
+    },
+    "PPO": {
+        "learning_rate": 5e-5,
+        "gamma"        : 0.995,
+        "n_steps"      : 1024,
+        "batch_size"   : 256,
+        "n_epochs"     : 10,
+        "clip_range"   : 0.2
+    }
+}
+
+# a list is a choice between its values, {"low", "high"} a uniform range and {"low", "high", "log": true} a log-uniform
+# one (integer bounds give integer values); --space FILE replaces these with the same structure in JSON
+DEFAULT_SPACES = {
+    "DQN": {
+        "learning_rate"         : {"low": 1e-5, "high": 1e-3, "log": True},
+        "buffer_size"           : [50000, 100000, 200000],
+        "batch_size"            : [64, 128, 256],
+        "gamma"                 : [0.98, 0.99, 0.995],
+        "exploration_fraction"  : {"low": 0.05, "high": 0.3},
+        "exploration_final_eps" : {"low": 0.01, "high": 0.1, "log": True},
+        "train_freq"            : [4, 8, 16],
+        "target_update_interval": [1000, 5000, 10000]
+    },
+    "PPO": {
+        "learning_rate": {"low": 1e-5, "high": 1e-3, "log": True},
+        "n_steps"      : [256, 512, 1024, 2048],
+        "batch_size"   : [64, 128, 256],
+        "gamma"        : [0.98, 0.99, 0.995],
+        "n_epochs"     : [5, 10, 20],
+        "clip_range"   : [0.1, 0.2, 0.3],
+        "ent_coef"     : {"low": 1e-4, "high": 1e-2, "log": True}
+    }
+}
+
+COLUMNS = ["trial", "status", "evaluations", "timesteps", "best_reward", "final_reward", "best_success_rate", "elapsed"]
+
+sweep = {} # set once per worker process, see initialize_worker
+
+def sample_hyperparameters(space, rng):
+    hyperparameters = {}
+
+    for name, values in space.items():
+        if isinstance(values, list):
+            hyperparameters[name] = values[int(rng.integers(len(values)))]
+        elif values.get("log", False):
+            value = float(np.exp(rng.uniform(np.log(values["low"]), np.log(values["high"]))))
+            hyperparameters[name] = int(round(value)) if isinstance(values["low"], int) and isinstance(values["high"], int) else value
+        elif isinstance(values["low"], int) and isinstance(values["high"], int):
+            hyperparameters[name] = int(rng.integers(values["low"], values["high"] + 1))
+        else:
+            hyperparameters[name] = float(rng.uniform(values["low"], values["high"]))
+
+    return hyperparameters
+
+
+class MedianPruner:
+    # stops a trial whose best mean reward so far is below the median of the other trials at the same evaluation;
+    # the rewards live in shared memory, so the trials running in other processes see each other's progress
+    def __init__(self, trials, evaluations, n_startup_trials=2, n_warmup_evaluations=1, context=mp):
+        self.trials = trials
+        self.evaluations = evaluations
+        self.n_startup_trials = n_startup_trials # trials that must have reached an evaluation before it prunes anything
+        self.n_warmup_evaluations = n_warmup_evaluations # evaluations of a trial before it can be pruned
+        self.values = context.Array("d", trials * evaluations)
+
+        self.table()[:] = np.nan
+
+
+    def table(self):
+        return np.frombuffer(self.values.get_obj()).reshape(self.trials, self.evaluations)
+
+
+    def report(self, trial, evaluation, reward):
+        if evaluation >= self.evaluations: # a rounding of the evaluation frequency, nothing to compare with
+            return False
+
+        with self.values.get_lock():
+            values = self.table()
+            best = reward if evaluation == 0 else max(reward, values[trial, evaluation - 1])
+            values[trial, evaluation] = best
+            others = np.delete(values[:, evaluation], trial)
+            others = others[~np.isnan(others)]
+
+        if evaluation < self.n_warmup_evaluations or len(others) < self.n_startup_trials:
+            return False
+
+        return best < np.median(others)
+
+
+def warm_map_caches(environment_kwargs):
+    # text maps, their padded grids and distance fields are built once here and shared by the forked workers
+    if environment_kwargs["static_obstacles"] and environment_kwargs["map_source"] is None:
+        margin = vision_margin(environment_kwargs["vision"], environment_kwargs["coarse_vision"], environment_kwargs["coarse_pooling"])
+
+        for map in get_registry().maps.values():
+            map.get_grid(margin)
+            map.get_danger_coordinates(margin)
+            get_reachability(map, margin)
+
+            if environment_kwargs["coarse_vision"] > 0:
+                map.get_summed_area_table(margin)
+
+
+def initialize_worker(state):
+    sweep.update(state)
+    torch.set_num_threads(1) # the trials are the parallelism
+
+
+def make_training_environment(n_envs, environment_kwargs, curriculum):
+    if n_envs > 1: # all environments are stepped at once as stacked arrays
+        return VecMonitor(VecEnvironment(n_envs, **environment_kwargs, curriculum=curriculum))
+
+    return Environment(**environment_kwargs, curriculum=curriculum)
+
+
+def run_trial(trial, hyperparameters):
+    arguments = sweep["arguments"]
+    start_time = time.perf_counter()
+
+    environment = make_training_environment(arguments.n_envs, sweep["environment_kwargs"], make_curriculum(arguments.curriculum))
+
+    callback = TrialEvalCallback(
+        {**sweep["environment_kwargs"], "training": False},
+        eval_freq=max(arguments.eval_timesteps // arguments.n_envs, 1), # callbacks count vectorized steps, not timesteps
+        pruner=sweep["pruner"],
+        trial=trial,
+        n_eval_episodes=arguments.n_eval_episodes,
+        seed=42,
+        map_count=MAPS if arguments.eval_all_maps else None
+    )
+
+    kwargs = {**DEFAULT_HYPERPARAMETERS[arguments.algorithm], **hyperparameters}
+
+    if arguments.algorithm == "DQN":
+        kwargs["replay_buffer_class"] = CompactReplayBuffer
+        kwargs["replay_buffer_kwargs"] = {"grid_size": sweep["environment_kwargs"]["grid_size"]}
+
+    model = ALGORITHMS[arguments.algorithm](policy="MlpPolicy", env=environment, verbose=0, seed=arguments.seed + trial, **kwargs)
+    model.learn(total_timesteps=arguments.timesteps, callback=callback)
+
+    if not callback.pruned:
+        model.save(os.path.join(arguments.output, f"trial_{trial}"))
+
+    environment.close()
+
+    return {
+        "trial"            : trial,
+        "status"           : "pruned" if callback.pruned else "complete",
+        "evaluations"      : len(callback.rewards),
+        "timesteps"        : model.num_timesteps,
+        "best_reward"      : max(callback.rewards, default=np.nan),
+        "final_reward"     : callback.rewards[-1] if len(callback.rewards) > 0 else np.nan,
+        "best_success_rate": max(callback.success_rates, default=np.nan),
+        "elapsed"          : time.perf_counter() - start_time,
+        **hyperparameters
+    }
+
+
+def write_results(path, results, names):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS + names + ["error"], restval="")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_results(results, names):
+    print("| " + " | ".join(COLUMNS + names) + " |")
+
+    for result in results:
+        values = [result.get(column, "") for column in COLUMNS + names]
+        print("| " + " | ".join(f"{value:.4g}" if isinstance(value, float) else str(value) for value in values) + " |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--algorithm', type=str, default="DQN") # "DQN" or "PPO"
+    parser.add_argument('--trials', type=int, default=8)
+    parser.add_argument('--timesteps', type=int, required=True) # per trial
+    parser.add_argument('--grid_size', nargs='+', required=True)
+    parser.add_argument('--static_obstacles', action='store_true', default=False)
+    parser.add_argument('--mobile_obstacles', action='store_true', default=False)
+    parser.add_argument('--map_source', type=str, default="text") # "text", "generated" or a map file from map_generator.py
+    parser.add_argument('--n_envs', type=int, default=8) # per trial, stepped together in its process
+    parser.add_argument('--workers', type=int, default=0) # trials running at once, 0 means one per core
+    parser.add_argument('--space', type=str, default=None) # JSON search space, see DEFAULT_SPACES
+    parser.add_argument('--vision', type=int, default=UAV_VISION) # odd size of the vision window
+    parser.add_argument('--coarse_vision', type=int, default=0) # size of the max-pooled coarse view, 0 for none
+    parser.add_argument('--coarse_pooling', type=int, default=3) # cells summarized by a coarse cell, per side
+    parser.add_argument('--curriculum', type=str, default="steps")
+    parser.add_argument('--eval_timesteps', type=int, default=20000) # timesteps between the evaluations used for pruning
+    parser.add_argument('--n_eval_episodes', type=int, default=20)
+    parser.add_argument('--eval_all_maps', action='store_true', default=False)
+    parser.add_argument('--n_startup_trials', type=int, default=2) # no pruning before this many trials reached an evaluation
+    parser.add_argument('--n_warmup_evaluations', type=int, default=1) # no pruning during the first evaluations of a trial
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default="sweeps") # results.csv and the models of the completed trials
+
+    arguments = parser.parse_args()
+
+    grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
+    workers = min(arguments.workers or os.cpu_count(), arguments.trials)
+
+    if arguments.space is not None:
+        with open(arguments.space) as file:
+            space = json.load(file)
+    else:
+        space = DEFAULT_SPACES[arguments.algorithm]
+
+    rng = np.random.default_rng(arguments.seed)
+    trials = [sample_hyperparameters(space, rng) for _ in range(arguments.trials)]
+    names = list(space)
+
+    environment_kwargs = {
+        "grid_size"       : grid_size,
+        "static_obstacles": arguments.static_obstacles,
+        "mobile_obstacles": arguments.mobile_obstacles,
+        "map_source"      : make_map_source(arguments.map_source, grid_size),
+        "vision"          : arguments.vision,
+        "coarse_vision"   : arguments.coarse_vision,
+        "coarse_pooling"  : arguments.coarse_pooling
+    }
+
+    os.makedirs(arguments.output, exist_ok=True)
+    warm_map_caches(environment_kwargs)
+
+    # with fork, the workers share the parsed maps, the imported modules and the pruner of this process
+    context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+    pruner = MedianPruner(arguments.trials, max(arguments.timesteps // arguments.eval_timesteps, 1),
+                          arguments.n_startup_trials, arguments.n_warmup_evaluations, context)
+    state = {"arguments": arguments, "environment_kwargs": environment_kwargs, "pruner": pruner}
+    results = []
+
+    print(f"Sweeping {arguments.trials} {arguments.algorithm} trials over {workers} workers")
+
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=initialize_worker, initargs=(state,)) as executor:
+        futures = {executor.submit(run_trial, trial, hyperparameters): trial for trial, hyperparameters in enumerate(trials)}
+
+        for future in as_completed(futures):
+            trial = futures[future]
+
+            try:
+                result = future.result()
+            except Exception as error: # e.g. incompatible hyperparameters, the other trials go on
+                result = {"trial": trial, "status": "failed", "error": repr(error), **trials[trial]}
+
+            results.append(result)
+            print(f"Trial {trial} {result['status']}" + (f", best reward {result['best_reward']:.3f}" if result["status"] != "failed" else f": {result['error']}"))
+
+    results.sort(key=lambda result: -result["best_reward"] if not np.isnan(result.get("best_reward", np.nan)) else np.inf)
+    write_results(os.path.join(arguments.output, "results.csv"), results, names)
+    print_results(results, names)
@@ -0,0 +1,338 @@
+import argparse
+import atexit
+import json
+import numpy as np
+import os
+import struct
+import time
+
+CHUNK_HEADER = struct.Struct("<4sI") # magic, length of the JSON header
+MAGIC = b"UAVT"
+BUFFER_STEPS = 65536
+TABLES = ["episodes", "steps"]
+
+recorders = {}
+
+class TelemetryRecorder:
+    # per-episode and per-step data of the environments sharing it, kept in preallocated columns and appended to
+    # the file as one chunk (a JSON header followed by the raw bytes of every column) whenever the buffers are full
+    def __init__(self, path, buffer_steps=BUFFER_STEPS):
+        self.path = path
+        self.buffer_steps = buffer_steps
+        self.grid_size = None
+        self.steps = None # columns, allocated for the grid size of the first episode
+        self.rows = 0
+        self.episodes = [] # finished episodes, few compared to the steps
+        self.open_episodes = {}
+        self.next_episode = 0
+
+        atexit.register(self.flush)
+
+
+    def allocate(self, grid_size):
+        self.grid_size = tuple(grid_size)
+        max_obstacles = (grid_size[0] * grid_size[1]) // 50 # as in the environments
+
+        self.steps = {
+            "episode"  : np.zeros(self.buffer_steps, dtype=np.int64),
+            "step"     : np.zeros(self.buffer_steps, dtype=np.int32),
+            "action"   : np.zeros(self.buffer_steps, dtype=np.uint8),
+            "reward"   : np.zeros(self.buffer_steps, dtype=np.float32),
+            "position" : np.zeros((self.buffer_steps, 2), dtype=np.int16),
+            "obstacles": np.zeros((self.buffer_steps, max_obstacles, 2), dtype=np.int16) # -1 after the last obstacle
+        }
+
+
+    def obstacle_positions(self, environment):
+        obstacles = np.full(self.steps["obstacles"].shape[1:], -1, dtype=np.int16)
+
+        if environment.mobile_obstacles:
+            obstacles[:len(environment.mobile_obstacles_positions)] = environment.mobile_obstacles_positions - environment.margin
+
+        return obstacles
+
+
+    def start_episode(self, environment, seed=None, episode=None):
+        if self.grid_size is None:
+            self.allocate(environment.grid_size)
+        elif self.grid_size != tuple(environment.grid_size):
+            raise ValueError(f"Telemetry of {self.path} is recorded for {self.grid_size} grids, not {tuple(environment.grid_size)}")
+
+        self.open_episodes.pop(environment.telemetry_episode, None) # reset before the end of the episode
+
+        if episode is None:
+            episode = self.next_episode
+
+        self.next_episode = max(self.next_episode, episode + 1)
+
+        if environment.map is not None:
+            static_grid = np.packbits(environment.map.codes == 1)
+        else:
+            static_grid = np.packbits(np.zeros(environment.grid_size, dtype=bool))
+
+        self.open_episodes[episode] = {
+            "episode"            : episode,
+            "seed"               : -1 if seed is None else seed,
+            "map"                : environment.map.name if environment.map is not None else "empty",
+            "difficulty"         : environment.difficulty if environment.map is not None else "none",
+            "grid_size"          : self.grid_size,
+            "vision"             : environment.vision, # observation layout, the replays draw the same vision window
+            "coarse_vision"      : environment.coarse_view.size if environment.coarse_view is not None else 0,
+            "coarse_pooling"     : environment.coarse_view.pooling if environment.coarse_view is not None else 0,
+            "static_grid"        : static_grid,
+            "start"              : environment.position - environment.margin,
+            "target"             : environment.target - environment.margin,
+            "optimal_path_length": environment.optimal_path_length,
+            "initial_obstacles"  : self.obstacle_positions(environment),
+            "steps"              : 0,
+            "reward"             : 0.0
+        }
+
+        return episode
+
+
+    def record_step(self, environment, action, reward, terminated, truncated):
+        episode = self.open_episodes[environment.telemetry_episode]
+        episode["steps"] += 1
+        episode["reward"] += float(reward)
+
+        row = self.rows
+        self.steps["episode"][row] = episode["episode"]
+        self.steps["step"][row] = episode["steps"]
+        self.steps["action"][row] = action
+        self.steps["reward"][row] = reward
+        self.steps["position"][row] = environment.position - environment.margin
+
+        if environment.mobile_obstacles:
+            self.steps["obstacles"][row] = self.obstacle_positions(environment)
+
+        self.rows += 1
+
+        if terminated or truncated:
+            episode["outcome"] = "success" if terminated and reward > 0 else "collision" if terminated else "truncation"
+            self.episodes.append(self.open_episodes.pop(episode["episode"]))
+
+        if self.rows == self.buffer_steps:
+            self.flush()
+
+
+    def encode_chunk(self, table, columns, rows):
+        header = {"table": table, "rows": rows, "columns": []}
+        blocks = []
+
+        for name, values in columns.items():
+            if isinstance(values, list): # strings are stored in the header
+                header["columns"].append({"name": name, "dtype": "str", "values": values})
+            else:
+                values = np.ascontiguousarray(values[:rows])
+                header["columns"].append({"name": name, "dtype": values.dtype.str, "shape": list(values.shape[1:])})
+                blocks.append(values.tobytes())
+
+        encoded = json.dumps(header).encode()
+
+        return CHUNK_HEADER.pack(MAGIC, len(encoded)) + encoded + b"".join(blocks)
+
+
+    def flush(self):
+        chunks = []
+
+        if self.rows > 0:
+            chunks.append(self.encode_chunk("steps", self.steps, self.rows))
+
+        if len(self.episodes) > 0:
+            columns = {}
+
+            for name in self.episodes[0]:
+                values = [episode[name] for episode in self.episodes]
+                columns[name] = values if isinstance(values[0], str) else np.array(values)
+
+            chunks.append(self.encode_chunk("episodes", columns, len(self.episodes)))
+
+        if len(chunks) == 0:
+            return
+
+        # a single appending write per flush, so processes recording into the same file do not interleave chunks
+        data = b"".join(chunks)
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            while len(data) > 0:
+                data = data[os.write(descriptor, data):]
+        finally:
+            os.close(descriptor)
+
+        self.rows = 0
+        self.episodes = []
+
+
+def make_recorder(telemetry):
+    if telemetry is None or isinstance(telemetry, TelemetryRecorder):
+        return telemetry
+
+    key = (telemetry, os.getpid()) # environments of a process share one recorder, forked workers get their own
+
+    if key not in recorders:
+        recorders[key] = TelemetryRecorder(telemetry)
+
+    return recorders[key]
+
+
+def read_telemetry(path):
+    tables = {table: {} for table in TABLES}
+
+    with open(path, "rb") as file:
+        data = memoryview(file.read())
+
+    offset = 0
+
+    while offset < len(data):
+        magic, length = CHUNK_HEADER.unpack_from(data, offset)
+
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a telemetry file (or is corrupted at byte {offset})")
+
+        header = json.loads(bytes(data[offset + CHUNK_HEADER.size:offset + CHUNK_HEADER.size + length]))
+        offset += CHUNK_HEADER.size + length
+        rows = header["rows"]
+
+        for column in header["columns"]:
+            chunks = tables[header["table"]].setdefault(column["name"], [])
+
+            if column["dtype"] == "str":
+                chunks.append(np.array(column["values"]))
+                continue
+
+            dtype = np.dtype(column["dtype"])
+            count = rows * int(np.prod(column["shape"], dtype=np.int64))
+            chunks.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape([rows] + column["shape"]))
+            offset += count * dtype.itemsize
+
+    return {table: {name: np.concatenate(chunks) for name, chunks in columns.items()} for table, columns in tables.items()}
+
+
+class EpisodeReplay:
+    # rebuilds an episode only from the recorded data, so it is shown exactly as it happened
+    def __init__(self, telemetry, episode):
+        episodes = telemetry["episodes"]
+        index = np.flatnonzero(episodes["episode"] == episode)
+
+        if len(index) == 0:
+            raise ValueError(f"Episode {episode} was not recorded (or did not finish)")
+
+        self.episode = {name: values[index[-1]] for name, values in episodes.items()}
+
+        steps = telemetry["steps"]
+        rows = np.flatnonzero(steps["episode"] == episode)[-int(self.episode["steps"]):] # the last recording of a repeated id
+
+        self.grid_size = tuple(int(size) for size in self.episode["grid_size"])
+        self.vision = int(self.episode["vision"]) if "vision" in self.episode else None # not recorded in older files
+        self.static_grid = np.unpackbits(self.episode["static_grid"], count=self.grid_size[0] * self.grid_size[1]).reshape(self.grid_size)
+        self.actions = steps["action"][rows]
+        self.rewards = steps["reward"][rows]
+        self.positions = np.concatenate([self.episode["start"][np.newaxis], steps["position"][rows]])
+        self.obstacles = np.concatenate([self.episode["initial_obstacles"][np.newaxis], steps["obstacles"][rows]])
+
+
+    def __len__(self):
+        return len(self.positions)
+
+
+    def frame(self, step):
+        # grid with the obstacles, position and target of the UAV after a step (0 is the reset)
+        grid = self.static_grid.copy()
+        obstacles = self.obstacles[step]
+        obstacles = obstacles[obstacles[:, 0] >= 0]
+        grid[obstacles[:, 0], obstacles[:, 1]] = 1
+
+        return grid, self.positions[step], self.episode["target"]
+
+
+    def text(self, step):
+        grid, position, target = self.frame(step)
+        characters = np.where(grid == 1, "#", ".")
+        characters[target[0], target[1]] = "T"
+        characters[position[0], position[1]] = "U" if grid[position[0], position[1]] == 0 else "X"
+
+        return "\n".join("".join(row) for row in characters)
+
+
+    def render(self, interval, video=None):
+        # in a window, or headless into a video file (one frame per interval)
+        import pygame # only needed to render
+        from environment import MAX_WINDOW_SIZE, PANEL_HEIGHT, UAV_VISION
+        from renderer import Renderer, VideoWriter
+
+        renderer = Renderer(self.grid_size, self.vision if self.vision is not None else UAV_VISION, MAX_WINDOW_SIZE, PANEL_HEIGHT)
+        renderer.reset(self.static_grid)
+        writer = None
+
+        if video is not None:
+            writer = VideoWriter(video, renderer.size, fps=1 / interval)
+        else:
+            pygame.init()
+            screen = pygame.display.set_mode(renderer.size)
+            pygame.display.set_caption("UAV Path Finding")
+
+        target = self.episode["target"]
+
+        for step in range(len(self)):
+            obstacles = self.obstacles[step]
+            position = self.positions[step]
+            renderer.update(position, target, obstacles[obstacles[:, 0] >= 0],
+                            f"Relative position: {np.round((target - position) / np.array(self.grid_size), 2)}")
+
+            if writer is not None:
+                writer.write(renderer.frame)
+            else:
+                renderer.show(screen)
+                time.sleep(interval)
+
+        if writer is not None:
+            writer.close()
+        else:
+            pygame.quit()
+
+
+def list_episodes(telemetry, outcome=None, map_name=None):
+    episodes = telemetry["episodes"]
+
+    print("| Episode | Map | Outcome | Steps | Optimal | Reward |")
+
+    for i in np.argsort(episodes["episode"], kind="stable"):
+        if outcome is not None and episodes["outcome"][i] != outcome:
+            continue
+        if map_name is not None and episodes["map"][i] != map_name:
+            continue
+
+        print(f"| {episodes['episode'][i]} | {episodes['map'][i]} | {episodes['outcome'][i]} | {episodes['steps'][i]} | "
+              f"{episodes['optimal_path_length'][i]} | {episodes['reward'][i]:.3f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('path', type=str) # recorded with --telemetry
+    parser.add_argument('--episode', type=int, default=None) # replays this episode, lists them otherwise
+    parser.add_argument('--outcome', type=str, default=None) # only lists "success", "collision" or "truncation" episodes
+    parser.add_argument('--map', type=str, default=None)
+    parser.add_argument('--text', action='store_true', default=False) # prints the frames instead of rendering them
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--video', type=str, default=None) # writes the replay to this video file instead of showing it
+
+    arguments = parser.parse_args()
+
+    telemetry = read_telemetry(arguments.path)
+
+    if arguments.episode is None:
+        list_episodes(telemetry, arguments.outcome, arguments.map)
+    else:
+        replay = EpisodeReplay(telemetry, arguments.episode)
+
+        print(f"Episode {arguments.episode}: {replay.episode['map']}, {replay.episode['outcome']} after {replay.episode['steps']} steps")
+
+        if arguments.text:
+            for step in range(len(replay)):
+                action = f", action {replay.actions[step - 1]}, reward {replay.rewards[step - 1]:.3f}" if step > 0 else ""
+                print(f"Step {step}{action}\n{replay.text(step)}\n")
+        else:
+            replay.render(arguments.interval, arguments.video)
@@ -1,11 +1,16 @@
 import argparse
-from environment import Environment
+from callbacks import AsyncCheckpointCallback, AsyncEvalCallback, CurriculumCallback, TimingCallback
+from checkpoints import CheckpointStore
+from curriculum import make_curriculum
+from environment import MAPS, UAV_VISION, Environment
+from fleet_environment import FleetEnvironment
+from map_generator import MAP_POOL, make_map_source
 import os
 from stable_baselines3 import PPO
-from stable_baselines3.common.callbacks import CallbackList
-from stable_baselines3.common.callbacks import CheckpointCallback
-from stable_baselines3.common.callbacks import EvalCallback
 from stable_baselines3.common.env_checker import check_env
+from parallel_environment import SharedMemoryVecEnv
+from stable_baselines3.common.vec_env import VecMonitor
+from vec_environment import VecEnvironment
 
 os.makedirs("models", exist_ok=True)
 os.makedirs("logs", exist_ok=True)
@@ -16,6 +21,21 @@ parser.add_argument('--timesteps', type=int, required=True)
 parser.add_argument('--grid_size', nargs='+', required=True)
 parser.add_argument('--static_obstacles', action='store_true', default=False)
 parser.add_argument('--mobile_obstacles', action='store_true', default=False)
+parser.add_argument('--map_source', type=str, default="text") # "text", "generated" or a map file from map_generator.py
+parser.add_argument('--map_pool', type=int, default=MAP_POOL) # generated maps per difficulty, 0 for a new map almost every episode
+parser.add_argument('--n_envs', type=int, default=1)
+parser.add_argument('--workers', type=int, default=1) # 0 means one worker per core
+parser.add_argument('--fleet', type=int, default=0) # UAVs flying at once in one shared airspace, instead of separate environments
+parser.add_argument('--vision', type=int, default=UAV_VISION) # odd size of the vision window
+parser.add_argument('--coarse_vision', type=int, default=0) # size of the max-pooled coarse view, 0 for none
+parser.add_argument('--coarse_pooling', type=int, default=3) # cells summarized by a coarse cell, per side
+parser.add_argument('--checkpoint_freq', type=int, default=1_000_000) # timesteps between checkpoints, saved in the background
+parser.add_argument('--keep_checkpoints', type=int, default=3) # most recent checkpoints kept, besides the best one
+parser.add_argument('--curriculum', type=str, default="steps") # "steps" (fixed step counts) or "success" (success rates)
+parser.add_argument('--eval_workers', type=int, default=1) # processes evaluating the policy snapshots while training goes on
+parser.add_argument('--eval_all_maps', action='store_true', default=False) # spreads the evaluation episodes over the 8 testing maps
+parser.add_argument('--profile', action='store_true', default=False) # times reset, step, observations and obstacles inside the environments
+parser.add_argument('--profile_window', nargs=2, type=int, default=None) # START STEPS: sampled stacks of these timesteps, for flame graphs
 
 arguments = parser.parse_args()
 
@@ -23,36 +43,90 @@ timesteps = arguments.timesteps
 grid_size = (int(arguments.grid_size[0]), int(arguments.grid_size[1]))
 static_obstacles = arguments.static_obstacles
 mobile_obstacles = arguments.mobile_obstacles
-
-environment = Environment(grid_size=grid_size,
-                          static_obstacles=static_obstacles,
-                          mobile_obstacles=mobile_obstacles)
-
-check_env(environment, warn=True)
-
-evaluate_environment = Environment(grid_size=grid_size,
-                                   static_obstacles=static_obstacles,
-                                   mobile_obstacles=mobile_obstacles,
-                                   training=False,
-                                   seed=42)
-
-evaluate_callback = EvalCallback(
-    evaluate_environment,
+map_source = make_map_source(arguments.map_source, grid_size, pool=arguments.map_pool)
+workers = arguments.workers or os.cpu_count()
+n_envs = arguments.fleet or max(arguments.n_envs, workers)
+curriculum = make_curriculum(arguments.curriculum)
+vision = {"vision": arguments.vision, "coarse_vision": arguments.coarse_vision, "coarse_pooling": arguments.coarse_pooling} # observation layout
+
+if arguments.fleet > 0: # every agent is one environment of the vectorized environment
+    environment = VecMonitor(FleetEnvironment(arguments.fleet,
+                                              grid_size=grid_size,
+                                              static_obstacles=static_obstacles,
+                                              mobile_obstacles=mobile_obstacles,
+                                              map_source=map_source,
+                                              curriculum=curriculum,
+                                              profile=arguments.profile,
+                                              **vision))
+elif workers > 1: # environments are split across worker processes writing into shared memory
+    environment = VecMonitor(SharedMemoryVecEnv(n_envs,
+                                                workers=workers,
+                                                grid_size=grid_size,
+                                                static_obstacles=static_obstacles,
+                                                mobile_obstacles=mobile_obstacles,
+                                                map_source=map_source,
+                                                curriculum=curriculum,
+                                                profile=arguments.profile,
+                                                **vision))
+elif n_envs > 1: # all environments are stepped at once as stacked arrays
+    environment = VecMonitor(VecEnvironment(n_envs,
+                                            grid_size=grid_size,
+                                            static_obstacles=static_obstacles,
+                                            mobile_obstacles=mobile_obstacles,
+                                            map_source=map_source,
+                                            curriculum=curriculum,
+                                            profile=arguments.profile,
+                                            **vision))
+else:
+    environment = Environment(grid_size=grid_size,
+                              static_obstacles=static_obstacles,
+                              mobile_obstacles=mobile_obstacles,
+                              map_source=map_source,
+                              curriculum=curriculum,
+                              profile=arguments.profile,
+                              **vision)
+
+    check_env(environment, warn=True)
+
+evaluate_environment_kwargs = {
+    "grid_size"       : grid_size,
+    "static_obstacles": static_obstacles,
+    "mobile_obstacles": mobile_obstacles,
+    "map_source"      : map_source,
+    "training"        : False,
+    **vision
+}
+
+# snapshots of the policy are evaluated in other processes, so the training never waits for them
+evaluate_callback = AsyncEvalCallback(
+    evaluate_environment_kwargs,
     best_model_save_path="./models/",
     log_path="./logs/",
-    eval_freq=100000,
+    eval_freq=max(100000 // n_envs, 1), # callbacks count vectorized steps, not timesteps
     n_eval_episodes=20,
-    deterministic=True,
-    render=False
+    seed=42,
+    workers=arguments.eval_workers,
+    map_count=MAPS if arguments.eval_all_maps else None
 )
 
-checkpoint_callback = CheckpointCallback(
-    save_freq=1_000_000,
-    save_path="./models/checkpoints/",
-    name_prefix="model"
+# weights, optimizer, replay buffer, curriculum and random states, so a training resumes where it stopped (see checkpoints.py)
+checkpoint_store = CheckpointStore("./models/checkpoints/", keep=arguments.keep_checkpoints)
+
+checkpoint_callback = AsyncCheckpointCallback(
+    checkpoint_store,
+    save_freq=max(arguments.checkpoint_freq // n_envs, 1),
+    curriculum=curriculum,
+    evaluation=evaluate_callback
 )
 
-callbacks = CallbackList([evaluate_callback, checkpoint_callback])
+curriculum_callback = CurriculumCallback(curriculum) # statistics only, its state is in the checkpoints
+
+# also logs where the time goes (environments, policy, gradient updates, each callback) under timing/
+callbacks = TimingCallback({
+    "evaluation": evaluate_callback,
+    "checkpoint": checkpoint_callback,
+    "curriculum": curriculum_callback
+}, profile_window=arguments.profile_window)
 
 if os.path.exists("models/pretrained_model.zip"):
     print("Pre-trained model found. Adaptation training starting...")
@@ -60,12 +134,20 @@ if os.path.exists("models/pretrained_model.zip"):
     model = PPO.load("models/pretrained_model", env=environment)
     model.learning_rate = 1e-5
     model.n_steps = 2048
+    model.get_env().env_method("set_curriculum_steps", model.num_timesteps) # the curriculum goes on from the steps of the loaded model
+    reset_timesteps = False
+
+elif checkpoint_store.latest() is not None:
+    print(f"Checkpoint found in {checkpoint_store.latest()}. Resuming training...")
+
+    model = checkpoint_store.load(PPO, environment, curriculum)
     reset_timesteps = False
 
-elif os.path.exists("models/last_model.zip"):
+elif os.path.exists("models/last_model.zip"): # trained before the checkpoints: only the model continues
     print("Model found. Continuing training...")
 
     model = PPO.load("models/last_model", env=environment)
+    model.get_env().env_method("set_curriculum_steps", model.num_timesteps)
     reset_timesteps = False
 
 else:
@@ -85,9 +167,13 @@ else:
 
     reset_timesteps = True
 
-model.learn(total_timesteps=timesteps,
-            callback=callbacks,
-            reset_num_timesteps=reset_timesteps,
-            tb_log_name="PPO_training")
+try:
+    model.learn(total_timesteps=timesteps,
+                callback=callbacks,
+                reset_num_timesteps=reset_timesteps,
+                tb_log_name="PPO_training")
+finally: # the worker processes and shared memory of --workers are released, even when the training fails
+    checkpoint_store.close()
+    environment.close()
 
 model.save("models/last_model")
@@ -0,0 +1,358 @@
+from curriculum import DIFFICULTIES, choose_maps, make_curriculum
+from environment import MAPS, MOVES, UAV_VISION
+from gymnasium import spaces
+from map_registry import get_registry
+from obstacle_motion import make_motion_policy, move_obstacles
+from profiling import VEC_ENVIRONMENT_PHASES, instrument
+from reachability import get_reachability
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from vision import CoarseView, summed_area_table, vision_margin
+
+class VecEnvironment(VecEnv):
+    def __init__(self, n_envs, grid_size=(10, 10), static_obstacles=False, mobile_obstacles=False, training=True, seed=None, obstacle_motion="random", map_source=None, curriculum=None, profile=False, vision=UAV_VISION, coarse_vision=0, coarse_pooling=3):
+        self.grid_size = grid_size # (height, width) or (rows, columns)
+
+        action_space = spaces.Discrete(8)
+        observation_space = spaces.Box(low=-1.0, high=1.0, shape=(2 + vision * vision + coarse_vision * coarse_vision,), dtype=np.float32)
+
+        self.render_mode = None
+        super(VecEnvironment, self).__init__(n_envs, observation_space, action_space)
+
+        self.moves = np.array(MOVES)
+        self.static_obstacles = static_obstacles
+        self.mobile_obstacles = mobile_obstacles
+        self.training = training
+        self.map_source = map_source # None uses the text maps, stacked once per difficulty
+        self.obstacle_motion = make_motion_policy(obstacle_motion, self.moves) # random walk, patrol or waypoint loop
+        self.curriculum = make_curriculum(curriculum) # difficulty of the training maps, see curriculum.py
+        self.record_episodes = True # workers of SharedMemoryVecEnv leave the recording to the main process
+
+        self.np_random = np.random.default_rng(seed)
+        self.total_steps = 0 # aggregated over all environments
+
+        self.vision = vision
+        self.margin = vision_margin(vision, coarse_vision, coarse_pooling) # see Environment
+        self.grid_coordinates = {
+            "first" : np.array([self.margin, self.margin]),
+            "last"  : np.array([self.margin + self.grid_size[0] - 1, self.margin + self.grid_size[1] - 1])
+        }
+
+        self.empty_grid = self.reset_grid()
+        self.grids = np.empty((n_envs,) + self.empty_grid.shape, dtype=np.float32)
+        self.env_indices = np.arange(n_envs)
+
+        window = np.arange(-(vision // 2), vision // 2 + 1)
+        self.window_rows = np.repeat(window, vision) # offsets of the flattened vision window
+        self.window_columns = np.tile(window, vision)
+
+        self.coarse_view = None
+
+        if coarse_vision > 0: # summed-area tables of the static obstacles, one per environment
+            self.coarse_view = CoarseView(coarse_vision, coarse_pooling, self.empty_grid.shape[1])
+            self.empty_table = summed_area_table(self.empty_grid).reshape(-1)
+            self.tables = np.empty((n_envs, len(self.empty_table)), dtype=np.int32)
+
+        self.load_maps()
+
+        self.positions = np.zeros((n_envs, 2), dtype=np.int64)
+        self.targets = np.zeros((n_envs, 2), dtype=np.int64)
+        self.current_steps = np.zeros(n_envs, dtype=np.int64)
+        self.optimal_path_lengths = np.zeros(n_envs, dtype=np.int64) # ignoring mobile obstacles
+        self.free_space = np.zeros(n_envs, dtype=np.int64)
+        self.difficulties = [None] * n_envs
+        self.map_names = [None] * n_envs
+        self.episodes = [] # (difficulty, map name, outcome) of the episodes finished in the last step
+
+        self.max_mobile_obstacles = (self.grid_size[0] * self.grid_size[1]) // 50
+        self.mobile_obstacles_positions = np.zeros((n_envs, self.max_mobile_obstacles, 2), dtype=np.int64)
+        self.mobile_obstacles_active = np.zeros((n_envs, self.max_mobile_obstacles), dtype=bool)
+
+        self.actions = np.zeros(n_envs, dtype=np.int64)
+        self.timers = instrument(self, VEC_ENVIRONMENT_PHASES) if profile else None # per-method wall time, see profiling.py
+
+
+    def reset_grid(self):
+        grid = np.ones((self.grid_size[0] + 2 * self.margin, self.grid_size[1] + 2 * self.margin), dtype=np.float32)
+        grid[self.margin:-self.margin, self.margin:-self.margin] = 0 # walls only on the borders of the map
+
+        return grid
+
+
+    def load_maps(self):
+        self.maps = {}
+
+        if not self.static_obstacles:
+            return
+
+        if self.map_source is not None:
+            if tuple(self.map_source.shape) != tuple(self.grid_size):
+                print("NO STATIC OBSTACLES: grid and obstacles map have different sizes")
+                self.static_obstacles = False
+
+            return
+
+        if self.training:
+            difficulties = DIFFICULTIES
+        else:
+            difficulties = ["testing"]
+
+        for difficulty in difficulties:
+            maps = [get_registry().select(self.training, difficulty, map_id) for map_id in range(1, MAPS + 1)]
+
+            if any(map.shape != tuple(self.grid_size) for map in maps):
+                print("NO STATIC OBSTACLES: grid and obstacles map have different sizes")
+                self.static_obstacles = False
+                self.maps = {}
+                return
+
+            self.maps[difficulty] = {
+                "maps"      : maps,
+                "grids"     : np.stack([map.get_grid(self.margin) for map in maps]),
+                "tables"    : np.stack([map.get_summed_area_table(self.margin) for map in maps]) if self.coarse_view is not None else None,
+                "free_space": np.array([map.free_space for map in maps])
+            }
+
+
+    def select_difficulty(self):
+        if not self.training:
+            return "testing"
+
+        return self.curriculum.select_difficulty(self.np_random, self.total_steps)
+
+
+    def get_curriculum_steps(self):
+        # the same methods as Environment's, so the step counter of any environment is read and set with env_method
+        return self.total_steps
+
+
+    def set_curriculum_steps(self, total_steps):
+        self.total_steps = total_steps
+
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.np_random = np.random.default_rng(self._seeds[0])
+
+        self.reset_environments(self.env_indices)
+        self._reset_seeds()
+        self._reset_options()
+
+        return self.get_observations()
+
+
+    def reset_environments(self, indices):
+        self.current_steps[indices] = 0
+
+        if self.static_obstacles:
+            maps = self.place_static_obstacles(indices)
+        else:
+            self.grids[indices] = self.empty_grid
+            self.free_space[indices] = self.grid_size[0] * self.grid_size[1]
+
+            if self.coarse_view is not None:
+                self.tables[indices] = self.empty_table
+
+        if self.mobile_obstacles:
+            self.place_mobile_obstacles(indices)
+
+        if self.static_obstacles:
+            self.reset_positions_and_targets_on_maps(indices, maps)
+        else:
+            self.reset_positions_and_targets(indices)
+
+
+    def place_static_obstacles(self, indices):
+        difficulties = [self.select_difficulty() for _ in indices]
+        maps = [None] * len(indices)
+
+        for difficulty in sorted(set(difficulties)): # environments drawing maps of the same difficulty are placed together
+            group = np.array([i for i, environment_difficulty in enumerate(difficulties) if environment_difficulty == difficulty])
+            environments = indices[group]
+
+            if self.map_source is not None:
+                for i, index in zip(group, environments):
+                    maps[i] = self.map_source.sample(self.np_random, difficulty, self.training)
+                    self.grids[index] = maps[i].get_grid(self.margin)
+                    self.free_space[index] = maps[i].free_space
+
+                    if self.coarse_view is not None:
+                        self.tables[index] = maps[i].get_summed_area_table(self.margin)
+
+                continue
+
+            stack = self.maps[difficulty]
+
+            if self.training:
+                map_ids = choose_maps(self.curriculum, self.np_random, stack["maps"], len(group))
+            else:
+                map_ids = self.np_random.integers(0, MAPS, size=len(group))
+
+            self.grids[environments] = stack["grids"][map_ids]
+            self.free_space[environments] = stack["free_space"][map_ids]
+
+            if self.coarse_view is not None:
+                self.tables[environments] = stack["tables"][map_ids]
+
+            for i, map_id in zip(group, map_ids):
+                maps[i] = stack["maps"][map_id]
+
+        for index, difficulty, map in zip(indices, difficulties, maps):
+            self.difficulties[index] = difficulty
+            self.map_names[index] = map.name
+
+        return maps
+
+
+    def place_mobile_obstacles(self, indices):
+        counts = self.free_space[indices] // 50 # good fraction of mobile obstacles
+        self.mobile_obstacles_active[indices] = np.arange(self.max_mobile_obstacles) < counts[:, np.newaxis]
+
+        for obstacle in range(self.max_mobile_obstacles):
+            pending = indices[self.mobile_obstacles_active[indices, obstacle]]
+
+            while len(pending) > 0: # rejection sampling over every environment still missing this obstacle
+                positions = self.get_random_coordinates(len(pending))
+                free = self.grids[pending, positions[:, 0], positions[:, 1]] != 1
+
+                placed = pending[free]
+                self.mobile_obstacles_positions[placed, obstacle] = positions[free]
+                self.grids[placed, positions[free, 0], positions[free, 1]] = 1
+
+                pending = pending[~free]
+
+        self.obstacle_motion.reset(self.grids, self.mobile_obstacles_positions, self.mobile_obstacles_active, self.np_random, indices)
+
+
+    def get_random_coordinates(self, size):
+        return np.stack([
+            self.np_random.integers(self.grid_coordinates["first"][0], self.grid_coordinates["last"][0] + 1, size=size),
+            self.np_random.integers(self.grid_coordinates["first"][1], self.grid_coordinates["last"][1] + 1, size=size)
+        ], axis=1)
+
+
+    def reset_positions_and_targets(self, indices):
+        pending = np.arange(len(indices))
+
+        while len(pending) > 0: # rejection sampling over every environment still missing a valid pair
+            positions = self.get_random_coordinates(len(pending))
+            targets = self.get_random_coordinates(len(pending))
+
+            environments = indices[pending]
+            valid = (np.any(positions != targets, axis=1) &
+                     (self.grids[environments, positions[:, 0], positions[:, 1]] != 1) &
+                     (self.grids[environments, targets[:, 0], targets[:, 1]] != 1))
+
+            self.positions[environments[valid]] = positions[valid]
+            self.targets[environments[valid]] = targets[valid]
+
+            pending = pending[~valid]
+
+        self.optimal_path_lengths[indices] = np.abs(self.targets[indices] - self.positions[indices]).max(axis=1) # diagonal moves cost one step
+
+
+    def reset_positions_and_targets_on_maps(self, indices, maps):
+        # same sampling as Environment: only pairs connected on the static map, with the target close to a wall 75% of the time
+        for index, map in zip(indices, maps):
+            reachability = get_reachability(map, self.margin)
+            self.positions[index], self.targets[index] = reachability.sample_pair(self.np_random, self.grids[index])
+            self.optimal_path_lengths[index] = reachability.distance(self.positions[index], self.targets[index])
+
+
+    def get_observations(self):
+        relative_positions = (self.targets - self.positions) / np.array(self.grid_size)
+        local_grids = self.grids[self.env_indices[:, np.newaxis],
+                                 self.positions[:, 0, np.newaxis] + self.window_rows,
+                                 self.positions[:, 1, np.newaxis] + self.window_columns]
+
+        observations = [relative_positions.astype(np.float32), local_grids]
+
+        if self.coarse_view is not None:
+            obstacles = self.mobile_obstacles_positions if self.mobile_obstacles else None
+            observations.append(self.coarse_view.encode(self.tables, self.positions, obstacles, self.mobile_obstacles_active))
+
+        return np.concatenate(observations, axis=1)
+
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions).reshape(self.num_envs)
+
+
+    def step_wait(self):
+        self.total_steps += self.num_envs
+        self.current_steps += 1
+
+        truncated = self.current_steps > self.grid_size[0] * self.grid_size[1] # UAV took many steps (more steps than coordinates in the grid)
+
+        next_positions = self.positions + self.moves[self.actions]
+
+        self.update_obstacles()
+
+        collided = ~truncated & (self.grids[self.env_indices, next_positions[:, 0], next_positions[:, 1]] == 1)
+        reached = ~truncated & ~collided & np.all(next_positions == self.targets, axis=1)
+        moved = ~truncated & ~collided
+
+        self.positions[moved] = next_positions[moved]
+
+        rewards = np.full(self.num_envs, -0.1, dtype=np.float32)
+        rewards[truncated | collided] = -100
+        rewards[reached] = 100
+        rewards = np.clip(rewards / 100, -1.0, 1.0)
+
+        terminated = collided | reached
+        dones = terminated | truncated
+
+        observations = self.get_observations()
+        infos = [{} for _ in range(self.num_envs)]
+
+        finished = np.flatnonzero(dones)
+        self.episodes = []
+
+        if self.static_obstacles and self.training and len(finished) > 0:
+            self.episodes = [(self.difficulties[i], self.map_names[i], "success" if reached[i] else "collision" if collided[i] else "truncation")
+                             for i in finished]
+
+            if self.record_episodes:
+                for episode in self.episodes:
+                    self.curriculum.record(*episode)
+
+        if len(finished) > 0:
+            for i in finished:
+                infos[i]["terminal_observation"] = observations[i].copy()
+                infos[i]["TimeLimit.truncated"] = bool(truncated[i] and not terminated[i])
+                infos[i]["optimal_path_length"] = int(self.optimal_path_lengths[i]) # of the finished episode, as Environment.reset returns it
+
+            self.reset_environments(finished)
+            observations[finished] = self.get_observations()[finished]
+
+        return observations, rewards, dones, infos
+
+
+    def update_obstacles(self):
+        if not self.mobile_obstacles:
+            return
+
+        # every obstacle of every environment proposes and resolves its move at once, see obstacle_motion.py
+        preferences = self.obstacle_motion.propose(self.grids, self.mobile_obstacles_positions, self.mobile_obstacles_active, self.np_random)
+        directions, moved = move_obstacles(self.grids, self.mobile_obstacles_positions, self.mobile_obstacles_active, preferences, self.moves)
+        self.obstacle_motion.update(self.mobile_obstacles_positions, self.mobile_obstacles_active, directions, moved)
+
+
+    def close(self):
+        pass
+
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,66 @@
+import numpy as np
+
+def vision_margin(vision, coarse_vision=0, coarse_pooling=1):
+    # walls padded around the map, so every window around a UAV on the map stays inside the grid
+    if vision % 2 == 0:
+        raise ValueError(f"the vision window must have an odd size, not {vision}")
+
+    return max(vision, coarse_vision * coarse_pooling) // 2
+
+
+def summed_area_table(grid):
+    # table[i, j] is the number of obstacles in grid[:i, :j], so the obstacles of any rectangle take four lookups
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(grid == 1, axis=0, dtype=np.int32), axis=1, out=table[1:, 1:])
+
+    return table
+
+
+class CoarseView:
+    # max-pooled summary of the (coarse_vision * pooling)^2 cells around a UAV: a coarse cell is 1 when any cell of its
+    # pooling x pooling block is an obstacle. Static obstacles and walls come from the summed-area table of the map (the
+    # same four lookups per coarse cell whatever the size of the area), mobile obstacles are dropped into their block
+    def __init__(self, coarse_vision, pooling, grid_width):
+        self.size = coarse_vision
+        self.pooling = pooling
+        self.radius = coarse_vision * pooling // 2
+        self.table_width = grid_width + 1
+
+        starts = np.arange(coarse_vision) * pooling - self.radius
+        rows = np.repeat(starts, coarse_vision)[np.newaxis]
+        columns = np.tile(starts, coarse_vision)[np.newaxis]
+
+        # corners of every block in a flattened table, relative to the cell of the UAV
+        self.top_left = rows * self.table_width + columns
+        self.top_right = self.top_left + pooling
+        self.bottom_left = self.top_left + pooling * self.table_width
+        self.bottom_right = self.bottom_left + pooling
+
+
+    def encode(self, tables, positions, obstacles=None, active=None):
+        # tables: flattened, (environments, table cells) or (table cells,) shared by all; positions: (environments, 2) in
+        # padded grid coordinates; obstacles: (environments, obstacles, 2) or (obstacles, 2), active: the same without the last axis
+        anchors = positions[:, 0] * self.table_width + positions[:, 1]
+
+        if tables.ndim > 1:
+            anchors = anchors + np.arange(len(positions)) * tables.shape[1]
+
+        cells = tables.reshape(-1)
+        anchors = anchors[:, np.newaxis]
+        sums = (cells[anchors + self.bottom_right] - cells[anchors + self.top_right]
+                - cells[anchors + self.bottom_left] + cells[anchors + self.top_left])
+        coarse = (sums > 0).astype(np.float32)
+
+        if obstacles is not None and obstacles.shape[-2] > 0:
+            relative = obstacles - (positions - self.radius)[:, np.newaxis] # (environments, obstacles, 2) either way
+            inside = relative.astype(np.uint64, copy=False) < self.size * self.pooling # negative offsets wrap around, one comparison per axis
+            inside = inside[..., 0] & inside[..., 1]
+
+            if active is not None:
+                inside &= active
+
+            environments, indices = np.nonzero(inside)
+            blocks = relative[environments, indices] // self.pooling
+            coarse[environments, blocks[:, 0] * self.size + blocks[:, 1]] = 1
+
+        return coarse
@@ -1,17 +1,351 @@
-import matplotlib.pyplot as plt
+import argparse
+import csv
+import matplotlib
 import numpy as np
+import os
+import re
+import struct
 
-data = np.load("./logs/evaluations.npz")
+EVALUATIONS = "evaluations.npz" # written by AsyncEvalCallback (and SB3's EvalCallback)
+EVENTS_PREFIX = "events.out.tfevents" # TensorBoard event files
+TAGS = ["rollout/ep_rew_mean", "eval/mean_reward", "eval/success_rate", "timing/steps_per_second"]
+THRESHOLD_TAG = "eval/mean_reward"
+RECORD_HEADER = struct.Struct("<QI") # length, masked CRC of the length
+Z = 1.96 # 95% confidence intervals, normal approximation
+MAX_EXPONENT = 100 # smoothing blocks keep weight ** -length below 10 ** MAX_EXPONENT
 
-timesteps = data["timesteps"]
-results = data["results"]
+def find_runs(paths):
+    # a run is a directory holding an evaluations file, event files or both
+    runs = {}
 
-mean_rewards = results.mean(axis=1)
+    def add(path):
+        directory, name = os.path.split(path)
+        run = runs.setdefault(os.path.relpath(directory or "."), {"evaluations": None, "events": []})
 
-plt.figure(figsize=(10, 5))
-plt.plot(timesteps, mean_rewards)
-plt.xlabel("Timesteps")
-plt.ylabel("Mean Reward")
-plt.title("Training Progress")
-plt.grid()
-plt.show()
\ No newline at end of file
+        if name == EVALUATIONS:
+            run["evaluations"] = path
+        elif name.startswith(EVENTS_PREFIX):
+            run["events"].append(path)
+
+    for path in paths:
+        if os.path.isfile(path):
+            add(path)
+            continue
+
+        for root, directories, files in os.walk(path):
+            directories.sort()
+
+            for file in sorted(files):
+                if file == EVALUATIONS or file.startswith(EVENTS_PREFIX):
+                    add(os.path.join(root, file))
+
+    return {label: run for label, run in sorted(runs.items())}
+
+
+def smooth(values, weight):
+    # exponential moving average with TensorBoard's debiasing, computed block by block with cumulative sums
+    # (weight ** -i grows too fast to do it in one pass over long curves)
+    values = np.asarray(values, dtype=np.float64)
+
+    if weight <= 0 or len(values) == 0:
+        return values
+
+    block = int(max(1, min(len(values), MAX_EXPONENT / max(-np.log10(weight), 1e-12))))
+    smoothed = np.empty_like(values)
+    last = 0.0
+
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = weight ** np.arange(1, len(chunk) + 1)
+        smoothed[start:start + len(chunk)] = powers * (last + (1 - weight) * np.cumsum(chunk / powers))
+        last = smoothed[start + len(chunk) - 1]
+
+    return smoothed / (1 - weight ** np.arange(1, len(values) + 1))
+
+
+def load_evaluations(path):
+    # reduced to one mean and confidence interval per evaluation as soon as it is read
+    with np.load(path) as data:
+        results = data["results"]
+        curves = {
+            "timesteps": data["timesteps"].astype(np.int64),
+            "reward"   : results.mean(axis=1),
+            "reward_ci": Z * results.std(axis=1, ddof=1) / np.sqrt(results.shape[1]) if results.shape[1] > 1 else np.zeros(len(results))
+        }
+
+        if "successes" in data.files:
+            curves["success_rate"] = data["successes"].mean(axis=1)
+
+    return curves
+
+
+def read_records(path):
+    # TFRecord framing: length, CRC, data, CRC; a run still writing may end with a partial record
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(RECORD_HEADER.size)
+
+            if len(header) < RECORD_HEADER.size:
+                return
+
+            length, _ = RECORD_HEADER.unpack(header)
+            data = file.read(length)
+
+            if len(data) < length or len(file.read(4)) < 4:
+                return
+
+            yield data
+
+
+def read_events(paths, tags):
+    # streams the event files record by record, keeping only the scalars of the selected tags
+    from tensorboard.compat.proto.event_pb2 import Event # only needed for event files
+
+    scalars = {}
+    first = last = None # (step, wall time) of the first and last summaries, for the throughput
+
+    for path in paths:
+        for record in read_records(path):
+            event = Event.FromString(record)
+
+            if not event.HasField("summary"):
+                continue
+
+            for value in event.summary.value:
+                if value.tag not in tags:
+                    continue
+
+                scalar = value.simple_value if value.HasField("simple_value") else value.tensor.float_val[0]
+                scalars.setdefault(value.tag, []).append((event.step, event.wall_time, scalar))
+
+            first = first or (event.step, event.wall_time)
+            last = (event.step, event.wall_time)
+
+    curves = {}
+
+    for tag, points in scalars.items():
+        points = np.array(points)
+        points = points[np.argsort(points[:, 0], kind="stable")] # several files of one run, or a resumed training
+        curves[tag] = {"steps": points[:, 0].astype(np.int64), "wall_times": points[:, 1], "values": points[:, 2]}
+
+    steps_per_second = np.nan
+
+    if first is not None and last[1] > first[1]:
+        steps_per_second = (last[0] - first[0]) / (last[1] - first[1])
+
+    return curves, steps_per_second
+
+
+def time_to_threshold(steps, values, threshold):
+    reached = np.flatnonzero(values >= threshold)
+
+    return steps[reached[0]] if len(reached) > 0 else None
+
+
+def group_label(label, pattern):
+    match = re.search(pattern, label) if pattern is not None else None
+
+    if match is None:
+        return label
+
+    return match.group(1) if match.groups() else match.group(0)
+
+
+def aggregate(curves):
+    # runs of one group (e.g. seeds) interpolated on the timesteps of the first run, over their common range;
+    # the confidence interval is then taken across runs
+    if len(curves) == 1:
+        return curves[0]
+
+    start = max(curve["timesteps"][0] for curve in curves)
+    end = min(curve["timesteps"][-1] for curve in curves)
+    timesteps = curves[0]["timesteps"]
+    timesteps = timesteps[(timesteps >= start) & (timesteps <= end)]
+
+    aggregated = {"timesteps": timesteps}
+
+    for key in ("reward", "success_rate"):
+        if all(key in curve for curve in curves):
+            values = np.stack([np.interp(timesteps, curve["timesteps"], curve[key]) for curve in curves])
+            aggregated[key] = values.mean(axis=0)
+
+            if key == "reward":
+                aggregated["reward_ci"] = Z * values.std(axis=0, ddof=1) / np.sqrt(len(curves))
+
+    return aggregated
+
+
+def plot_evaluations(groups, smoothing, threshold, output):
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(figsize=(10, 5))
+
+    for label, curve in groups.items():
+        if len(curve["timesteps"]) == 0:
+            continue
+
+        reward = smooth(curve["reward"], smoothing)
+        line, = axes.plot(curve["timesteps"], reward, label=label)
+        axes.fill_between(curve["timesteps"], reward - curve["reward_ci"], reward + curve["reward_ci"], color=line.get_color(), alpha=0.2)
+
+    if threshold is not None:
+        axes.axhline(threshold, color="gray", linestyle="--", linewidth=1)
+
+    axes.set_xlabel("Timesteps")
+    axes.set_ylabel("Mean Reward")
+    axes.set_title("Evaluations (95% confidence intervals)")
+    axes.grid()
+    axes.legend(fontsize="small")
+    save(figure, output, "evaluations.png")
+
+    if any("success_rate" in curve for curve in groups.values()):
+        figure, axes = plt.subplots(figsize=(10, 5))
+
+        for label, curve in groups.items():
+            if "success_rate" in curve:
+                axes.plot(curve["timesteps"], smooth(curve["success_rate"], smoothing), label=label)
+
+        axes.set_xlabel("Timesteps")
+        axes.set_ylabel("Success Rate")
+        axes.set_title("Evaluation Success Rate")
+        axes.grid()
+        axes.legend(fontsize="small")
+        save(figure, output, "success_rate.png")
+
+
+def plot_tags(events, smoothing, output):
+    import matplotlib.pyplot as plt
+
+    tags = sorted({tag for curves, _ in events.values() for tag in curves})
+
+    for tag in tags:
+        figure, axes = plt.subplots(figsize=(10, 5))
+
+        for label, (curves, _) in events.items():
+            if tag in curves:
+                curve = curves[tag]
+                line, = axes.plot(curve["steps"], smooth(curve["values"], smoothing), label=label)
+                axes.plot(curve["steps"], curve["values"], color=line.get_color(), alpha=0.2) # raw values behind
+
+        axes.set_xlabel("Timesteps")
+        axes.set_ylabel(tag)
+        axes.set_title(tag)
+        axes.grid()
+        axes.legend(fontsize="small")
+        save(figure, output, tag.replace("/", "_") + ".png")
+
+    rates = {label: rate for label, (_, rate) in events.items() if not np.isnan(rate)}
+
+    if len(rates) > 0:
+        figure, axes = plt.subplots(figsize=(10, max(2, 0.4 * len(rates) + 1)))
+        axes.barh(list(rates), list(rates.values()))
+        axes.invert_yaxis()
+        axes.set_xlabel("Timesteps per second")
+        axes.set_title("Training Throughput")
+        axes.grid(axis="x")
+        save(figure, output, "steps_per_second.png")
+
+
+def save(figure, output, name):
+    import matplotlib.pyplot as plt
+
+    if output is not None:
+        figure.tight_layout()
+        figure.savefig(os.path.join(output, name), dpi=120)
+        plt.close(figure)
+
+
+def summarize(runs, evaluations, events, smoothing, threshold):
+    rows = []
+
+    for label in runs:
+        row = {"run": label}
+
+        if label in evaluations:
+            curve = evaluations[label]
+            reward = smooth(curve["reward"], smoothing)
+
+            row["evaluations"] = len(reward)
+            row["final_reward"] = float(curve["reward"][-1]) if len(reward) > 0 else np.nan
+            row["best_reward"] = float(reward.max()) if len(reward) > 0 else np.nan
+
+            if threshold is not None:
+                row["steps_to_threshold"] = time_to_threshold(curve["timesteps"], reward, threshold)
+
+        if label in events:
+            curves, steps_per_second = events[label]
+            row["steps_per_second"] = steps_per_second
+
+            if threshold is not None and THRESHOLD_TAG in curves: # wall time from the first event to the threshold
+                curve = curves[THRESHOLD_TAG]
+                reached = np.flatnonzero(smooth(curve["values"], smoothing) >= threshold)
+
+                if len(reached) > 0:
+                    row["seconds_to_threshold"] = float(curve["wall_times"][reached[0]] - curve["wall_times"][0])
+
+        rows.append(row)
+
+    return rows
+
+
+def print_summary(rows, path=None):
+    columns = ["run", "evaluations", "final_reward", "best_reward", "steps_to_threshold", "seconds_to_threshold", "steps_per_second"]
+    columns = [column for column in columns if any(column in row for row in rows)]
+
+    print("| " + " | ".join(columns) + " |")
+
+    for row in rows:
+        values = [row.get(column) for column in columns]
+        print("| " + " | ".join("-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value) for value in values) + " |")
+
+    if path is not None:
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=columns, restval="")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('paths', nargs='*', default=["./logs"]) # evaluation files, event files or directories searched for them
+    parser.add_argument('--tags', nargs='+', default=TAGS) # TensorBoard scalars to read, the others are skipped while streaming
+    parser.add_argument('--smoothing', type=float, default=0.6) # weight of the exponential moving average, as in TensorBoard
+    parser.add_argument('--threshold', type=float, default=None) # reward for the time-to-threshold columns
+    parser.add_argument('--group', type=str, default=None) # regex on the run paths, runs with the same match (or first group) are averaged
+    parser.add_argument('--output', type=str, default="plots") # directory of the images and summary.csv
+    parser.add_argument('--show', action='store_true', default=False) # opens windows instead of writing images
+
+    arguments = parser.parse_args()
+
+    if not arguments.show:
+        matplotlib.use("Agg") # no display needed
+        os.makedirs(arguments.output, exist_ok=True)
+
+    output = None if arguments.show else arguments.output
+    runs = find_runs(arguments.paths)
+
+    if len(runs) == 0:
+        raise SystemExit(f"No {EVALUATIONS} or event files found in {', '.join(arguments.paths)}")
+
+    # every file is reduced to its curves right after it is read, so only those stay in memory
+    evaluations = {label: load_evaluations(run["evaluations"]) for label, run in runs.items() if run["evaluations"] is not None}
+    events = {label: read_events(run["events"], set(arguments.tags)) for label, run in runs.items() if len(run["events"]) > 0}
+
+    groups = {}
+
+    for label, curve in evaluations.items():
+        groups.setdefault(group_label(label, arguments.group), []).append(curve)
+
+    if len(evaluations) > 0:
+        plot_evaluations({label: aggregate(curves) for label, curves in groups.items()}, arguments.smoothing, arguments.threshold, output)
+    if len(events) > 0:
+        plot_tags(events, arguments.smoothing, output)
+
+    print_summary(summarize(runs, evaluations, events, arguments.smoothing, arguments.threshold),
+                  os.path.join(output, "summary.csv") if output is not None else None)
+
+    if arguments.show:
+        import matplotlib.pyplot as plt
+
+        plt.show()